@@ -12,26 +12,24 @@ sys.path.append(str(scripts_path.resolve()))
 # Ajouter le dossier Code au path
 sys.path.append(str(code_path.resolve()))
 
-from scripts.data_utils import import_csv_data, import_data_sig
-from scripts.map_utils import simplify_geom
+from scripts.snapshot_utils import load_or_prepare_resources
 from scripts.layout import get_layout
-from scripts.callbacks import register_callbacks
-from scripts.config import norm_map, scale_options, color_range_options, type_options, first_year, geom_simplify_tol, last_year
+from scripts.callbacks import register_callbacks, build_map_state
+from scripts.startup_utils import BackgroundLoader
+from metrics_utils import register_metrics_routes  # flat import, as in callbacks.py: same metrics registry
+from http_utils import register_http_routes
+from export_utils import register_export_routes
+from scripts.config import norm_map, scale_options, color_range_options, type_options, first_year, last_year, year_mode_options, default_year_mode, rank_by_options, rank_window_options, rank_size_options, country_level, startup_mode, snapshot_filename, profile_dir
+from scripts.config import http_compression, compression_encodings, compression_min_size, compression_levels, deterministic_outputs, callback_cache_max_age
 
-# --- Load data ---
-filename = "data_final_all_norm.csv"
-df_data = import_csv_data(base_path, filename)
-gdf_world = import_data_sig(base_path, 'world.geojson')
 
-# --- Simplify geometry ---
-gdf_world = gdf_world[gdf_world['Country_code'].notna()].copy()
-gdf_world['geometry'] = gdf_world['geometry'].apply(lambda g: simplify_geom(g, tol=geom_simplify_tol))
+def load_resources():
+    # Prepared snapshot (one file read) if built from the current data, otherwise
+    # load CSV + GeoJSON, simplify geometry and build the data store
+    return build_map_state(load_or_prepare_resources(base_path, snapshot_filename))
 
-# --- Options ---
-indicator_options = df_data['Indicator'].unique()
-database_options = df_data['Source'].unique()
-category_options = df_data['Category'].unique()  # <-- Nouveau champ
-year_options = sorted(df_data['Year'].unique())
+
+resources = BackgroundLoader(load_resources, background=(startup_mode == 'lazy'))
 
 norm_map_labels = list(norm_map.keys())
 
@@ -39,21 +37,69 @@ norm_map_labels = list(norm_map.keys())
 app = dash.Dash(__name__)
 server = app.server  # <-- Must be global, visible par Gunicorn
 
-app.title = "NetZeroVisu"
-app.layout = get_layout(
-    indicator_options, 
-    database_options, 
-    category_options,       # <-- Ajouter au layout
-    norm_map_labels, 
-    first_year, 
-    last_year, 
-    year_options, 
-    scale_options, 
-    color_range_options, 
-    type_options
+
+def serve_layout():
+    # Called on every page load: empty dropdowns (filled by the startup_poll
+    # callback) as long as the data is loading
+    ready = resources.ready()
+    state = resources.get() if ready else dict(base_figure=None, options=dict(
+        indicator=[], database=[], category=[], year=list(range(first_year, last_year + 1)), grouping=[]))
+    options = state['options']
+    return get_layout(
+        options['indicator'],
+        options['database'],
+        options['category'],       # <-- Ajouter au layout
+        norm_map_labels,
+        first_year,
+        last_year,
+        options['year'],
+        scale_options,
+        color_range_options,
+        type_options,
+        year_mode_options,
+        default_year_mode,
+        rank_by_options,
+        rank_window_options,
+        rank_size_options,
+        [country_level] + options['grouping'],
+        data_ready=ready,
+        base_figure=state['base_figure']
+    )
+
+
+@server.route("/health")
+def health():
+    # Answers as soon as the worker is up; 'status' tells whether the data is loaded.
+    # 503 once loading has failed, so the orchestrator restarts the worker
+    status = resources.status()
+    return {"status": status}, 503 if status == 'error' else 200
+
+
+# --- Stage timings (/metrics) and opt-in profiling ---
+register_metrics_routes(
+    server,
+    cache_stats=lambda: resources.get()['figure_cache'].stats() if resources.ready() else None,
+    profile_dir=profile_dir
+)
+
+# --- Compression and ETags (registered after the metrics: response sizes are the compressed ones) ---
+register_http_routes(
+    server,
+    data_version=lambda: resources.get()['figure_cache'].namespace if resources.ready() else None,
+    deterministic_outputs=deterministic_outputs,
+    encodings=compression_encodings if http_compression else (),
+    min_size=compression_min_size,
+    levels=compression_levels,
+    max_age=callback_cache_max_age
 )
 
-register_callbacks(app, df_data, gdf_world, norm_map)
+# --- Data slice of a map selection (GET /export/data) ---
+register_export_routes(server, resources, norm_map)
+
+app.title = "NetZeroVisu"
+app.layout = serve_layout
+
+register_callbacks(app, resources, norm_map)
 
 if __name__ == "__main__":
     app.run(debug=False)
@@ -0,0 +1,79 @@
+// Client-side geometry: the server sends the world map as TopoJSON (quantized,
+// shared borders stored once) and the browser converts it back to the GeoJSON
+// expected by the choropleth trace. Each topology is decoded only once.
+
+window.dash_clientside = Object.assign({}, window.dash_clientside);
+
+(function() {
+    const decoded = new WeakMap();
+
+    function decodeTopology(topology) {
+        const [sx, sy] = topology.transform.scale;
+        const [tx, ty] = topology.transform.translate;
+
+        // Delta-encoded integer arcs -> absolute coordinates
+        const arcs = topology.arcs.map(function(arc) {
+            let x = 0, y = 0;
+            return arc.map(function(point) {
+                x += point[0];
+                y += point[1];
+                return [x * sx + tx, y * sy + ty];
+            });
+        });
+
+        // ~i refers to arc i traversed backwards; consecutive arcs share their end point
+        function ring(indexes) {
+            const coords = [];
+            indexes.forEach(function(i, k) {
+                const arc = i < 0 ? arcs[~i].slice().reverse() : arcs[i];
+                coords.push.apply(coords, k ? arc.slice(1) : arc);
+            });
+            return coords;
+        }
+
+        function geometry(g) {
+            if (g.type === 'Polygon') {
+                return {type: 'Polygon', coordinates: g.arcs.map(ring)};
+            }
+            if (g.type === 'MultiPolygon') {
+                return {type: 'MultiPolygon', coordinates: g.arcs.map(p => p.map(ring))};
+            }
+            return null;
+        }
+
+        return {
+            type: 'FeatureCollection',
+            features: topology.objects.countries.geometries.map(g => ({
+                type: 'Feature', properties: g.properties, geometry: geometry(g)
+            }))
+        };
+    }
+
+    function toGeojson(topology) {
+        if (!decoded.has(topology)) {
+            decoded.set(topology, decodeTopology(topology));
+        }
+        return decoded.get(topology);
+    }
+
+    window.dash_clientside.geometry = {
+        decodeTopology: decodeTopology,
+
+        // Map figure = figure computed by the server + decoded geometry
+        render_map: function(figure, topology, current) {
+            const no_update = window.dash_clientside.no_update;
+            if (!topology) {
+                return no_update;
+            }
+            const triggered = window.dash_clientside.callback_context.triggered;
+            const geometryOnly = triggered.every(t => t.prop_id === 'geo_topology.data');
+            // A new level of detail keeps the map as displayed (e.g. a year swapped in the browser)
+            const base = geometryOnly && current && current.data ? current : figure;
+            if (!base || !base.data) {
+                return no_update;
+            }
+            const trace = Object.assign({}, base.data[0], {geojson: toGeojson(topology)});
+            return Object.assign({}, base, {data: [trace].concat(base.data.slice(1))});
+        }
+    };
+})();
@@ -0,0 +1,372 @@
+"""
+Benchmark suite of the dashboard hot paths, on a synthetic dataset scaled to
+1x, 10x or 100x the current size (number of raw sources of config.raw_sources,
+200 countries, 64 years).
+
+For each step: latency percentiles, peak Python memory (tracemalloc, one extra
+call: NumPy / pandas buffers included, Arrow memory pool not) and, for the
+callbacks, the size of the JSON sent to the browser.
+The callbacks are the ones registered on a Dash app by register_callbacks,
+called directly with the prepared data.
+
+Usage (from Code/):
+    python benchmarks/bench_app.py                                    # scales 1 and 10
+    python benchmarks/bench_app.py --scales 1 10 100 --save benchmarks/baseline.json
+    python benchmarks/bench_app.py --compare benchmarks/baseline.json # exit code 1 on regression
+
+The 100x scale needs about 4 GB of memory and several minutes.
+"""
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str((Path(__file__).parent.parent / "scripts").resolve()))
+
+import dash
+from plotly.io.json import to_json_plotly
+
+from config import (norm_map, norm_specs, raw_sources, geom_lod_levels, geom_quantization, scale_options,
+                    color_range_options, country_level, aggregate_ratio_columns)
+from data_utils import (import_csv_data, import_data_sig, build_columnar_data, concat_intermediate_files,
+                        import_countries_data, import_country_groups)
+from aggregate_utils import build_membership, build_norm_inputs, build_aggregates
+from map_utils import build_geometry_levels, build_topojson
+from snapshot_utils import prepare_resources, write_snapshot, load_snapshot
+from callbacks import register_callbacks, build_map_state
+from cache_utils import FigureCache
+from startup_utils import BackgroundLoader
+
+N_COUNTRIES = 200
+YEARS = np.arange(1960, 2024)
+
+# Compared with the baseline only above these values (below, the ratio is noise)
+COMPARED_METRICS = {"p50": 0.1, "peak_mb": 1.0, "payload_bytes": 1000}
+
+
+# -----------------------------
+# Synthetic dataset
+# -----------------------------
+def _jagged_edge(p0, p1, n_points, rng, amplitude):
+    """
+    Densified segment p0 -> p1, bent by a few random waves plus small noise
+    across it (end points kept). The offset is a function of the position
+    along the segment, so the border never crosses itself.
+    """
+    t = np.linspace(0, 1, n_points + 2)
+    waves = sum(rng.uniform(-1, 1) / k * np.sin(np.pi * k * t) for k in range(1, 5))
+    offset = amplitude * (waves + rng.normal(scale=0.02, size=len(t)))
+    offset[[0, -1]] = 0
+    normal = np.array([p0[1] - p1[1], p1[0] - p0[0]]) / np.hypot(*(p1 - p0))
+    return p0 + t[:, None] * (p1 - p0) + offset[:, None] * normal
+
+
+def make_world(base_path, n_countries=N_COUNTRIES, points_per_edge=50, seed=0):
+    """
+    Grid of countries with jagged shared borders -> Data/SIG/world.geojson.
+    Returns the country codes.
+    """
+    rng = np.random.default_rng(seed)
+    n_cols = int(np.ceil(np.sqrt(n_countries * 2)))
+    n_rows = int(np.ceil(n_countries / n_cols))
+    lons = np.linspace(-180, 180, n_cols + 1)
+    lats = np.linspace(-60, 80, n_rows + 1)
+    amplitude = 0.05 * min(lons[1] - lons[0], lats[1] - lats[0])
+
+    # One polyline per grid edge, shared by the two cells it separates
+    h_edges = {(i, j): _jagged_edge(np.array([lons[j], lats[i]]), np.array([lons[j + 1], lats[i]]),
+                                    points_per_edge, rng, amplitude)
+               for i in range(n_rows + 1) for j in range(n_cols)}
+    v_edges = {(i, j): _jagged_edge(np.array([lons[j], lats[i]]), np.array([lons[j], lats[i + 1]]),
+                                    points_per_edge, rng, amplitude)
+               for i in range(n_rows) for j in range(n_cols + 1)}
+
+    codes, features = [], []
+    for k in range(n_countries):
+        i, j = divmod(k, n_cols)
+        ring = np.concatenate([h_edges[i, j], v_edges[i, j + 1][1:], h_edges[i + 1, j][::-1][1:],
+                               v_edges[i, j][::-1][1:]])
+        code = f"C{k:03d}"
+        codes.append(code)
+        features.append({"type": "Feature", "properties": {"Country_code": code, "name": f"Country {k}"},
+                         "geometry": {"type": "Polygon", "coordinates": [ring.round(5).tolist()]}})
+
+    path = base_path / "Data" / "SIG" / "world.geojson"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": features}), encoding="utf-8")
+    return codes
+
+
+def make_countries(base_path, codes, seed=0):
+    """
+    Denominators of the normalizations -> Data/countries/countries_area.csv.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(codes) * len(YEARS)
+    df = pd.DataFrame({"countryiso3": np.repeat(codes, len(YEARS)), "Year": np.tile(YEARS, len(codes))})
+    df["population_total"] = rng.lognormal(16, 1.5, n)
+    df["gdp_current_usd"] = df["population_total"] * rng.lognormal(8.5, 1, n)
+    df["gdp_ppp_current_intl"] = df["gdp_current_usd"] * rng.uniform(1, 3, n)
+    df["surface_km2"] = np.repeat(rng.lognormal(11, 2, len(codes)), len(YEARS))
+    path = base_path / "Data" / "countries" / "countries_area.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False)
+
+    # Regional aggregates: 6 'continents' and one custom list
+    groups = pd.DataFrame({"Grouping": "Continent", "Group": [f"Region {i % 6}" for i in range(len(codes))],
+                           "Country_code": codes})
+    custom = pd.DataFrame({"Grouping": "Custom", "Group": "Group A", "Country_code": codes[::7]})
+    pd.concat([groups, custom]).to_csv(path.with_name("country_groups.csv"), index=False)
+
+
+def make_dataset(base_path, codes, scale=1, seed=0):
+    """
+    One intermediate CSV per synthetic source (len(raw_sources) x scale sources)
+    in Data/data_intermediate, and the final dataset (CSV + .feather) in Data/data_final.
+    Returns the number of rows of the final dataset.
+    """
+    rng = np.random.default_rng(seed)
+    intermediate_dir = base_path / "Data" / "data_intermediate"
+    intermediate_dir.mkdir(parents=True, exist_ok=True)
+
+    frames = []
+    for s in range(len(raw_sources) * scale):
+        spec = raw_sources[s % len(raw_sources)]
+        df = pd.DataFrame({"Year": np.repeat(YEARS, len(codes)), "Country": np.tile(codes, len(YEARS))})
+        values = rng.lognormal(12, 2.5, len(df)) * (rng.choice([-1, 1], len(df)) if spec["category"] == "LULUCF" else 1)
+        values[rng.random(len(df)) < 0.15] = np.nan  # missing years / countries
+        df["Value"] = values
+        df["Unit"] = "tC"
+        df["Category"] = spec["category"]
+        df["Indicator"] = f"{spec['indicator']} {s // len(raw_sources)}" if s >= len(raw_sources) else spec["indicator"]
+        df["Source"] = spec["source"]
+        df["Country_code"] = df["Country"]
+        df.to_csv(intermediate_dir / f"synthetic_{s:04d}.csv", index=False)
+        frames.append(df.assign(Type="Annual"))  # as run_pipeline: cumulative computed by the app
+
+    df_final = pd.concat(frames, ignore_index=True)
+    final_dir = base_path / "Data" / "data_final"
+    final_dir.mkdir(parents=True, exist_ok=True)
+    df_final.to_csv(final_dir / "data_final_all.csv", index=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_columnar_data(base_path, "data_final_all.csv", df=df_final)
+    os.link(final_dir / "data_final_all.csv", final_dir / "data_csv_only.csv")  # same data, no .feather
+    return len(df_final)
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+def measure(func, calls, repeat=1, payload=False):
+    """
+    Run `func(*args)` for every args of `calls`, `repeat` times.
+
+    Retour
+    ------
+    (dict with the latency percentiles (ms), the peak traced memory of one call
+    (MB) and, if `payload`, the mean size of the JSON of the outputs (bytes),
+    output of the last call)
+    """
+    timings, sizes = [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for args in calls:
+                t0 = time.perf_counter()
+                output = func(*args)
+                timings.append(time.perf_counter() - t0)
+                if payload:
+                    sizes.append(len(to_json_plotly(output)))
+
+        # Memory measured apart: tracemalloc slows every allocation down
+        tracemalloc.start()
+        func(*calls[0])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    ms = np.array(timings) * 1e3
+    result = dict(n=len(ms), p50=np.percentile(ms, 50), p95=np.percentile(ms, 95), p99=np.percentile(ms, 99),
+                  mean=ms.mean(), peak_mb=peak / 1e6)
+    if payload:
+        result["payload_bytes"] = float(np.mean(sizes))
+    return {k: float(v) if k != "n" else v for k, v in result.items()}, output
+
+
+def find_callback(app, output):
+    """
+    Function registered for `output` (e.g. 'map_figure.data'), without the Dash wrapper.
+    """
+    for key, entry in app.callback_map.items():
+        if output in key.strip(".").split("..."):
+            return getattr(entry["callback"], "__wrapped__", entry["callback"])
+    raise KeyError(output)
+
+
+def bench_scale(base_path, scale, n_calls, seed=0):
+    """
+    All the benchmarks of one scale of the synthetic dataset.
+    """
+    results = {}
+    t0 = time.perf_counter()
+    codes = make_world(base_path, seed=seed)  # the countries do not change with the data size
+    make_countries(base_path, codes, seed=seed)
+    n_rows = make_dataset(base_path, codes, scale, seed=seed)
+    print(f"\n--- scale {scale}x: {n_rows:,} rows, {len(codes)} countries "
+          f"(generated in {time.perf_counter() - t0:.1f} s) ---")
+
+    def run(name, func, calls, repeat=1, payload=False):
+        results[name], output = measure(func, calls, repeat, payload)
+        print_result(name, results[name])
+        return output
+
+    # --- Loading and preparation ---
+    run("import_csv_data[feather]", import_csv_data, [(base_path, "data_final_all.csv")], repeat=3)
+    run("import_csv_data[csv]", import_csv_data, [(base_path, "data_csv_only.csv")], repeat=3)
+    run("import_data_sig", import_data_sig, [(base_path, "world.geojson")], repeat=3)
+
+    gdf_world = import_data_sig(base_path, "world.geojson")
+    tolerances = [tol for _, tol in geom_lod_levels]
+    gdf_levels = run("build_geometry_levels", build_geometry_levels, [(gdf_world, tolerances)], repeat=3)
+    run("build_topojson", lambda: [build_topojson(gdf, quantization=geom_quantization) for gdf in gdf_levels.values()],
+        [()], repeat=3)
+
+    run("concat_intermediate_files", concat_intermediate_files,
+        [(base_path, "data_intermediate", "data_final", "concat.csv")])
+    run("concat_intermediate_files[streaming]",
+        lambda: concat_intermediate_files(base_path, final_filename="concat_stream.csv", streaming=True), [()])
+
+    resources = run("prepare_resources", prepare_resources, [(base_path,)])
+    snapshot_path = base_path / "Data" / "data_final" / "app_snapshot.pkl"
+    write_snapshot(resources, snapshot_path, "bench")
+    run("load_snapshot", load_snapshot, [(snapshot_path,)], repeat=3)
+
+    cube = resources['cube']
+    membership = build_membership(import_country_groups(base_path), cube['countries'])
+    norm_inputs = build_norm_inputs(import_countries_data(base_path), norm_specs, aggregate_ratio_columns,
+                                    cube['countries'], cube['years'])
+    def aggregate(cube, cache=None):
+        return build_aggregates(cube, membership, norm_inputs, dict(cache or {}))
+    run("build_aggregates", aggregate, [(cube,)], repeat=3)
+    first_key = next(iter(cube['matrices']))
+    changed = dict(cube, matrices={**cube['matrices'], first_key: {'Value': cube['matrices'][first_key]['Value'] * 1.01}})
+    run("build_aggregates[incremental]", aggregate, [(changed, aggregate(cube)[1])], repeat=3)
+
+    # --- Callbacks, called as registered on the app ---
+    state = build_map_state(resources)
+    state['figure_cache'] = FigureCache(0)  # every call renders
+    app = dash.Dash(__name__)
+    register_callbacks(app, BackgroundLoader(lambda: state, background=False), norm_map)
+
+    rng = np.random.default_rng(seed)
+    keys = list(state['cube']['matrices']) + state['cube']['cumulative_keys']
+    selections = [keys[i] for i in rng.integers(len(keys), size=n_calls)]
+    years = rng.choice(state['cube']['years'], size=n_calls)
+    scales = rng.choice(scale_options, size=n_calls)
+    ranges = rng.choice(color_range_options, size=n_calls)
+    norms = rng.choice(list(norm_map), size=n_calls)
+
+    update_map = find_callback(app, "map_figure.data")
+    map_calls = [(c, i, s, t, int(y), sc, cr, nm, country_level, None, int(y))
+                 for (c, i, s, t), y, sc, cr, nm in zip(selections, years, scales, ranges, norms)]
+    run("update_map", update_map, map_calls, payload=True)
+    run("update_map[regions]", update_map, [call[:8] + ("Continent",) + call[9:] for call in map_calls], payload=True)
+    run("update_map[cumulative since 1990]", update_map,
+        [call[:3] + ("Cumulative",) + call[4:9] + (1990,) + call[10:] for call in map_calls], payload=True)
+
+    state['figure_cache'] = FigureCache(n_calls)
+    run("update_map[cached]", update_map, map_calls, repeat=2, payload=True)
+    state['figure_cache'] = FigureCache(0)
+
+    frames_calls = [(c, i, s, t, sc, cr, nm, country_level, None, "client")
+                    for (c, i, s, t), sc, cr, nm in list(zip(selections, scales, ranges, norms))[:max(n_calls // 10, 1)]]
+    run("update_year_frames", find_callback(app, "year_frames.data"), frames_calls, payload=True)
+
+    run("update_indicator_dropdown", find_callback(app, "indicator.options"),
+        [(c,) for c, _, _, _ in selections], payload=True)
+    run("update_database_dropdown", find_callback(app, "database.options"),
+        [(i,) for _, i, _, _ in selections], payload=True)
+    run("update_geo_topology", find_callback(app, "geo_topology.data"),
+        [(tol, True) for tol in tolerances], payload=True)
+
+    # Whole process (Arrow buffers included), highest value since the start of the run
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    results["peak_rss"] = dict(peak_mb=rss)
+    print(f"{'peak RSS of the process':>38}: {rss:.0f} MB")
+
+    for path in (base_path / "Data").rglob("*"):  # next scale starts from scratch
+        if path.is_file():
+            path.unlink()
+    return results
+
+
+# -----------------------------
+# Report
+# -----------------------------
+def print_result(name, r):
+    payload = f" | {r['payload_bytes'] / 1e3:9.1f} kB" if "payload_bytes" in r else ""
+    print(f"{name:>38}: p50 {r['p50']:9.2f} ms | p95 {r['p95']:9.2f} ms | p99 {r['p99']:9.2f} ms "
+          f"| peak {r['peak_mb']:8.1f} MB{payload}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the ratio new / baseline of p50, peak memory and payload (see COMPARED_METRICS).
+    Returns the benchmarks slower (or bigger) than baseline x (1 + tolerance).
+    """
+    regressions = []
+    print(f"\n--- comparison with the baseline (tolerance {tolerance:.0%}) ---")
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:>44}: new")
+            continue
+        ratios = {metric: r[metric] / base[metric] for metric, floor in COMPARED_METRICS.items()
+                  if metric in r and base.get(metric, 0) >= floor}
+        worse = [m for m, ratio in ratios.items() if ratio > 1 + tolerance]
+        if worse:
+            regressions.append(name)
+        print(f"{name:>44}: " + (" | ".join(f"{m} x{ratio:.2f}" for m, ratio in ratios.items()) or "too small to compare")
+              + ("  <-- REGRESSION" if worse else ""))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10], help="dataset sizes (x current)")
+    parser.add_argument("--calls", type=int, default=200, help="callback calls per benchmark")
+    parser.add_argument("--save", type=Path, default=None, help="write the results (JSON) to this file")
+    parser.add_argument("--compare", type=Path, default=None, help="baseline written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a regression")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="netzero-bench-") as tmp:
+        for scale in args.scales:
+            for name, r in bench_scale(Path(tmp), scale, args.calls, args.seed).items():
+                results[f"{name}@{scale}x"] = r
+
+    if args.save:
+        meta = dict(python=platform.python_version(), machine=platform.machine(), cpus=os.cpu_count(),
+                    date=time.strftime("%Y-%m-%d %H:%M:%S"), pandas=pd.__version__, dash=dash.__version__)
+        args.save.write_text(json.dumps({"meta": meta, "results": results}, indent=2), encoding="utf-8")
+        print(f"\nRésultats sauvegardés dans {args.save}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))["results"]
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark: boolean filtering of df_data vs lookup in the indexed cube.
+
+Usage (from Code/):
+    python benchmarks/bench_cube_lookup.py                # synthetic data
+    python benchmarks/bench_cube_lookup.py --csv ../Data/data_final/data_final_all_norm.csv
+"""
+from pathlib import Path
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str((Path(__file__).parent.parent / "scripts").resolve()))
+
+from config import norm_map
+from cube_utils import build_data_cube, cube_lookup
+
+
+def make_synthetic_data(n_countries=200, n_years=64, n_indicators=9, seed=0):
+    """
+    Long-format DataFrame with the same columns as data_final_all_norm.csv.
+    """
+    rng = np.random.default_rng(seed)
+    countries = [f"C{i:03d}" for i in range(n_countries)]
+    years = np.arange(1960, 1960 + n_years)
+    frames = []
+    for i in range(n_indicators):
+        for type_value in ["Annual", "Cumulative"]:
+            df = pd.DataFrame({
+                "Year": np.repeat(years, n_countries),
+                "Country": np.tile(countries, n_years),
+                "Country_code": np.tile(countries, n_years),
+            })
+            df["Category"] = "LULUCF" if i % 2 else "Fossil Fuel"
+            df["Indicator"] = f"Indicator {i}"
+            df["Source"] = "GCB"
+            df["Type"] = type_value
+            for col_value, col_unit in norm_map.values():
+                df[col_value] = rng.normal(size=len(df)) * 1e6
+                df[col_unit] = "tC"
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def time_calls(func, selections, repeat):
+    timings = []
+    for _ in range(repeat):
+        for sel in selections:
+            t0 = time.perf_counter()
+            func(*sel)
+            timings.append(time.perf_counter() - t0)
+    return np.array(timings) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", type=Path, default=None, help="real dataset instead of synthetic data")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    df_data = pd.read_csv(args.csv) if args.csv else make_synthetic_data()
+    print(f"{len(df_data):,} rows")
+
+    t0 = time.perf_counter()
+    cube = build_data_cube(df_data, norm_map)
+    print(f"cube build: {(time.perf_counter() - t0) * 1e3:.1f} ms ({len(cube['matrices'])} selections)")
+
+    col_value = "Value"
+    years = cube['years']
+    selections = [key + (years[i % len(years)],) for i, key in enumerate(cube['matrices'])]
+
+    def boolean_filter(category, indicator, source, type_value, year):
+        return df_data[
+            (df_data['Category'] == category) &
+            (df_data['Indicator'] == indicator) &
+            (df_data['Source'] == source) &
+            (df_data['Type'] == type_value) &
+            (df_data['Year'] == year)
+        ].copy()[col_value]
+
+    def lookup(category, indicator, source, type_value, year):
+        return cube_lookup(cube, (category, indicator, source, type_value), col_value, year)
+
+    for name, func in [("boolean filter", boolean_filter), ("cube lookup", lookup)]:
+        ms = time_calls(func, selections, args.repeat)
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        print(f"{name:>15}: p50 {p50:.4f} ms | p95 {p95:.4f} ms | p99 {p99:.4f} ms")
+
+
+if __name__ == "__main__":
+    main()
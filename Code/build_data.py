@@ -0,0 +1,167 @@
+from pathlib import Path
+import argparse
+import gzip
+import json
+import sys
+import time
+
+# Root of project (NetZero)
+base_path = Path(__file__).parent.parent
+sys.path.append(str((Path(__file__).parent / "scripts").resolve()))
+
+from data_utils import build_columnar_data, import_data_sig
+from map_utils import build_geometry_levels, build_geojson, build_topojson
+from pipeline_utils import load_country_codes, run_pipeline
+from snapshot_utils import prepare_resources, snapshot_inputs_key, write_snapshot
+from wdi_utils import WDI_BASE, fetch_indicators, build_countries_table
+from excel_utils import convert_workbooks
+from snapshot_utils import load_or_prepare_resources
+from callbacks import build_map_state
+from export_utils import (EXPORT_FORMATS, RENDER_FORMATS, ANIMATION_FORMATS, parse_years, selection_slice, write_slice,
+                          export_filename, render_maps)
+from config import (geom_lod_levels, geom_quantization, raw_sources, raw_unit, manual_country_codes, norm_specs,
+                    snapshot_filename, wdi_indicators, wdi_first_year, wdi_last_year, wdi_cache_dir,
+                    excel_cache_folder, gcb_folder, norm_map, country_level)
+
+
+def geometry_report(filename="world.geojson"):
+    """
+    Payload size of the map geometry for each level of detail:
+    GeoJSON (as sent before) vs quantized TopoJSON, raw and gzip-compressed.
+    """
+    gdf_world = import_data_sig(base_path, filename)
+    gdf_world = gdf_world[gdf_world['Country_code'].notna()].copy()
+    gdf_levels = build_geometry_levels(gdf_world, [tol for _, tol in geom_lod_levels])
+
+    print(f"{'tolerance':>9} | {'GeoJSON':>10} | {'gzip':>9} | {'TopoJSON':>10} | {'gzip':>9} | ratio")
+    for tol, gdf in gdf_levels.items():
+        geojson = json.dumps(build_geojson(gdf), separators=(",", ":")).encode("utf-8")
+        topojson = json.dumps(build_topojson(gdf, quantization=geom_quantization), separators=(",", ":")).encode("utf-8")
+        print(f"{tol:>9} | {len(geojson):>10,} | {len(gzip.compress(geojson)):>9,} | "
+              f"{len(topojson):>10,} | {len(gzip.compress(topojson)):>9,} | {len(geojson) / len(topojson):.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build steps for the NetZero data files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_columnar = subparsers.add_parser("columnar", help="write the .feather version of the final CSV")
+    p_columnar.add_argument("--filename", default="data_final_all.csv")
+
+    p_pipeline = subparsers.add_parser("pipeline", help="raw tables -> data_intermediate -> final dataset")
+    p_pipeline.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    p_pipeline.add_argument("--force", action="store_true", help="reprocess every source, even unchanged ones")
+    p_pipeline.add_argument("--norm-columns", action="store_true",
+                            help="also write data_final_all_norm.csv with the Value_norm_* columns (notebooks)")
+
+    p_snapshot = subparsers.add_parser("snapshot", help="write the startup snapshot loaded by app.py")
+    p_snapshot.add_argument("--filename", default="data_final_all.csv")
+    p_snapshot.add_argument("--output", default=snapshot_filename, help="file name in Data/data_final")
+
+    p_wdi = subparsers.add_parser("wdi", help="download the normalization denominators from the World Bank WDI API")
+    p_wdi.add_argument("--output", default="countries_area.csv", help="file name in Data/countries")
+    p_wdi.add_argument("--workers", type=int, default=8, help="simultaneous requests")
+    p_wdi.add_argument("--per-page", type=int, default=1000)
+    p_wdi.add_argument("--max-age", type=float, default=None, help="refetch cached pages older than this (days)")
+    p_wdi.add_argument("--base-url", default=WDI_BASE)
+
+    p_excel = subparsers.add_parser("excel", help="convert the sheets of the Excel workbooks to the sheet cache")
+    p_excel.add_argument("--folder", default=gcb_folder, help="folder of the workbooks in Data/")
+    p_excel.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+
+    # --- Exports of one map selection (same inputs as the dashboard) ---
+    selection_parser = argparse.ArgumentParser(add_help=False)
+    selection_parser.add_argument("--category", required=True)
+    selection_parser.add_argument("--indicator", required=True)
+    selection_parser.add_argument("--database", required=True)
+    selection_parser.add_argument("--type", default="Annual")
+    selection_parser.add_argument("--normalization", default=next(iter(norm_map)))
+    selection_parser.add_argument("--aggregate", default=country_level, help="grouping of the regional aggregates")
+    selection_parser.add_argument("--cumulative-start", type=int, default=None)
+    selection_parser.add_argument("--years", default="all", help='"1990-2020", "2020" or "all"')
+    selection_parser.add_argument("--output-dir", default=str(base_path / "exports"))
+
+    p_export = subparsers.add_parser("export", parents=[selection_parser], help="write the data slice of one map selection")
+    p_export.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+
+    p_render = subparsers.add_parser("render", parents=[selection_parser], help="render the map of every year of a range")
+    p_render.add_argument("--format", choices=RENDER_FORMATS, default="html")
+    p_render.add_argument("--animation", action="store_true",
+                          help=f"one animated file instead of one file per year ({', '.join(ANIMATION_FORMATS)})")
+    p_render.add_argument("--scale", default="relative")
+    p_render.add_argument("--color-range", default="raw")
+    p_render.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    p_render.add_argument("--level", type=float, default=None, choices=[tol for _, tol in geom_lod_levels],
+                          help="geometry tolerance (default: the coarsest, as the dashboard opens)")
+    p_render.add_argument("--width", type=int, default=1600)
+    p_render.add_argument("--height", type=int, default=900)
+
+    p_geometry = subparsers.add_parser("geometry", help="report the map geometry payload (GeoJSON vs TopoJSON)")
+    p_geometry.add_argument("--filename", default="world.geojson")
+
+    args = parser.parse_args()
+    if args.command == "render" and args.animation and args.format not in ANIMATION_FORMATS:
+        parser.error(f"--animation writes one {' or '.join(ANIMATION_FORMATS)} file, not {args.format}")
+
+    if args.command == "columnar":
+        build_columnar_data(base_path, args.filename)
+    elif args.command == "pipeline":
+        t0 = time.perf_counter()
+        country_codes = load_country_codes(base_path, manual_country_codes)
+        report = run_pipeline(base_path, raw_sources, country_codes, norm_specs if args.norm_columns else None,
+                              workers=args.workers, force=args.force, unit=raw_unit,
+                              excel_cache_dir=base_path / "Data" / excel_cache_folder)
+        for name, countries in report["unmatched"].items():
+            print(f"{name}: {len(countries)} pays sans Country_code ignorés ({', '.join(countries)})")
+        print(f"{len(report['processed'])} sources traitées, {len(report['skipped'])} inchangées, "
+              f"fichiers finaux : {', '.join(report['final']) or 'inchangés'} ({time.perf_counter() - t0:.1f} s)")
+    elif args.command == "snapshot":
+        t0 = time.perf_counter()
+        snapshot_path = base_path / "Data" / "data_final" / args.output
+        resources = prepare_resources(base_path, args.filename)
+        content_hash = write_snapshot(resources, snapshot_path, snapshot_inputs_key(base_path, args.filename))
+        print(f"Snapshot {snapshot_path} ({snapshot_path.stat().st_size / 1e6:.1f} Mo, version {content_hash}) "
+              f"écrit en {time.perf_counter() - t0:.1f} s")
+    elif args.command == "wdi":
+        t0 = time.perf_counter()
+        countries_dir = base_path / "Data" / "countries"
+        df_long = fetch_indicators(wdi_indicators, wdi_first_year, wdi_last_year, base_url=args.base_url,
+                                   per_page=args.per_page, workers=args.workers, cache_dir=countries_dir / wdi_cache_dir,
+                                   max_age=args.max_age * 86400 if args.max_age is not None else None)
+        table = build_countries_table(df_long, list(wdi_indicators.values()), wdi_first_year, wdi_last_year)
+        table.to_csv(countries_dir / args.output, index=False, encoding="utf-8")
+        print(f"{countries_dir / args.output} : {len(table):,} lignes, {table['countryiso3'].nunique()} pays "
+              f"({time.perf_counter() - t0:.1f} s)")
+    elif args.command == "excel":
+        t0 = time.perf_counter()
+        workbooks = sorted((base_path / "Data" / args.folder).glob("*.xlsx"))
+        converted, cached = convert_workbooks(workbooks, base_path / "Data" / excel_cache_folder, args.workers)
+        print(f"{len(workbooks)} classeurs : {converted} feuilles converties, {cached} déjà en cache "
+              f"({time.perf_counter() - t0:.1f} s)")
+    elif args.command in ("export", "render"):
+        t0 = time.perf_counter()
+        state = build_map_state(load_or_prepare_resources(base_path, snapshot_filename))
+        years = parse_years(args.years, state['cube']['years'])
+        out_dir = Path(args.output_dir)
+        if args.command == "export":
+            df = selection_slice(state, norm_map, args.category, args.indicator, args.database, args.type,
+                                 args.normalization, args.aggregate, args.cumulative_start, years)
+            path = out_dir / export_filename(args.category, args.indicator, args.database, args.type,
+                                             args.normalization, years, args.format)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(write_slice(df, args.format))
+            print(f"{path} : {len(df):,} lignes ({time.perf_counter() - t0:.1f} s)")
+        else:
+            selection = dict(category=args.category, indicator=args.indicator, database=args.database,
+                             type_value=args.type, scale=args.scale, color_range=args.color_range,
+                             normalization=args.normalization, aggregate=args.aggregate,
+                             cumulative_start=args.cumulative_start)
+            paths = render_maps(state, norm_map, selection, years, out_dir, args.format, args.animation,
+                                args.workers, level=args.level, width=args.width, height=args.height)
+            print(f"{len(paths)} fichier(s) dans {out_dir} ({len(years)} années, {time.perf_counter() - t0:.1f} s)")
+    elif args.command == "geometry":
+        geometry_report(args.filename)
+
+
+if __name__ == "__main__":
+    main()
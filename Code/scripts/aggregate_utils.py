@@ -0,0 +1,266 @@
+import hashlib
+import pickle
+import numpy as np
+from norm_utils import build_denominators, norm_columns, normalize
+from cube_utils import CUMULATIVE_TYPE, cached_result, cumulative_values, start_position
+
+# Country values rolled up to groups of countries (continents, custom lists...,
+# see data_utils.import_country_groups) for every selection and year.
+# Membership is a sparse group x country matrix in CSR form (indptr, indices):
+# the total of a group is a sum over the columns of its members (np.add.reduceat).
+# A normalized total is the sum of the values over the sum of the denominators
+# of the same countries (those reporting both), not a mean of the country ratios.
+# Results are kept by content hash of their inputs: when one input changes
+# (one source, the denominators, the groups), only what depends on it is recomputed.
+
+
+def build_membership(df_groups, countries, world_group="World"):
+    """
+    Sparse membership of the countries of the cube in each group.
+
+    Paramètres
+    ----------
+    df_groups : pd.DataFrame
+        Colonnes Grouping, Group, Country_code (voir data_utils.import_country_groups)
+    countries : np.ndarray
+        Axe des pays du cube
+    world_group : str, optionnel
+        Nom du groupe de tous les pays (None : pas de groupe monde)
+
+    Retour
+    ------
+    dict with keys:
+    - 'groups' : [(grouping, group)], one per row of the matrix
+    - 'groupings' : {grouping: positions of its groups}
+    - 'indptr', 'indices' : CSR arrays (members of group i: indices[indptr[i]:indptr[i + 1]])
+    - 'version' : hash of the membership
+    """
+    country_pos = {code: i for i, code in enumerate(countries)}
+    members = {}
+    if world_group:
+        members[(world_group, world_group)] = list(range(len(countries)))
+    for grouping, group, code in df_groups[['Grouping', 'Group', 'Country_code']].itertuples(index=False):
+        if code in country_pos:
+            members.setdefault((grouping, group), []).append(country_pos[code])
+
+    groups = list(members)
+    indices = [np.unique(members[g]) for g in groups]
+    indptr = np.concatenate([[0], np.cumsum([len(i) for i in indices])]).astype(np.int64)
+    indices = np.concatenate(indices).astype(np.int64) if indices else np.zeros(0, dtype=np.int64)
+
+    groupings = {}
+    for i, (grouping, _) in enumerate(groups):
+        groupings.setdefault(grouping, []).append(i)
+
+    version = hashlib.sha1(repr(groups).encode("utf-8") + indptr.tobytes() + indices.tobytes()
+                           + np.asarray(countries).astype(str).tobytes())
+    return {
+        'groups': groups,
+        'groupings': {k: np.array(v) for k, v in groupings.items()},
+        'indptr': indptr,
+        'indices': indices,
+        'version': version.hexdigest()[:16],
+    }
+
+
+def group_sums(matrix, membership):
+    """
+    Sum of a year x country matrix over the members of each group: sparse
+    product membership x matrix.T, NaN ignored.
+
+    Retour
+    ------
+    np.ndarray (n_years, n_groups), NaN for a group without any reported value
+    """
+    indptr, indices = membership['indptr'], membership['indices']
+    sums = np.full((matrix.shape[0], len(indptr) - 1), np.nan)
+    non_empty = np.diff(indptr) > 0
+    if not non_empty.any():
+        return sums
+
+    members = matrix[:, indices]
+    reported = ~np.isnan(members)
+    starts = indptr[:-1][non_empty]
+    total = np.add.reduceat(np.where(reported, members, 0.0), starts, axis=1)
+    count = np.add.reduceat(reported, starts, axis=1)
+    sums[:, non_empty] = np.where(count > 0, total, np.nan)
+    return sums
+
+
+def build_norm_inputs(df_countries, norm_specs, ratio_columns, countries, years):
+    """
+    Country matrices needed to aggregate each normalization: the column of
+    `norm_specs` itself, or the numerator and denominator of a per-country
+    ratio listed in `ratio_columns` (e.g. GDP per capita = GDP / population).
+
+    Retour
+    ------
+    {col_value: (numerator np.ndarray (n_years, n_countries), denominator np.ndarray or None, divisor)}
+    """
+    needed = set()
+    for _, col, _, _ in norm_specs.values():
+        needed.update(ratio_columns.get(col, (col,)))
+    raw = build_denominators(df_countries, {col: (None, col, 1, "") for col in sorted(needed)}, countries, years)
+
+    inputs = {}
+    for name, (_, col, divisor, _) in norm_specs.items():
+        numerator, denominator = ratio_columns.get(col, (col, None))
+        inputs[norm_columns(name)[0]] = (raw[numerator], raw[denominator] if denominator else None, divisor)
+    return inputs
+
+
+def aggregate_norm(values, norm_input, membership):
+    """
+    Normalized group totals: sum of the values / aggregated denominator, over
+    the countries reporting the value and every part of the denominator.
+    """
+    numerator, denominator, divisor = norm_input
+    valid = ~np.isnan(values) & ~np.isnan(numerator)
+    if denominator is not None:
+        valid &= ~np.isnan(denominator)
+
+    total = group_sums(np.where(valid, values, np.nan), membership)
+    group_denominator = group_sums(np.where(valid, numerator, np.nan), membership) / divisor
+    if denominator is not None:
+        group_denominator = normalize(group_denominator, group_sums(np.where(valid, denominator, np.nan), membership))
+    return normalize(total, group_denominator)
+
+
+def _digest(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.tobytes() if isinstance(part, np.ndarray) else repr(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_aggregates(cube, membership, norm_inputs, cache=None):
+    """
+    Group totals of every selection of the cube, raw and normalized.
+
+    Paramètres
+    ----------
+    cube : dict
+        Voir cube_utils.build_data_cube (colonne 'Value')
+    norm_inputs : dict
+        Voir build_norm_inputs
+    cache : dict, optionnel
+        Résultats d'un calcul précédent ({hash des entrées: matrice}), réutilisés
+        quand leurs entrées n'ont pas changé
+
+    Retour
+    ------
+    (aggregates, cache) : aggregates = dict with keys
+    - 'groups', 'groupings', 'indptr', 'indices' : see build_membership
+    - 'matrices' : {key: {col_value: np.ndarray (n_years, n_groups)}}, annual selections
+    - 'norm_inputs' : `norm_inputs`, to aggregate the running totals of the cumulative selections
+    - 'version' : hash of all the aggregated values
+    - 'computed', 'reused' : number of matrices computed / taken from `cache`
+    and the cache of this computation (to pass to the next one)
+    """
+    cache = cache or {}
+    new_cache, computed = {}, 0
+    norm_digests = {col: _digest(col, *norm_input) for col, norm_input in norm_inputs.items()}
+    version = hashlib.sha1(membership['version'].encode("utf-8"))
+
+    matrices = {}
+    for key, mats in cube['matrices'].items():
+        if 'Value' not in mats:
+            continue
+        values = mats['Value']
+        value_digest = _digest(membership['version'], values)
+        matrices[key] = {}
+        for col, digest in [('Value', value_digest)] + [(col, _digest(value_digest, d)) for col, d in norm_digests.items()]:
+            if digest not in cache:
+                computed += 1
+                cache[digest] = (group_sums(values, membership) if col == 'Value'
+                                 else aggregate_norm(values, norm_inputs[col], membership))
+            new_cache[digest] = matrices[key][col] = cache[digest]
+            version.update(digest.encode("utf-8"))
+
+    aggregates = {
+        'groups': membership['groups'],
+        'groupings': membership['groupings'],
+        'indptr': membership['indptr'],
+        'indices': membership['indices'],
+        'matrices': matrices,
+        'norm_inputs': norm_inputs,
+        'version': version.hexdigest()[:16],
+        'computed': computed,
+        'reused': len(new_cache) - computed,
+    }
+    return aggregates, new_cache
+
+
+def group_matrix(cube, key, col_value, grouping, start_year=None):
+    """
+    Year x group matrix of one selection for the groups of `grouping` (None if not available).
+    Cumulative selections: group totals of the running totals since `start_year`, cached.
+    """
+    aggregates = cube.get('aggregates')
+    if aggregates is None or grouping not in aggregates['groupings']:
+        return None
+    if key[3] == CUMULATIVE_TYPE:
+        mat = cumulative_group_matrix(cube, key, col_value, start_year)
+    else:
+        mat = aggregates['matrices'].get(key, {}).get(col_value)
+    return None if mat is None else mat[:, aggregates['groupings'][grouping]]
+
+
+def cumulative_group_matrix(cube, key, col_value, start_year=None):
+    """
+    Year x group totals (all groups) of the running totals of a cumulative selection.
+    """
+    aggregates = cube['aggregates']
+    totals = cumulative_values(cube, key, 'Value', start_year)
+    if totals is None or (col_value != 'Value' and col_value not in aggregates['norm_inputs']):
+        return None
+
+    def compute():
+        if col_value == 'Value':
+            return group_sums(totals, aggregates)
+        return aggregate_norm(totals, aggregates['norm_inputs'][col_value], aggregates)
+
+    return cached_result((cube['version'], aggregates['version'], 'groups', key, col_value,
+                          start_position(cube, start_year)), compute)
+
+
+def group_positions(cube, grouping, positions):
+    """
+    For each country of `positions` (see cube_utils.country_positions), position
+    of its group among the groups of `grouping` (-1 if in none, the first one if in several).
+    """
+    aggregates = cube['aggregates']
+    indptr, indices = aggregates['indptr'], aggregates['indices']
+    group_of_country = np.full(len(cube['countries']), -1)
+    for j, group in reversed(list(enumerate(aggregates['groupings'][grouping]))):
+        group_of_country[indices[indptr[group]:indptr[group + 1]]] = j
+    return np.where(positions >= 0, group_of_country[positions], -1)
+
+
+def spread_groups(group_values, group_pos):
+    """
+    Value of the group of each country (NaN if in none), for one year (1-D) or every year (2-D).
+    """
+    values = np.asarray(group_values, dtype=float)
+    if values.shape[-1] == 0:
+        return np.full(values.shape[:-1] + (len(group_pos),), np.nan)
+    return np.where(group_pos >= 0, values[..., np.maximum(group_pos, 0)], np.nan)
+
+
+def load_aggregate_cache(path):
+    """
+    Cache written by `write_aggregate_cache` ({} if missing or unreadable).
+    """
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return {}
+
+
+def write_aggregate_cache(cache, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def _mtime(path):
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return 0  # removed by another worker: pruned first (unlink ignores it)
+
+
+class FigureCache:
+    """
+    Bounded LRU cache of serialized figures (JSON strings).
+
+    The in-memory LRU is private to each worker. When `cache_dir` is given,
+    entries are also written to disk so that every gunicorn worker sharing the
+    directory can reuse figures rendered by the others.
+
+    Paramètres
+    ----------
+    max_entries : int
+        Nombre maximal d'entrées en mémoire
+    cache_dir : str or Path, optionnel
+        Dossier partagé entre workers (désactivé si None)
+    max_disk_entries : int, optionnel
+        Nombre maximal de fichiers sur disque (par défaut : 10 x max_entries),
+        dépassé d'au plus `prune_every` fichiers entre deux nettoyages
+    prune_every : int, optionnel
+        Nettoyage du dossier toutes les `prune_every` écritures de ce worker
+        (par défaut : max_disk_entries / 10)
+    namespace : str, optionnel
+        Préfixe des clés (ex : version des données), pour ne jamais servir
+        une figure calculée sur d'anciennes données
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None, max_disk_entries=None, namespace="", prune_every=None):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries or 10 * max_entries
+        self.prune_every = prune_every or max(1, self.max_disk_entries // 10)
+        self.namespace = namespace
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_writes = 0
+
+    def _digest(self, key):
+        raw = repr((self.namespace,) + tuple(key)).encode("utf-8")
+        return hashlib.sha1(raw).hexdigest()
+
+    def _disk_path(self, digest):
+        return self.cache_dir / f"{digest}.json"
+
+    def _remember(self, digest, value):
+        self._entries[digest] = value
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Serialized figure for `key`, or None on a miss.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return self._entries[digest]
+
+        if self.cache_dir is not None:
+            path = self._disk_path(digest)
+            try:
+                value = path.read_text(encoding="utf-8")
+            except OSError:
+                value = None
+            if value is not None:
+                try:
+                    os.utime(path)  # LRU on disk: mtime = last access
+                except OSError:
+                    pass  # pruned by another worker since the read: the value read is still valid
+                with self._lock:
+                    self._remember(digest, value)
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """
+        Store the serialized figure `value` (str) for `key`.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            self._remember(digest, value)
+
+        if self.cache_dir is not None:
+            # Atomic write: other workers never read a partial file
+            path = self._disk_path(digest)
+            tmp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+            tmp_path.write_text(value, encoding="utf-8")
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % self.prune_every == 0
+            if prune:
+                self._prune_disk()
+
+    def _prune_disk(self):
+        # Listing the folder costs one stat per file: only every `prune_every` writes
+        files = list(self.cache_dir.glob("*.json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=_mtime)
+        for f in files[:len(files) - self.max_disk_entries]:
+            try:
+                f.unlink()
+            except OSError:
+                pass  # already removed by another worker
+
+    def stats(self):
+        """
+        Hit/miss counters of this worker.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
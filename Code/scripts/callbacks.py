@@ -1,24 +1,245 @@
-from dash import Input, Output
+from dash import Input, Output, State, ClientsideFunction, Patch, ctx, no_update
+from dash.exceptions import PreventUpdate
 import plotly.graph_objects as go
+import plotly.io as pio
 import json
 import numpy as np
-from map_utils import symlog
-
-def register_callbacks(app, df_data, gdf_world, norm_map):
-    
-    # --- Mapping ---
-    category_to_indicator = (
-        df_data.groupby("Category")["Indicator"]
-        .unique()
-        .apply(list)
-        .to_dict()
+import hashlib
+from map_utils import (compute_map_values, compute_color_stats, compact_values, encode_values, colorscale_values,
+                       lod_tolerance)
+from cube_utils import (country_positions, country_series, cube_lookup, cube_matrix, cube_unit, lookup_color_stats,
+                        ranking_scores, top_n, effective_color_range, CUMULATIVE_TYPE)
+from aggregate_utils import group_matrix, group_positions, spread_groups
+from scale_utils import transform_values
+from layout import country_panel_style, country_panel_hidden
+from cache_utils import FigureCache
+from metrics_utils import metrics
+from config import figure_cache_size, figure_cache_dir, geom_lod_levels, country_level, norm_map
+
+def map_hovertemplate(indicator, normalization, values, name="%{text}"):
+    # name: '%{customdata}' when the map shows the group of each country
+    if values['no_data']:
+        return f"<b>{name}</b><br>{indicator} ({normalization}) = No data<extra></extra>"
+    return f"<b>{name}</b><br>{indicator} ({normalization}) = %{{z:.2f}} {values['unit_label']}<extra></extra>"
+
+def build_base_figure(countries):
+    """
+    Static part of the map (countries, names, geo layout, "No data" legend),
+    sent once; update_map only patches the values and the colorbar.
+    """
+    fig = go.Figure(go.Choropleth(
+        featureidkey="properties.Country_code",
+        locations=countries['Country_code'],
+        text=countries['name'],
+        colorbar=dict(
+            title=dict(text="", side="top", font=dict(size=14,color="black",family="Arial")),
+            x=0.0, xanchor='left', len=0.8, thickness=30
+        )
+    ))
+
+    fig.update_layout(
+        geo=dict(
+            scope="world", projection_type="natural earth",
+            showcountries=True, showcoastlines=True, showland=True, showocean=True,
+            landcolor="lightgray", oceancolor="lightblue", lakecolor="lightblue",
+            domain=dict(x=[0.07, 1], y=[0, 1])
+        ),
+        margin=dict(l=0,r=0,t=0,b=0),
+        uirevision="world_map"  # keep the user's zoom when the figure is rebuilt
     )
-    indicator_to_db = (
-        df_data.groupby("Indicator")["Source"]
-        .unique()
-        .apply(list)
-        .to_dict()
+
+    # No data patch
+    fig.add_shape(type="rect", xref="paper", yref="paper", x0=0.0, y0=0.93, x1=0.03, y1=0.96,
+                  fillcolor="lightgray", line=dict(color="black", width=1))
+    fig.add_annotation(xref="paper", yref="paper", x=0.035, y=0.96, text="No data",
+                       showarrow=False, font=dict(size=12, color="black"), align="left")
+
+    return json.loads(pio.to_json(fig, validate=False))
+
+def country_figure(cube, series_by_norm, category, indicator, type_value, normalization, norm_map):
+    """
+    Line chart of one country: one trace per source and normalization, only
+    those of `normalization` visible; the menu switches normalization in the browser.
+
+    Paramètres
+    ----------
+    series_by_norm : dict
+        {libellé de normalisation: {source: np.ndarray (n_years,)}} (voir cube_utils.country_series)
+    """
+    years = [int(y) for y in cube['years']]
+    traces, units = [], {}
+    for label, series in series_by_norm.items():
+        col_unit = norm_map[label][1]
+        for source, values in series.items():
+            traces.append(dict(type='scatter', mode='lines', name=source, meta=label, x=years,
+                               y=compact_values(values), visible=label == normalization))
+            unit = cube_unit(cube, (category, indicator, source, type_value), col_unit)
+            units.setdefault(label, f"{unit}/year" if unit and type_value == "Annual" else unit)
+
+    buttons = [dict(label=label, method='update',
+                    args=[{'visible': [t['meta'] == label for t in traces]}, {'yaxis.title.text': units.get(label, "")}])
+               for label in series_by_norm]
+    return dict(data=traces, layout=dict(
+        title=dict(text=f"{indicator} ({type_value})", x=0.5),
+        yaxis=dict(title=dict(text=units.get(normalization, ""))),
+        hovermode='x unified',
+        legend=dict(orientation='h', y=-0.15),
+        margin=dict(l=60, r=10, t=80, b=40),
+        updatemenus=[dict(type='dropdown', buttons=buttons, x=0, y=1.12, xanchor='left', yanchor='bottom',
+                          active=list(series_by_norm).index(normalization) if normalization in series_by_norm else 0)],
+    ))
+
+def start_year(type_value, cumulative_start):
+    """
+    First year of the running totals (None: since the first year of the data, or not cumulative).
+    """
+    return cumulative_start if type_value == CUMULATIVE_TYPE else None
+
+def map_patch(update):
+    """
+    Patch of the base figure from the output of build_map_update.
+    """
+    patch = Patch()
+    patch['data'][0].update(update['trace'])
+    patch['data'][0]['colorbar'].update(update['colorbar'])
+    patch['data'][0]['colorbar']['title']['text'] = update['title']
+    return patch
+
+def build_map_state(resources):
+    """
+    Add what the map callbacks derive from the prepared resources
+    (see snapshot_utils.prepare_resources): country positions and figure cache.
+    """
+    cube, topojson_levels = resources['cube'], resources['topojson_levels']
+
+    # --- Figure cache (data and geometry are static after startup) ---
+    geometry_version = hashlib.sha1(json.dumps(topojson_levels).encode("utf-8")).hexdigest()[:16]
+    # cube['version'] only hashes the matrices: units and labels shown in the figures are versioned apart
+    units = [norm_map, sorted((repr(key), cols) for key, cols in cube['units'].items()), cube.get('norm_units', {})]
+    units_version = hashlib.sha1(json.dumps(units, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+    aggregates = cube.get('aggregates', {})
+    figure_cache = FigureCache(figure_cache_size, cache_dir=figure_cache_dir,
+                               namespace=f"{cube['version']}-{aggregates.get('version')}-{geometry_version}-{units_version}")
+
+    # --- Group of each country of the map, for every grouping of the aggregates ---
+    country_pos = country_positions(cube, resources['countries']['Country_code'])
+    group_pos = {grouping: group_positions(cube, grouping, country_pos) for grouping in aggregates.get('groupings', {})}
+    group_names = {grouping: [aggregates['groups'][g][1] for g in groups]
+                   for grouping, groups in aggregates.get('groupings', {}).items()}
+
+    return {
+        **resources,
+        'default_level': geom_lod_levels[0][1],
+        'country_pos': country_pos,
+        'group_pos': group_pos,
+        'group_names': group_names,
+        'group_labels': {grouping: [group_names[grouping][j] if j >= 0 else None for j in pos]
+                         for grouping, pos in group_pos.items()},
+        'figure_cache': figure_cache,
+        'base_figure': build_base_figure(resources['countries']),
+        'ranking_codes': resources['countries']['Country_code'].to_numpy(),
+        'country_names': dict(zip(resources['countries']['Country_code'], resources['countries']['name'])),
+    }
+
+def map_matrix(state, key, col_value, scale, color_range, aggregate, cumulative_start=None):
+    """
+    Year x country matrix of the map: the country values, or the total of
+    the group of each country when `aggregate` is a grouping. The group
+    totals are then transformed for `scale` before being spread (ranks of
+    the groups, not of the countries), and returned with their color stats
+    (see map_utils.compute_color_stats): pass transformed=True to
+    compute_map_values.
+    """
+    cube = state['cube']
+    if aggregate not in state['group_pos']:
+        return cube_matrix(cube, key, col_value, state['country_pos'], cumulative_start), None
+    groups = group_matrix(cube, key, col_value, aggregate, cumulative_start)
+    if groups is None:
+        groups = np.full((len(cube['years']), len(state['group_names'][aggregate])), np.nan)
+    stats = compute_color_stats(groups, scale, effective_color_range(scale, color_range))
+    groups = transform_values(groups, scale, stats['multiplier'])
+    return spread_groups(groups, state['group_pos'][aggregate]), stats
+
+def build_map_update(state, norm_map, category, indicator, database, type_value, year, scale, color_range, normalization,
+                     aggregate=country_level, cumulative_start=None):
+    """
+    What changes on the map from one selection to another: values, color
+    range, colorscale, hover and colorbar.
+    """
+    # --- Lookup data (constant-time slice of the cube) ---
+    cube, country_pos = state['cube'], state['country_pos']
+    key = (category, indicator, database, type_value)
+    col_value, col_unit = norm_map[normalization]
+
+    grouped = aggregate in state['group_pos']
+    if grouped:
+        # --- Each country shows the total of its group ---
+        with metrics.stage('update_map', 'lookup'):
+            matrix, group_stats = map_matrix(state, key, col_value, scale, color_range, aggregate, cumulative_start)
+            year_pos = cube['year_index'].get_indexer([year])[0]
+            z_values = matrix[year_pos] if year_pos >= 0 else np.full(len(country_pos), np.nan)
+        color_stats = {k: v[year_pos] for k, v in group_stats.items()} if year_pos >= 0 else None
+    else:
+        with metrics.stage('update_map', 'lookup'):
+            z_values = cube_lookup(cube, key, col_value, year, country_pos, cumulative_start)
+        with metrics.stage('update_map', 'color_stats'):
+            color_stats = lookup_color_stats(cube, key, col_value, scale, color_range, year, cumulative_start)
+    with metrics.stage('update_map', 'values'):
+        values = compute_map_values(z_values, cube_unit(cube, key, col_unit), scale, color_range, type_value, color_stats,
+                                    transformed=grouped)
+
+    # --- Figure update ---
+    with metrics.stage('update_map', 'figure'):
+        update = {
+            'trace': dict(
+                z=encode_values(values['z']),
+                zmin=float(values['zmin']),
+                zmax=float(values['zmax']),
+                zmid=values['zmid'],
+                colorscale=colorscale_values(values['colorscale']),
+                hovertemplate=map_hovertemplate(indicator, normalization, values,
+                                                "%{customdata}" if grouped else "%{text}"),
+                customdata=state['group_labels'][aggregate] if grouped else None,
+            ),
+            'colorbar': dict(tickvals=compact_values(values['tickvals']), ticktext=list(values['ticktext'])),
+            'title': f"<b>{values['unit_label']}</b>",
+        }
+    return update
+
+def register_callbacks(app, resources, norm_map):
+    """
+    `resources.get()` returns the output of `build_map_state`
+    (see startup_utils.BackgroundLoader): callbacks are
+    registered before the data is loaded and do nothing until it is.
+    """
+
+    def map_state():
+        if not resources.ready():
+            raise PreventUpdate
+        return resources.get()
+
+    # --- Startup: fill the dropdowns once the data is loaded ---
+    @app.callback(
+        Output("category", "options"),
+        Output("category", "value"),
+        Output("aggregate", "options"),
+        Output("data_ready", "data"),
+        Output("startup_poll", "disabled"),
+        Output("map_figure", "data", allow_duplicate=True),
+        Output("startup_status", "children"),
+        Input("startup_poll", "n_intervals"),
+        prevent_initial_call=True
     )
+    def poll_startup(_n_intervals):
+        if resources.status() == 'error':
+            # Loading failed: stop polling (/health answers 503, the worker gets restarted)
+            return (no_update,) * 4 + (True, no_update, "The data failed to load: see the server logs.")
+        state = map_state()
+        category_options = state['options']['category']
+        options = [{"label": i, "value": i} for i in category_options]
+        aggregate_options = [country_level] + state['options'].get('grouping', [])
+        return (options, category_options[0] if category_options else None, aggregate_options, True, True,
+                state['base_figure'], None)
 
     # --- Dynamic Indicator dropdown ---
     @app.callback(
@@ -27,7 +248,7 @@ def register_callbacks(app, df_data, gdf_world, norm_map):
         Input("category", "value")
     )
     def update_indicator_dropdown(selected_category):
-        valid_inds = category_to_indicator.get(selected_category, [])
+        valid_inds = map_state()['cube']['category_to_indicator'].get(selected_category, [])
         options = [{"label": ind, "value": ind} for ind in valid_inds]
         default_value = valid_inds[0] if valid_inds else None
         return options, default_value
@@ -39,176 +260,303 @@ def register_callbacks(app, df_data, gdf_world, norm_map):
         Input("indicator", "value")
     )
     def update_database_dropdown(selected_indicator):
-        valid_dbs = indicator_to_db.get(selected_indicator, [])
+        valid_dbs = map_state()['cube']['indicator_to_db'].get(selected_indicator, [])
         options = [{"label": db, "value": db} for db in valid_dbs]
         default_value = valid_dbs[0] if valid_dbs else None
         return options, default_value
 
-    # --- Map update callback ---
+    # --- Start year of the running totals, only for the cumulative type ---
+    app.clientside_callback(
+        "function(type_value) { return type_value !== 'Cumulative'; }",
+        Output("cumulative_start", "disabled"),
+        Input("type", "value")
+    )
+
+    # --- Year slider: only reaches the server in 'server' mode ---
+    app.clientside_callback(
+        """
+        function(year, mode) {
+            const triggered = window.dash_clientside.callback_context.triggered;
+            const fromSlider = triggered.some(t => t.prop_id === 'year.value');
+            if (mode === 'client' && fromSlider) {
+                return window.dash_clientside.no_update;
+            }
+            return year;
+        }
+        """,
+        Output("server_year", "data"),
+        Input("year", "value"),
+        Input("year_mode", "value")
+    )
+
+    # --- Map update callback (patch of the base figure, see build_base_figure and render_map) ---
     @app.callback(
+        Output("map_figure", "data"),
+        Input("category", "value"),
+        Input("indicator", "value"),
+        Input("database", "value"),
+        Input("type", "value"),
+        Input("server_year", "data"),
+        Input("scale", "value"),
+        Input("color_range", "value"),
+        Input("normalization", "value"),
+        Input("aggregate", "value"),
+        Input("cumulative_start", "value"),
+        State("year", "value")
+    )
+    def update_map(category, indicator, database, type_value, _server_year, scale, color_range, normalization, aggregate,
+                   cumulative_start, year):
+        # The figure always shows the slider year; server_year only triggers the update
+        state = map_state()
+        metrics.inc('netzero_callback_calls_total', callback='update_map')
+        figure_cache = state['figure_cache']
+        cache_key = ('update', category, indicator, database, type_value, year, scale, color_range, normalization,
+                     aggregate, start_year(type_value, cumulative_start))
+        with metrics.stage('update_map', 'cache'):
+            update_json = figure_cache.get(cache_key)
+        if update_json is None:
+            update = build_map_update(state, norm_map, *cache_key[1:])
+            with metrics.stage('update_map', 'serialize'):
+                update_json = json.dumps(update)
+                figure_cache.set(cache_key, update_json)
+        with metrics.stage('update_map', 'patch'):
+            return map_patch(json.loads(update_json))
+
+    # --- Geometry of the current level of detail (sent once per level, not with every figure) ---
+    @app.callback(
+        Output("geo_topology", "data"),
+        Input("geo_level", "data"),
+        Input("data_ready", "data")
+    )
+    def update_geo_topology(geo_level, _data_ready):
+        state = map_state()
+        metrics.inc('netzero_callback_calls_total', callback='update_geo_topology')
+        topojson_levels = state['topojson_levels']
+        return topojson_levels[geo_level if geo_level in topojson_levels else state['default_level']]
+
+    # --- Figure + geometry decoded in the browser (assets/geometry.js) ---
+    app.clientside_callback(
+        ClientsideFunction(namespace="geometry", function_name="render_map"),
         Output("world_map", "figure"),
+        Input("map_figure", "data"),
+        Input("geo_topology", "data"),
+        State("world_map", "figure")
+    )
+
+    # --- All years of a selection, for the browser-side slider ---
+    @app.callback(
+        Output("year_frames", "data"),
         Input("category", "value"),
         Input("indicator", "value"),
         Input("database", "value"),
         Input("type", "value"),
-        Input("year", "value"),
         Input("scale", "value"),
         Input("color_range", "value"),
-        Input("normalization", "value")
+        Input("normalization", "value"),
+        Input("aggregate", "value"),
+        Input("cumulative_start", "value"),
+        Input("year_mode", "value")
+    )
+    def update_year_frames(category, indicator, database, type_value, scale, color_range, normalization, aggregate,
+                           cumulative_start, year_mode):
+        if year_mode != 'client':
+            return None
+        state = map_state()
+        metrics.inc('netzero_callback_calls_total', callback='update_year_frames')
+        figure_cache = state['figure_cache']
+        cache_key = ('frames', category, indicator, database, type_value, scale, color_range, normalization, aggregate,
+                     start_year(type_value, cumulative_start))
+        with metrics.stage('update_year_frames', 'cache'):
+            frames_json = figure_cache.get(cache_key)
+        if frames_json is None:
+            frames = build_year_frames(state, *cache_key[1:])
+            with metrics.stage('update_year_frames', 'serialize'):
+                frames_json = json.dumps(frames)
+                figure_cache.set(cache_key, frames_json)
+        with metrics.stage('update_year_frames', 'decode'):
+            return json.loads(frames_json)
+
+    # --- Swap the year in the browser (no server round-trip) ---
+    app.clientside_callback(
+        """
+        function(year, frames, mode, figure) {
+            const no_update = window.dash_clientside.no_update;
+            if (mode !== 'client' || !frames || !figure || !figure.data) {
+                return no_update;
+            }
+            const i = frames.years.indexOf(year);
+            if (i < 0) {
+                return no_update;
+            }
+            const trace = Object.assign({}, figure.data[0], {
+                z: frames.z[i],
+                zmin: frames.zmin[i],
+                zmax: frames.zmax[i],
+                zmid: frames.zmid,
+                colorscale: frames.colorscale[i],
+                hovertemplate: frames.hovertemplate[i]
+            });
+            const colorbar = Object.assign({}, trace.colorbar);
+            colorbar.tickvals = frames.tickvals[i];
+            colorbar.ticktext = frames.ticktext[i];
+            colorbar.title = Object.assign({}, colorbar.title, {text: '<b>' + frames.unit_label[i] + '</b>'});
+            trace.colorbar = colorbar;
+            return Object.assign({}, figure, {data: [trace]});
+        }
+        """,
+        Output("world_map", "figure", allow_duplicate=True),
+        Input("year", "value"),
+        Input("year_frames", "data"),
+        State("year_mode", "value"),
+        State("world_map", "figure"),
+        prevent_initial_call=True
     )
-    def update_map(category, indicator, database, type_value, year, scale, color_range, normalization):
-        # --- Filter data ---
-        df_filtered = df_data[
-            (df_data['Category'] == category) &
-            (df_data['Indicator'] == indicator) &
-            (df_data['Source'] == database) &
-            (df_data['Type'] == type_value) &
-            (df_data['Year'] == year)
-        ].copy()
-
-        # --- Merge with geometry ---
-        gdf_merged = gdf_world.merge(df_filtered, on='Country_code', how='left')
-        geojson_data = json.loads(gdf_merged.to_json())
-
-        # --- Columns for values and units ---
+
+    def build_year_frames(state, category, indicator, database, type_value, scale, color_range, normalization,
+                          aggregate=country_level, cumulative_start=None):
+        """
+        Compact payload with the year x country values of one selection and,
+        for each year, the color range and colorbar computed as in update_map.
+        """
+        cube = state['cube']
+        key = (category, indicator, database, type_value)
         col_value, col_unit = norm_map[normalization]
-        if col_value not in gdf_merged.columns:
-            gdf_merged[col_value] = np.nan
-        if col_unit not in gdf_merged.columns:
-            gdf_merged[col_unit] = ""
-
-        z_values = gdf_merged[col_value]
-        no_data_at_all = z_values.dropna().empty
-
-        if no_data_at_all:
-            unit_prefix = ""
-            z_plot_scaled = np.zeros(len(gdf_merged))
-            colorscale_to_use = [[0, 'lightgray'], [1, 'lightgray']]
-            zmin, zmax = 0, 1
-            colorbar_ticks = dict(ticks="", tickvals=[], ticktext=[])
-            hovertemplate = f"<b>%{{text}}</b><br>{indicator} ({normalization}) = No data<extra></extra>"
-        else:
-            # --- Determine color range ---
-            if color_range == 'raw':
-                zmin_raw, zmax_raw = z_values.min(), z_values.max()
-            elif color_range.startswith("q"):
-                q_low = float(color_range[1:])
-                q_high = 1 - q_low
-                zmin_raw, zmax_raw = z_values.quantile(q_low), z_values.quantile(q_high)
-            elif color_range.startswith("*"):
-                factor = float(color_range[1:])
-                zmin_raw, zmax_raw = factor * z_values.min(), factor * z_values.max()
-            else:
-                raise ValueError("color_range must be 'raw', 'q0.xx', or '*0.xx'")
-
-            # --- Determine z_plot_scaled and zmin/zmax depending on scale ---
-            unit_prefix = gdf_merged[col_unit].iloc[0] if col_unit in gdf_merged.columns else ""
-            unit_multiplier = 1
-
-            if scale == 'absolute':
-                z_plot = z_values.copy()
-                zborne = max(abs(zmin_raw), abs(zmax_raw))
-                if zborne >= 1e9:
-                    unit_multiplier = 1e9
-                    unit_prefix = f"G{unit_prefix}"
-                elif zborne >= 1e6:
-                    unit_multiplier = 1e6
-                    unit_prefix = f"M{unit_prefix}"
-                elif zborne >= 1e3:
-                    unit_multiplier = 1e3
-                    unit_prefix = f"k{unit_prefix}"
-                z_plot_scaled = z_plot / unit_multiplier
-                zmin, zmax = -zborne / unit_multiplier, zborne / unit_multiplier
-                colorscale_to_use = 'RdYlGn_r'
-
-            elif scale == 'relative':
-                z_plot = z_values.copy()
-                zborne = max(abs(zmin_raw), abs(zmax_raw))
-                if zborne >= 1e9:
-                    unit_multiplier = 1e9
-                    unit_prefix = f"G{unit_prefix}"
-                elif zborne >= 1e6:
-                    unit_multiplier = 1e6
-                    unit_prefix = f"M{unit_prefix}"
-                elif zborne >= 1e3:
-                    unit_multiplier = 1e3
-                    unit_prefix = f"k{unit_prefix}"
-                z_plot_scaled = z_plot / unit_multiplier
-                zmin = zmin_raw / unit_multiplier
-                zmax = zmax_raw / unit_multiplier
-                colorscale_to_use = 'RdYlGn_r'
-
-            elif scale == 'rank':
-                z_plot = z_values.rank(ascending=True)
-                z_plot_scaled = z_plot
-                zmin, zmax = z_plot.min(), z_plot.max()
-                colorscale_to_use = 'YlOrBr'
-
-            elif scale == 'log':
-                z_plot = z_values.apply(symlog)
-                z_plot_scaled = z_plot
-                zmin, zmax = z_plot.min(), z_plot.max()
-                colorscale_to_use = 'RdYlGn_r'
+        unit = cube_unit(cube, key, col_unit)
+        grouped = aggregate in state['group_pos']
 
-            else:
-                raise ValueError("scale must be 'absolute', 'relative', 'rank', or 'log'")
+        frames = dict(years=[int(y) for y in cube['years']], zmid=0 if scale == 'absolute' else None,
+                      z=[], zmin=[], zmax=[], colorscale=[], tickvals=[], ticktext=[],
+                      unit_label=[], hovertemplate=[])
+        with metrics.stage('update_year_frames', 'lookup'):
+            matrix, group_stats = map_matrix(state, key, col_value, scale, color_range, aggregate, cumulative_start)
+        with metrics.stage('update_year_frames', 'values'):
+            for year_pos, (year, z_values) in enumerate(zip(cube['years'], matrix)):
+                color_stats = ({k: v[year_pos] for k, v in group_stats.items()} if grouped
+                               else lookup_color_stats(cube, key, col_value, scale, color_range, year, cumulative_start))
+                values = compute_map_values(z_values, unit, scale, color_range, type_value, color_stats,
+                                            transformed=grouped)
+                frames['z'].append(compact_values(values['z']))
+                frames['zmin'].append(float(values['zmin']))
+                frames['zmax'].append(float(values['zmax']))
+                frames['colorscale'].append(colorscale_values(values['colorscale']))
+                frames['tickvals'].append(compact_values(values['tickvals']))
+                frames['ticktext'].append(values['ticktext'])
+                frames['unit_label'].append(values['unit_label'])
+                frames['hovertemplate'].append(map_hovertemplate(indicator, normalization, values,
+                                                                 "%{customdata}" if grouped else "%{text}"))
+        return frames
+
+    # --- Country drill-down: every year and source of the clicked country ---
+    @app.callback(
+        Output("country_panel", "style"),
+        Output("country_title", "children"),
+        Output("country_series", "figure"),
+        Input("world_map", "clickData"),
+        Input("country_close", "n_clicks"),
+        Input("category", "value"),
+        Input("indicator", "value"),
+        Input("type", "value"),
+        Input("normalization", "value"),
+        Input("cumulative_start", "value"),
+        State("country_panel", "style"),
+        prevent_initial_call=True
+    )
+    def update_country_panel(click_data, _close, category, indicator, type_value, normalization, cumulative_start,
+                             panel_style):
+        if ctx.triggered_id == "country_close":
+            return country_panel_hidden, no_update, no_update
+        if not click_data or (ctx.triggered_id != "world_map" and panel_style == country_panel_hidden):
+            raise PreventUpdate  # selection changed while the panel is closed
+        state = map_state()
+        metrics.inc('netzero_callback_calls_total', callback='update_country_panel')
+        code = click_data['points'][0].get('location')
 
-            if type_value == "Annual":
-                unit_prefix = f"{unit_prefix}/year"
+        # --- Per-country index: contiguous series, no filtering of the whole dataset ---
+        with metrics.stage('update_country_panel', 'lookup'):
+            series_by_norm = {label: country_series(state['cube'], code, category, indicator, type_value, col_value,
+                                                    start_year(type_value, cumulative_start))
+                              for label, (col_value, _) in norm_map.items()}
+        with metrics.stage('update_country_panel', 'figure'):
+            fig = country_figure(state['cube'], series_by_norm, category, indicator, type_value, normalization, norm_map)
+        return country_panel_style, state['country_names'].get(code, code), fig
 
-            # --- Colorbar ticks ---
-            tickvals, ticktext = [], []
-            if scale == 'absolute':
-                pos_ticks = np.linspace(0, zmax, 5)[1:]
-                neg_ticks = np.linspace(zmin, 0, 5)[:-1]
-                tickvals = np.concatenate([neg_ticks, [0], pos_ticks])
-            else:
-                tickvals = np.linspace(zmin, zmax, 9)
-            for v in tickvals:
-                abs_v = abs(v)
-                if abs_v > 100:
-                    ticktext.append(f"{int(round(v))}")
-                elif abs_v > 10:
-                    ticktext.append(f"{round(v,1)}")
-                else:
-                    ticktext.append(f"{round(v,2)}")
-            colorbar_ticks = dict(tickvals=tickvals, ticktext=ticktext)
-            hovertemplate = f"<b>%{{text}}</b><br>{indicator} ({normalization}) = %{{customdata[0]:.2f}} {unit_prefix}<extra></extra>"
-
-        # --- Build figure ---
-        fig = go.Figure(go.Choropleth(
-            geojson=json.loads(gdf_merged.to_json()),
-            locations=gdf_merged.index,
-            z=z_plot_scaled,
-            text=gdf_merged['name'],
-            colorscale=colorscale_to_use,
-            zmin=zmin,
-            zmax=zmax,
-            zmid=0 if scale=='absolute' else None,
-            customdata=np.stack([z_plot_scaled], axis=-1),
-            hovertemplate=hovertemplate,
-            colorbar=dict(
-                title=dict(text=f"<b>{unit_prefix}</b>", side="top", font=dict(size=14,color="black",family="Arial")),
-                x=0.0, xanchor='left', len=0.8, thickness=30,
-                tickvals=colorbar_ticks.get('tickvals', None),
-                ticktext=colorbar_ticks.get('ticktext', None)
-            )
-        ))
-
-        fig.update_layout(
-            geo=dict(
-                scope="world", projection_type="natural earth",
-                showcountries=True, showcoastlines=True, showland=True, showocean=True,
-                landcolor="lightgray", oceancolor="lightblue", lakecolor="lightblue",
-                domain=dict(x=[0.07, 1], y=[0, 1])
-            ),
-            margin=dict(l=0,r=0,t=0,b=0)
-        )
+    # --- Ranking of the countries of the map (top / bottom N, value or change) ---
+    @app.callback(
+        Output("ranking", "figure"),
+        Input("category", "value"),
+        Input("indicator", "value"),
+        Input("database", "value"),
+        Input("type", "value"),
+        Input("normalization", "value"),
+        Input("year", "value"),
+        Input("rank_by", "value"),
+        Input("rank_order", "value"),
+        Input("rank_size", "value"),
+        Input("rank_window", "value"),
+        Input("aggregate", "value"),
+        Input("cumulative_start", "value"),
+        Input("data_ready", "data")
+    )
+    def update_ranking(category, indicator, database, type_value, normalization, year, rank_by, rank_order, rank_size,
+                       rank_window, aggregate, cumulative_start, _data_ready):
+        state = map_state()
+        metrics.inc('netzero_callback_calls_total', callback='update_ranking')
+        cube = state['cube']
+        key = (category, indicator, database, type_value)
+        col_value, col_unit = norm_map[normalization]
+        year_pos = cube['year_index'].get_indexer([year])[0]
 
-        # No data patch
-        fig.add_shape(type="rect", xref="paper", yref="paper", x0=0.0, y0=0.93, x1=0.03, y1=0.96,
-                      fillcolor="lightgray", line=dict(color="black", width=1))
-        fig.add_annotation(xref="paper", yref="paper", x=0.035, y=0.96, text="No data",
-                           showarrow=False, font=dict(size=12, color="black"), align="left")
+        # --- Year x country (or group) matrix, scored and ranked with NumPy ---
+        grouped = aggregate in state['group_pos']
+        with metrics.stage('update_ranking', 'lookup'):
+            start = start_year(type_value, cumulative_start)
+            matrix = group_matrix(cube, key, col_value, aggregate, start) if grouped else \
+                cube_matrix(cube, key, col_value, state['country_pos'], start)
+            if matrix is None:
+                matrix = np.full((len(cube['years']), len(state['group_names'][aggregate])), np.nan)
+        with metrics.stage('update_ranking', 'rank'):
+            scores = ranking_scores(matrix, rank_by, rank_window)[max(year_pos, 0)]
+            positions, valid = top_n(scores, rank_size, largest=rank_order == 'top')
+            positions = positions[valid] if year_pos >= 0 else positions[:0]
 
+        with metrics.stage('update_ranking', 'figure'):
+            unit = cube_unit(cube, key, col_unit)
+            if rank_by == 'change_pct':
+                unit = "%"
+            elif unit and type_value == "Annual":
+                unit = f"{unit}/year"
+            title = f"{'Top' if rank_order == 'top' else 'Bottom'} {rank_size} - {indicator} ({normalization}), "
+            title += str(year) if rank_by == 'value' else f"change {year - rank_window}-{year}"
+            if grouped:
+                names = [state['group_names'][aggregate][p] for p in positions]
+            else:
+                names = [state['country_names'].get(code, code) for code in state['ranking_codes'][positions]]
+            fig = dict(
+                data=[dict(type='bar', orientation='h', x=compact_values(scores[positions]), y=names,
+                           marker=dict(color='#c0392b' if rank_order == 'top' else '#27ae60'),
+                           hovertemplate=f"<b>%{{y}}</b><br>%{{x:.3s}} {unit}<extra></extra>")],
+                layout=dict(
+                    title=dict(text=title, x=0.5),
+                    xaxis=dict(title=dict(text=unit)),
+                    yaxis=dict(autorange='reversed', automargin=True),
+                    margin=dict(l=10, r=10, t=50, b=40),
+                    annotations=[] if len(positions) else [dict(text="No data", showarrow=False,
+                                                                  xref='paper', yref='paper', x=0.5, y=0.5)],
+                ),
+            )
         return fig
+
+    # --- Geometry level of detail follows the zoom ---
+    @app.callback(
+        Output("geo_level", "data"),
+        Input("world_map", "relayoutData"),
+        State("geo_level", "data"),
+        prevent_initial_call=True
+    )
+    def update_map_geometry(relayout_data, geo_level):
+        if not relayout_data or "geo.projection.scale" not in relayout_data:
+            raise PreventUpdate
+        level = lod_tolerance(relayout_data["geo.projection.scale"], geom_lod_levels)
+        if level == (geo_level if geo_level is not None else geom_lod_levels[0][1]):
+            raise PreventUpdate
+        return level
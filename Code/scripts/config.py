@@ -1,25 +1,164 @@
+import os
+
 # --- Normalizations and units ---
+# name: (dropdown label, column of Data/countries/countries_area.csv, divisor, unit suffix)
+# -> Value_norm_<name> = Value / (column / divisor), computed on request (norm_utils.py).
+# A label of None keeps the normalization out of norm_map, so out of the app: it is only
+# written to the materialized file (build_data.py pipeline --norm-columns, for the notebooks).
+norm_specs = {
+    'area': ('Area', 'surface_km2', 1, '/km²'),
+    'population': ('Population', 'population_total', 1e1, '/hab'),
+    'gdp': ('GDP', 'gdp_current_usd', 1e6, '/GDP M$'),
+    'ppp': ('GDP(PPP)', 'gdp_ppp_current_intl', 1e6, '/GDP(PPP) M$'),
+    'gdp_hab': ('GDP/hab', 'gdp_percapita', 1e3, '/k$/hab'),
+    'ppp_hab': ('PGD(PPP)/hab', 'gdp_ppp_percapita', 1e3, '/k$(PPP)/hab'),
+    'densite': (None, 'population_density', 1, '/hab/km²'),
+}
+
+# Dropdown label -> (value column, unit column)
 norm_map = {
     'No norm': ('Value', 'Unit'),
-    'Area': ('Value_norm_area', 'Unit_norm_area'),
-    'Population': ('Value_norm_population', 'Unit_norm_population'),
-    'GDP': ('Value_norm_gdp', 'Unit_norm_gdp'),
-    'GDP(PPP)': ('Value_norm_ppp', 'Unit_norm_ppp'),
-    'GDP/hab': ('Value_norm_gdp_hab', 'Unit_norm_gdp_hab'),
-    'PGD(PPP)/hab': ('Value_norm_ppp_hab', 'Unit_norm_ppp_hab'),
+    **{label: (f'Value_norm_{name}', f'Unit_norm_{name}') for name, (label, *_) in norm_specs.items() if label},
+}
+
+# --- Denominators from the World Bank WDI API (build_data.py wdi -> countries_area.csv) ---
+# WDI code -> column of countries_area.csv
+wdi_indicators = {
+    "SP.POP.TOTL": "population_total",
+    "NY.GDP.MKTP.CD": "gdp_current_usd",
+    "NY.GDP.PCAP.CD": "gdp_percapita_current_usd",
+    "NY.GDP.MKTP.PP.CD": "gdp_ppp_current_intl",
+    "NY.GDP.PCAP.PP.CD": "gdp_percapita_ppp_current_intl",
+    "AG.LND.TOTL.K2": "surface_km2",
+}
+wdi_first_year = 1960
+wdi_last_year = 2024
+wdi_cache_dir = "wdi_cache"  # in Data/countries: one JSON file per indicator and page
+
+# --- Regional aggregates (aggregate_utils.py) ---
+# Groupings of Data/countries/country_groups.csv, plus the whole world
+groups_filename = "country_groups.csv"
+world_group = "World"
+country_level = "Countries"  # aggregate dropdown value of the country map
+# Per-country ratios of countries_area.csv, re-aggregated as sum(numerator) / sum(denominator)
+aggregate_ratio_columns = {
+    'gdp_percapita': ('gdp_current_usd', 'population_total'),
+    'gdp_ppp_percapita': ('gdp_ppp_current_intl', 'population_total'),
+    'population_density': ('population_total', 'surface_km2'),
+}
+
+# --- Ingestion pipeline (build_data.py pipeline) ---
+# One entry per raw table: file in Data/<folder>, header row (and Excel sheet),
+# conversion factor to the target unit and the metadata of the indicator.
+MTCO2_TO_TC = 1e6 * 0.272727  # 3.66666 from C to CO2, 0.272727 from CO2 to C
+MTC_TO_TC = 1e6               # TgC = MtC
+
+gcb_folder = "GHG Datasets/Global Carbon Budget"
+gcb_luc_file = "National_LandUseChange_Carbon_Emissions_2024v1.0-1.xlsx"
+
+raw_sources = [
+    # Global Carbon Budget, national tables (data_raw)
+    dict(file="GCB_FFTerritorial_Countries.csv", n_header=1, factor=MTCO2_TO_TC, category="Fossil Fuel", indicator="Territorial", source="GCB"),
+    dict(file="GCB_FFConsumption_Countries.csv", n_header=1, factor=MTCO2_TO_TC, category="Fossil Fuel", indicator="Consumption", source="GCB"),
+    dict(file="GCB_FFTransfer_Countries.csv", n_header=1, factor=MTCO2_TO_TC, category="Fossil Fuel", indicator="Transfer", source="GCB"),
+    dict(file="GCB_NetEmissions_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Net Emissions", source="GCB"),
+    dict(file="GCB_Deforestation_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Deforestation", source="GCB"),
+    dict(file="GCB_Regrowth_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Forest Regrowth", source="GCB"),
+    dict(file="GCB_other_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Other Emissions", source="GCB"),
+    dict(file="GCB_Peat_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Peat Emissions", source="GCB"),
+    dict(file="GCB_Woodharvest_Countries.csv", n_header=1, factor=MTC_TO_TC, category="LULUCF", indicator="Wood Harvesting", source="GCB"),
+    # Global Carbon Budget Excel release: land-use change emissions of each bookkeeping model
+    # (the fossil sheets hold the same data as the GCB_FF*.csv tables above)
+    *[dict(file=gcb_luc_file, folder=gcb_folder, sheet_name=model, n_header=7, factor=MTC_TO_TC,
+           category="LULUCF", indicator="Net Emissions", source=model)
+      for model in ["BLUE", "H&C2023", "OSCAR", "LUCE"]],
+]
+raw_unit = "tC"
+excel_cache_folder = "excel_cache"  # in Data/: sheets of the Excel workbooks converted once (excel_utils.py)
+
+# Country names without a match in Data/SIG/country_codes_clean.csv
+manual_country_codes = {
+    "Bahamas": "BS", "Bolivia": "BO", "Cape Verde": "CV", "Central African Republic": "CF",
+    "Comoros": "KM", "Congo": "CG", "Cook Islands": "CK", "Czech Republic": "CZ",
+    "Democratic Republic of the Congo": "CD", "Dominican Republic": "DO", "Gambia": "GM",
+    "Iran": "IR", "Laos": "LA", "Lao People's Democratic Republic": "LA", "Marshall Islands": "MH",
+    "Micronesia (Federated States of)": "FM", "Moldova": "MD", "Netherlands": "NL", "Niger": "NE",
+    "North Korea": "KP", "Democratic People's Republic of Korea": "KP", "North Macedonia": "MK",
+    "Macedonia": "MK", "Occupied Palestinian Territory": "PS", "State of Palestine": "PS",
+    "Philippines": "PH", "Republic of South Sudan": "SS", "Russian Federation": "RU",
+    "South Korea": "KR", "Republic of Korea": "KR", "Sudan": "SD", "Swaziland": "SZ", "Syria": "SY",
+    "Tanzania": "TZ", "United Arab Emirates": "AE", "United Kingdom": "GB",
+    "United Kingdom of Great Britain and Northern Ireland": "GB", "United States of America": "US",
+    "Venezuela": "VE", "Vietnam": "VN",
+    "Russia": "RU", "Türkiye": "TR", "USA": "US", "Vatican City": "VA",  # GCB Excel names
+    "Namibia": "NAM",  # 'NA' would be read as missing
 }
 
-# --- Geometry simplification ---
-geom_simplify_tol = 0.1
+# --- Geometry levels of detail ---
+# (minimum geo projection scale, simplification tolerance in degrees):
+# the coarse level is used for the world view, finer ones when zooming in
+geom_lod_levels = [(0, 0.5), (2, 0.1), (6, 0.02)]
+geom_quantization = 1e5  # TopoJSON grid: 1e5 x 1e5 points over the world bounds (~400 m)
+
+# --- Startup ---
+# 'lazy': the layout is served at once, data and geometry load in a background thread
+#         of each worker (gunicorn without --preload)
+# 'eager': everything is loaded at import (use with gunicorn --preload: loaded once
+#          in the master, shared copy-on-write by the workers)
+startup_mode = os.environ.get("NETZERO_STARTUP_MODE", "lazy")
+
+# --- Startup snapshot (build_data.py snapshot) ---
+# Prepared data store, options and geometry in one file of Data/data_final,
+# used instead of the CSV / GeoJSON when it was built from the current inputs
+snapshot_filename = os.environ.get("NETZERO_SNAPSHOT", "app_snapshot.pkl")
+
+# --- Figure cache ---
+figure_cache_size = 256  # figures kept in memory by each worker
+figure_cache_dir = os.environ.get("NETZERO_FIGURE_CACHE_DIR")  # shared by gunicorn workers (None = memory only)
+
+# --- Metrics and profiling (/metrics, see metrics_utils.py) ---
+# Folder of the cProfile dumps; profiling is off unless set. Then a callback
+# request sent with the header 'X-Profile: 1', or the next one after
+# GET /profile/next, is profiled
+profile_dir = os.environ.get("NETZERO_PROFILE_DIR")
+
+# --- HTTP compression and ETags (see http_utils.py) ---
+# Set NETZERO_COMPRESSION=0 when a reverse proxy already compresses the responses
+http_compression = os.environ.get("NETZERO_COMPRESSION", "1") != "0"
+compression_encodings = ("br", "gzip")  # by preference; 'br' needs the brotli package
+compression_min_size = 1024             # bytes
+compression_levels = {'gzip': 6, 'br': 5}
+# Callbacks whose response only depends on their inputs (data static after startup): ETag + Cache-Control,
+# for a reverse proxy configured to cache POST responses keyed on the body (see http_utils.py)
+deterministic_outputs = ["map_figure.data", "year_frames.data", "geo_topology.data"]
+callback_cache_max_age = 3600  # seconds
 
 # --- Dropdown options ---
 scale_options = ['absolute', 'relative', 'rank', 'log']
-color_range_options = ['raw', 'q0.01', 'q0.05', 'q0.1', '*0.8']
+color_range_options = ['raw', 'q0.01', 'q0.05', 'q0.1', '*0.8', 'global']  # 'global': same range for every year
 type_options = [
     {"label": "Annual", "value": "Annual"},
     {"label": "Cumulative", "value": "Cumulative"}
 ]
 
+# --- Ranking panel (see cube_utils.ranking_scores) ---
+rank_by_options = [
+    {"label": "Value", "value": "value"},
+    {"label": "Change", "value": "change"},
+    {"label": "Change (%)", "value": "change_pct"}
+]
+rank_window_options = [1, 5, 10, 20, 30]  # years of the change
+rank_size_options = [5, 10, 20, 50]
+
+# --- Year slider mode ---
+# 'server': each slider move re-renders the map on the server
+# 'client': all years of the selection are sent once and swapped in the browser
+year_mode_options = [
+    {"label": "Server", "value": "server"},
+    {"label": "In browser", "value": "client"}
+]
+default_year_mode = "server"
+
 # --- Slider settings ---
 first_year = 1960
 last_year= 2023
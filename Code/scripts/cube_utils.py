@@ -0,0 +1,454 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from map_utils import compute_color_stats, format_ticks
+from norm_utils import norm_columns, build_denominators, normalize
+
+# Columns identifying one map selection (the Year is the first axis of each matrix)
+CUBE_KEYS = ['Category', 'Indicator', 'Source', 'Type']
+
+# Only the annual series are stored: a 'Cumulative' selection is the running
+# total of its 'Annual' one, computed on request from any start year
+ANNUAL_TYPE = 'Annual'
+CUMULATIVE_TYPE = 'Cumulative'
+CUMULATIVE_CACHE_SIZE = 256  # running totals (and their color stats) kept by each worker
+
+_cumulative_cache = {}
+
+
+def _unique_in_order(values):
+    return list(dict.fromkeys(values))
+
+
+def build_data_cube(df_data, norm_map, df_countries=None, norm_specs=None):
+    """
+    Build the in-memory store used by the map callbacks.
+
+    Each (Category, Indicator, Source, Type) key holds one dense year x country
+    matrix per value column of `norm_map` present in `df_data`, so a map lookup
+    is a simple slice instead of boolean masks over the whole long-format DataFrame.
+    The normalized columns missing from `df_data` are computed on request
+    from the 'Value' matrix and the denominators of `df_countries` / `norm_specs`;
+    the denominators of the materialized ones (file written with
+    `pipeline --norm-columns`) are kept too, for their cumulative type. Without
+    `df_countries`, the cumulative type of a materialized column is not available.
+    Only the 'Annual' rows are stored; 'Cumulative' rows of `df_data`, if any,
+    are ignored (see cumulative_values).
+
+    Retour
+    ------
+    dict with keys:
+    - 'years', 'countries' : axes of the matrices (np.ndarray)
+    - 'year_index', 'country_index' : pd.Index used to locate a year / country
+    - 'matrices' : {key: {col_value: np.ndarray (n_years, n_countries)}}, annual selections only
+    - 'units' : {key: {col_unit: str}}
+    - 'norms' : {col_value: (denominator np.ndarray (n_years, n_countries), unit suffix)}, every
+      normalization of `norm_map` (the stored matrix, if any, is used for the annual type)
+    - 'norm_units' : {col_unit: unit suffix}
+    - 'cumulative_keys' : selections computed as running totals of an annual one
+    - 'category_to_indicator', 'indicator_to_db' : dropdown mappings
+    - 'by_country' : per-country index of the series (see build_country_index)
+    - 'version' : content hash of the matrices (changes when the data changes)
+    """
+    df_data = df_data[df_data['Type'] != CUMULATIVE_TYPE]
+    years = np.array(sorted(df_data['Year'].dropna().unique()))
+    countries = np.array(sorted(df_data['Country_code'].dropna().unique()))
+    year_index = pd.Index(years)
+    country_index = pd.Index(countries)
+
+    year_pos = year_index.get_indexer(df_data['Year'])
+    country_pos = country_index.get_indexer(df_data['Country_code'])
+
+    value_cols = [col for col, _ in norm_map.values() if col in df_data.columns]
+    unit_cols = [col for _, col in norm_map.values() if col in df_data.columns]
+    values = {col: df_data[col].to_numpy(dtype=float, na_value=np.nan) for col in value_cols}
+
+    matrices, units = {}, {}
+    for key, rows in df_data.groupby(CUBE_KEYS, sort=False).indices.items():
+        rows = rows[(country_pos[rows] >= 0) & (year_pos[rows] >= 0)]
+        yi, ci = year_pos[rows], country_pos[rows]
+
+        # Duplicated (country, year) rows: the last one wins, as on the map
+        mats = {}
+        for col in value_cols:
+            mat = np.full((len(years), len(countries)), np.nan)
+            mat[yi, ci] = values[col][rows]
+            mats[col] = mat
+        matrices[key] = mats
+
+        units[key] = {}
+        for col in unit_cols:
+            unit = df_data[col].iloc[rows].dropna()
+            units[key][col] = unit.iloc[0] if not unit.empty else ""
+
+    # --- Normalizations computed on request (and running totals of the materialized ones) ---
+    norms, norm_units = {}, {}
+    if df_countries is not None and norm_specs:
+        denominators = build_denominators(df_countries, norm_specs, countries, years)
+        norm_cols = set(norm_map.values())
+        for name, (_, _, _, suffix) in norm_specs.items():
+            col_value, col_unit = norm_columns(name)
+            if (col_value, col_unit) in norm_cols:
+                norms[col_value] = (denominators[name], suffix)
+                norm_units[col_unit] = suffix
+
+    keys = list(matrices)
+    version = hashlib.sha1()
+    version.update(countries.astype(str).tobytes() + years.astype(np.int64).tobytes())
+    for key in keys:
+        version.update(repr(key).encode("utf-8"))
+        for col, mat in matrices[key].items():
+            version.update(col.encode("utf-8") + mat.tobytes())
+    for col, (denominator, suffix) in norms.items():
+        version.update((col + suffix).encode("utf-8") + denominator.tobytes())
+
+    keys += [key[:3] + (CUMULATIVE_TYPE,) for key in keys if key[3] == ANNUAL_TYPE]
+    category_to_indicator = {}
+    indicator_to_db = {}
+    for category, indicator, source, _ in keys:
+        category_to_indicator.setdefault(category, []).append(indicator)
+        indicator_to_db.setdefault(indicator, []).append(source)
+
+    cube = {
+        'years': years,
+        'countries': countries,
+        'year_index': year_index,
+        'country_index': country_index,
+        'matrices': matrices,
+        'units': units,
+        'norms': norms,
+        'norm_units': norm_units,
+        'category_to_indicator': {k: _unique_in_order(v) for k, v in category_to_indicator.items()},
+        'indicator_to_db': {k: _unique_in_order(v) for k, v in indicator_to_db.items()},
+        'cumulative_keys': [key for key in keys if key[3] == CUMULATIVE_TYPE],
+        'version': version.hexdigest()[:16],
+    }
+    cube['by_country'] = build_country_index(cube)
+    return cube
+
+
+def build_country_index(cube):
+    """
+    Per-country index of the series: the selections of each indicator, so the
+    series of one country are read as one column of each of their matrices
+    (n_years values per source), without a second, country-major copy of the cube.
+
+    Retour
+    ------
+    dict with keys:
+    - 'keys' : selections of the cube matrices
+    - 'by_indicator' : {(Category, Indicator, Type): positions in 'keys' (one per source)}
+    """
+    keys = list(cube['matrices'])
+    by_indicator = {}
+    for i, (category, indicator, _, type_value) in enumerate(keys):
+        by_indicator.setdefault((category, indicator, type_value), []).append(i)
+
+    return {
+        'keys': keys,
+        'by_indicator': {k: np.array(v) for k, v in by_indicator.items()},
+    }
+
+
+def country_series(cube, country_code, category, indicator, type_value, col_value, start_year=None):
+    """
+    Full series of one country for every source of an indicator
+    (running totals since `start_year` for the cumulative type).
+
+    Retour
+    ------
+    {source: np.ndarray (n_years,)} (empty if the country or the indicator is unknown)
+    """
+    index = cube['by_country']
+    country_pos = cube['country_index'].get_indexer([country_code])[0]
+    cumulative = type_value == CUMULATIVE_TYPE
+    positions = index['by_indicator'].get((category, indicator, ANNUAL_TYPE if cumulative else type_value))
+    if country_pos < 0 or positions is None:
+        return {}
+
+    series = {}
+    for i in positions:
+        key = index['keys'][i]
+        mats = cube['matrices'][key]
+        if col_value in mats and not cumulative:
+            row = mats[col_value][:, country_pos]
+        elif (col_value == 'Value' or col_value in cube.get('norms', {})) and 'Value' in mats:
+            row = mats['Value'][:, country_pos]
+            if cumulative:
+                row = cumulative_matrix(row, start_position(cube, start_year))
+            if col_value != 'Value':
+                row = normalize(row, cube['norms'][col_value][0][:, country_pos])
+        else:
+            continue
+        series[key[2]] = row
+    return series
+
+
+def start_position(cube, start_year=None):
+    """
+    Row of the first year of a running total (0: since the first year of the data).
+    """
+    if start_year is None:
+        return 0
+    return int(np.searchsorted(cube['years'], start_year))
+
+
+def cumulative_matrix(matrix, start_pos=0):
+    """
+    Running total along the year axis (first axis) from row `start_pos`, as
+    data_utils.add_cumulative: missing years stay NaN and do not stop the sum.
+    NaN before `start_pos`.
+    """
+    totals = np.full(np.shape(matrix), np.nan)
+    annual = np.asarray(matrix, dtype=float)[start_pos:]
+    totals[start_pos:] = np.where(np.isnan(annual), np.nan, np.nancumsum(annual, axis=0))
+    return totals
+
+
+def cached_result(cache_key, compute):
+    """
+    Result of `compute()` kept in the cache of the running totals (bounded, oldest dropped first).
+    """
+    result = _cumulative_cache.get(cache_key)
+    if result is None:
+        result = compute()
+        if len(_cumulative_cache) >= CUMULATIVE_CACHE_SIZE:
+            _cumulative_cache.pop(next(iter(_cumulative_cache)), None)
+        _cumulative_cache[cache_key] = result
+    return result
+
+
+def cumulative_values(cube, key, col_value, start_year=None):
+    """
+    Year x country running totals of a cumulative selection since `start_year`
+    (None: since the first year), from the 'Value' matrix of its annual
+    selection; normalized columns divide the running total by the denominator
+    of each year. Cached per selection and start year. None if not available.
+    """
+    mats = cube['matrices'].get(key[:3] + (ANNUAL_TYPE,), {})
+    if 'Value' not in mats or (col_value != 'Value' and col_value not in cube.get('norms', {})):
+        return None
+    start_pos = start_position(cube, start_year)
+
+    def compute():
+        totals = cumulative_matrix(mats['Value'], start_pos)
+        if col_value == 'Value':
+            return totals
+        return normalize(totals, cube['norms'][col_value][0])
+
+    return cached_result((cube['version'], key, col_value, start_pos), compute)
+
+
+def ranking_scores(matrix, rank_by='value', window=1):
+    """
+    Score of every country for every year, from a year x country matrix.
+
+    Paramètres
+    ----------
+    rank_by : str
+        'value' : valeur de l'année,
+        'change' : variation sur `window` années (x[t] - x[t - window]),
+        'change_pct' : variation relative, en % de |x[t - window]|
+    window : int
+        Nombre d'années de la variation
+
+    Retour
+    ------
+    np.ndarray (n_years, n_countries), NaN when not computable (first years, missing values)
+    """
+    if rank_by == 'value':
+        return matrix
+    scores = np.full(matrix.shape, np.nan)
+    if 0 < window < len(matrix):
+        change = matrix[window:] - matrix[:-window]
+        if rank_by == 'change_pct':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = np.where(matrix[:-window] != 0, 100 * change / np.abs(matrix[:-window]), np.nan)
+        scores[window:] = change
+    return scores
+
+
+def top_n(scores, n, largest=True):
+    """
+    Positions of the `n` largest (or smallest) scores along the last axis,
+    best first, NaN ignored. Works on one year (1-D) or on every year at once (2-D).
+
+    Retour
+    ------
+    (positions, valid) : np.ndarray (..., n) of positions and mask of the non-NaN ones
+    """
+    keyed = np.where(np.isnan(scores), -np.inf, scores if largest else -scores)
+    n = min(n, keyed.shape[-1])
+    if n <= 0:
+        empty = np.zeros(keyed.shape[:-1] + (0,), dtype=int)
+        return empty, empty.astype(bool)
+    # argpartition: O(n_countries) selection, only the n best are sorted
+    part = np.argpartition(-keyed, n - 1, axis=-1)[..., :n]
+    order = np.argsort(-np.take_along_axis(keyed, part, axis=-1), axis=-1, kind='stable')
+    positions = np.take_along_axis(part, order, axis=-1)
+    return positions, np.take_along_axis(keyed, positions, axis=-1) > -np.inf
+
+
+def country_positions(cube, country_codes):
+    """
+    Positions of `country_codes` along the country axis of the cube (-1 if absent).
+    Computed once for the geometry order, then reused by every lookup.
+    """
+    return cube['country_index'].get_indexer(country_codes)
+
+
+def value_columns(cube, key):
+    """
+    Value columns available for one selection (stored and computed on request).
+    """
+    if key[3] == CUMULATIVE_TYPE:
+        mats = cube['matrices'].get(key[:3] + (ANNUAL_TYPE,), {})
+        return ['Value'] + list(cube.get('norms', {})) if 'Value' in mats else []
+    mats = cube['matrices'].get(key, {})
+    lazy = [col for col in cube.get('norms', {}) if col not in mats] if 'Value' in mats else []
+    return list(mats) + lazy
+
+
+def _values(cube, key, col_value, rows=slice(None), start_year=None):
+    """
+    Rows `rows` of the year x country matrix of one selection (None if not available).
+    """
+    if key[3] == CUMULATIVE_TYPE:
+        totals = cumulative_values(cube, key, col_value, start_year)
+        return None if totals is None else totals[rows]
+    mats = cube['matrices'].get(key, {})
+    if col_value in mats:
+        return mats[col_value][rows]
+    if col_value in cube.get('norms', {}) and 'Value' in mats:
+        denominator, _ = cube['norms'][col_value]
+        return normalize(mats['Value'][rows], denominator[rows])
+    return None
+
+
+def cube_lookup(cube, key, col_value, year, positions=None, start_year=None):
+    """
+    Values of one selection for one year, as a float array.
+
+    `key` is a (Category, Indicator, Source, Type) tuple. When `positions`
+    (from `country_positions`) is given, the result follows that country
+    order with NaN for countries absent from the cube. `start_year`: first
+    year of the running totals of a cumulative selection.
+    """
+    n = len(cube['countries']) if positions is None else len(positions)
+    year_pos = cube['year_index'].get_indexer([year])[0]
+    row = _values(cube, key, col_value, year_pos, start_year) if year_pos >= 0 else None
+    if row is None:
+        return np.full(n, np.nan)
+
+    if positions is None:
+        return row
+    return np.where(positions >= 0, row[positions], np.nan)
+
+
+def cube_matrix(cube, key, col_value, positions=None, start_year=None):
+    """
+    Year x country matrix of one selection, in the order of `positions` if given
+    (NaN for countries absent from the cube).
+    """
+    n = len(cube['countries']) if positions is None else len(positions)
+    mat = _values(cube, key, col_value, start_year=start_year)
+    if mat is None:
+        return np.full((len(cube['years']), n), np.nan)
+    if positions is None:
+        return mat
+    return np.where(positions >= 0, mat[:, positions], np.nan)
+
+
+def cube_unit(cube, key, col_unit):
+    """
+    Unit string of one selection ("" if unknown).
+    """
+    units = cube['units'].get(key[:3] + (ANNUAL_TYPE,) if key[3] == CUMULATIVE_TYPE else key, {})
+    if col_unit in units:
+        return units[col_unit]
+    if col_unit in cube.get('norm_units', {}):
+        unit = units.get('Unit', "")
+        return f"{unit}{cube['norm_units'][col_unit]}" if unit else ""
+    return ""
+
+
+def effective_color_range(scale, color_range):
+    """
+    'rank' and 'log' ignore the color range except 'global': their stats are shared.
+    """
+    if scale in ('rank', 'log'):
+        return 'global' if color_range == 'global' else 'raw'
+    return color_range
+
+
+def build_color_stats(cube, scale_options, color_range_options, country_codes=None):
+    """
+    Pre-compute, for every selection, value column, scale and color range,
+    the per-year zmin/zmax, unit multiplier and colorbar tick values.
+    When `country_codes` is given, only those countries (the ones drawn on
+    the map) are taken into account.
+
+    Retour
+    ------
+    {(key, col_value, scale, color_range): dict of arrays (see map_utils.compute_color_stats)}
+    Tick labels are formatted on first lookup and kept in 'ticktext'.
+    """
+    columns = color_columns(cube, country_codes)
+
+    color_stats = {}
+    for key in list(cube['matrices']) + cube.get('cumulative_keys', []):
+        for col_value in value_columns(cube, key):
+            mat = cube_matrix(cube, key, col_value)[:, columns]
+            for scale in scale_options:
+                for color_range in color_range_options:
+                    stats_key = (key, col_value, scale, effective_color_range(scale, color_range))
+                    if stats_key in color_stats:
+                        continue
+                    color_stats[stats_key] = _color_stats(mat, scale, stats_key[3])
+    return color_stats
+
+
+def color_columns(cube, country_codes=None):
+    """
+    Positions of the countries taken into account by the color stats (all if `country_codes` is None).
+    """
+    if country_codes is None:
+        return slice(None)
+    positions = country_positions(cube, pd.unique(np.asarray(country_codes)))
+    return positions[positions >= 0]
+
+
+def _color_stats(matrix, scale, color_range):
+    stats = compute_color_stats(matrix, scale, color_range)
+    stats['ticktext'] = [None] * len(matrix)
+    return stats
+
+
+def lookup_color_stats(cube, key, col_value, scale, color_range, year, start_year=None):
+    """
+    Pre-computed color stats of one map (None if not available). The running
+    totals of a cumulative selection starting after the first year have
+    their own stats, computed on first use and cached with them.
+    """
+    color_range = effective_color_range(scale, color_range)
+    start_pos = start_position(cube, start_year) if key[3] == CUMULATIVE_TYPE else 0
+    if start_pos > 0 and col_value in value_columns(cube, key):
+        columns = cube.get('color_columns', slice(None))
+        stats = cached_result(
+            (cube['version'], key, col_value, start_pos, scale, color_range),
+            lambda: _color_stats(cube_matrix(cube, key, col_value, start_year=start_year)[:, columns], scale, color_range))
+    else:
+        stats = cube.get('color_stats', {}).get((key, col_value, scale, color_range))
+    year_pos = cube['year_index'].get_indexer([year])[0]
+    if stats is None or year_pos < 0:
+        return None
+
+    if stats['ticktext'][year_pos] is None:
+        stats['ticktext'][year_pos] = format_ticks(stats['tickvals'][year_pos])
+    return {
+        'zmin': stats['zmin'][year_pos],
+        'zmax': stats['zmax'][year_pos],
+        'multiplier': stats['multiplier'][year_pos],
+        'tickvals': stats['tickvals'][year_pos],
+        'ticktext': stats['ticktext'][year_pos],
+    }
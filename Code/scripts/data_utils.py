@@ -1,11 +1,12 @@
 import pandas as pd
 from pathlib import Path
 import geopandas as gpd
+from excel_utils import read_excel_sheets
 
 # -----------------------------
 # Fonctions d'importation
 # -----------------------------
-def import_data_raw(data_path, folder="data_raw", n_header=0, sep=',', encoding='utf-8', sheet_name=0):
+def import_data_raw(data_path, folder="data_raw", n_header=0, sep=',', encoding='utf-8', sheet_name=0, cache_dir=None):
     """
     Importation d'un fichier de données (CSV ou Excel) depuis Data/data_raw.
 
@@ -23,6 +24,9 @@ def import_data_raw(data_path, folder="data_raw", n_header=0, sep=',', encoding=
         Encodage du fichier CSV (par défaut : 'utf-8')
     sheet_name : str ou int, optionnel
         Nom ou index de la feuille Excel à lire (par défaut : 0)
+    cache_dir : Path, optionnel
+        Dossier du cache des feuilles Excel converties (voir excel_utils.py) :
+        chaque feuille n'est lue avec openpyxl qu'une fois (par défaut : pas de cache)
     
     Retour
     ------
@@ -36,7 +40,7 @@ def import_data_raw(data_path, folder="data_raw", n_header=0, sep=',', encoding=
     if suffix in ['.csv', '.txt']:
         df = pd.read_csv(data_path, header=n_header, sep=sep, encoding=encoding)
     elif suffix in ['.xls', '.xlsx']:
-        df = pd.read_excel(data_path, header=n_header, sheet_name=sheet_name)
+        df = read_excel_sheets(data_path, sheet_name, n_header=n_header, cache_dir=cache_dir)
     else:
         raise ValueError(f"Format de fichier non pris en charge : {suffix}")
     
@@ -149,7 +153,37 @@ def save_long_dataframe(df, base_path,category=None, indicator=None, source=None
     print(f"DataFrame sauvegardé dans {save_path}")
     return save_path
 
-def concat_intermediate_files(base_path, folder_in="data_intermediate", folder_out="data_final", final_filename="data_final.csv", sep=',', encoding='utf-8'):
+# Schéma des fichiers de data_intermediate (ordre des colonnes du fichier final)
+intermediate_schema = {
+    'Year': 'int64',
+    'Country': 'string',
+    'Value': 'float64',
+    'Unit': 'string',
+    'Category': 'string',
+    'Indicator': 'string',
+    'Source': 'string',
+    'Country_code': 'string',
+}
+
+def validate_chunk(df, schema, source=""):
+    """
+    Vérifie qu'un bloc de lignes respecte `schema` ({colonne: dtype}) et le convertit :
+    colonnes dans l'ordre du schéma, types imposés, colonnes supplémentaires ignorées.
+    Lève ValueError si une colonne manque ou ne peut pas être convertie.
+    """
+    missing = [col for col in schema if col not in df.columns]
+    if missing:
+        raise ValueError(f"{source} : colonnes manquantes {missing}")
+
+    df = df[list(schema)]
+    try:
+        return df.astype(schema)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"{source} : types invalides ({e})") from e
+
+def concat_intermediate_files(base_path, folder_in="data_intermediate", folder_out="data_final", final_filename="data_final.csv",
+                              sep=',', encoding='utf-8', streaming=False, chunksize=100_000, schema=None,
+                              files=None, constants=None, columnar=False):
     """
     Concatène tous les fichiers CSV dans un dossier intermédiaire et sauvegarde le résultat final.
     Affiche les fichiers trouvés et le nombre de lignes par fichier.
@@ -157,9 +191,18 @@ def concat_intermediate_files(base_path, folder_in="data_intermediate", folder_o
     Paramètres :
     - folder_in : dossier contenant les fichiers CSV intermédiaires
     - folder_out : dossier où sauvegarder le fichier final
-    - final_filename : nom du fichier CSV final
+    - final_filename : nom du fichier final (.csv, ou .parquet en mode streaming)
     - sep : séparateur CSV
     - encoding : encodage du fichier
+    - streaming : si True, lit chaque fichier par blocs de `chunksize` lignes et les ajoute
+      au fichier final au fur et à mesure (mémoire bornée par un bloc) ; retourne le chemin
+      du fichier au lieu du DataFrame
+    - schema : {colonne: dtype} vérifié sur chaque bloc (par défaut : intermediate_schema en
+      mode streaming)
+    - files : noms des fichiers de folder_in à fusionner (par défaut : tous les .csv)
+    - constants : {colonne: valeur} ajoutées à chaque ligne (mode streaming)
+    - columnar : écrit aussi la version .feather du fichier final (mode streaming, voir
+      build_columnar_data) sans charger toutes les lignes
     """
     import pandas as pd
     from pathlib import Path
@@ -167,16 +210,28 @@ def concat_intermediate_files(base_path, folder_in="data_intermediate", folder_o
 
     # Construire le chemin des fichiers
     folder_path = base_path / "Data" / folder_in
-    files = glob.glob(str(folder_path / "*.csv"))
+    if files is None:
+        files = sorted(glob.glob(str(folder_path / "*.csv")))
+    else:
+        files = [str(folder_path / f) for f in files]
 
     if not files:
         print(f"Aucun fichier CSV trouvé dans {folder_path}")
         return None
 
+    save_path = base_path / "Data" / folder_out / final_filename
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if streaming:
+        return _concat_streaming(files, save_path, sep, encoding, chunksize, schema or intermediate_schema, constants,
+                                 save_path.with_suffix(".feather") if columnar else None)
+
     print("Fichiers trouvés et nombre de lignes :")
     dfs = []
     for f in files:
         df = pd.read_csv(f, sep=sep, encoding=encoding)
+        if schema is not None:
+            df = validate_chunk(df, schema, f)
         print(f"- {f} : {len(df)} lignes")
         dfs.append(df)
 
@@ -185,14 +240,154 @@ def concat_intermediate_files(base_path, folder_in="data_intermediate", folder_o
     print(f"{len(files)} fichiers fusionnés pour obtenir {len(df_final)} lignes au total.")
 
     # Sauvegarder le résultat final
-    save_path = base_path / "Data" / folder_out / final_filename
-    save_path.parent.mkdir(parents=True, exist_ok=True)
     df_final.to_csv(save_path, sep=sep, index=False, encoding=encoding)
 
     print(f"DataFrame final sauvegardé dans {save_path}")
     return df_final
 
-    import numpy as np
+def _concat_streaming(files, save_path, sep, encoding, chunksize, schema, constants=None, feather_path=None):
+    """
+    Ajoute les fichiers bloc par bloc au fichier final : CSV (append) ou Parquet
+    (un row group par bloc). Les fichiers sont écrits sous un nom temporaire puis
+    renommés, pour ne jamais laisser un fichier final partiel.
+
+    - constants : {colonne: valeur} ajoutées à chaque ligne (ex : {'Type': 'Annual'})
+    - feather_path : écrit aussi la version colonne (voir build_columnar_data) bloc par
+      bloc, avec les types de optimize_dtypes ; les catégories sont lues dans une
+      première passe, pour que tous les blocs partagent le même dictionnaire
+    """
+    import os
+
+    constants = constants or {}
+    tmp_path = save_path.with_name(save_path.name + ".tmp")
+    tmp_feather = feather_path.with_name(feather_path.name + ".tmp") if feather_path else None
+    parquet = save_path.suffix.lower() == ".parquet"
+    columns = list(schema) + list(constants)
+    string_dtypes = {col: dtype for col, dtype in schema.items() if dtype == 'string'}
+    writer = feather_writer = None
+    n_total = 0
+
+    def with_constants(chunk):
+        return chunk.assign(**constants) if constants else chunk
+
+    print("Fichiers trouvés et nombre de lignes :")
+    try:
+        if parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            arrow_schema = pa.Schema.from_pandas(validate_chunk(pd.DataFrame(columns=list(schema)), schema), preserve_index=False)
+            writer = pq.ParquetWriter(tmp_path, arrow_schema)
+        else:
+            pd.DataFrame(columns=columns).to_csv(tmp_path, sep=sep, index=False, encoding=encoding)
+
+        if feather_path:
+            import pyarrow as pa
+            categories = _chunk_categories(files, sep, encoding, chunksize, schema, constants)
+            empty = with_constants(validate_chunk(pd.DataFrame(columns=list(schema)), schema))
+            feather_schema = pa.Schema.from_pandas(_columnar_chunk(empty, categories), preserve_index=False)
+            feather_writer = pa.ipc.new_file(tmp_feather, feather_schema)
+
+        for f in files:
+            n_rows = 0
+            for chunk in pd.read_csv(f, sep=sep, encoding=encoding, chunksize=chunksize, dtype=string_dtypes):
+                chunk = with_constants(validate_chunk(chunk, schema, f))
+                if parquet:
+                    writer.write_table(pa.Table.from_pandas(chunk, schema=arrow_schema, preserve_index=False))
+                else:
+                    chunk.to_csv(tmp_path, sep=sep, index=False, encoding=encoding, mode='a', header=False)
+                if feather_writer is not None:
+                    feather_writer.write_table(pa.Table.from_pandas(_columnar_chunk(chunk, categories),
+                                                                    schema=feather_schema, preserve_index=False))
+                n_rows += len(chunk)
+            print(f"- {f} : {n_rows} lignes")
+            n_total += n_rows
+    except Exception:
+        for w in (writer, feather_writer):
+            if w is not None:
+                w.close()
+        writer = feather_writer = None
+        tmp_path.unlink(missing_ok=True)
+        if tmp_feather:
+            tmp_feather.unlink(missing_ok=True)
+        raise
+    finally:
+        for w in (writer, feather_writer):
+            if w is not None:
+                w.close()
+
+    os.replace(tmp_path, save_path)
+    if feather_path:
+        os.replace(tmp_feather, feather_path)
+        print(f"Données colonne sauvegardées dans {feather_path} ({n_total} lignes)")
+    print(f"{len(files)} fichiers fusionnés pour obtenir {n_total} lignes au total.")
+    print(f"Fichier final sauvegardé dans {save_path}")
+    return save_path
+
+def _chunk_categories(files, sep, encoding, chunksize, schema, constants):
+    """
+    Valeurs de chaque colonne catégorielle (voir optimize_dtypes) sur tous les fichiers, triées.
+    """
+    columns = [col for col in schema if col in categorical_columns or col.startswith('Unit')]
+    values = {col: set() for col in columns}
+    for f in files:
+        for chunk in pd.read_csv(f, sep=sep, encoding=encoding, chunksize=chunksize, usecols=columns,
+                                 dtype={col: 'string' for col in columns}):
+            for col in columns:
+                values[col].update(chunk[col].dropna())
+    categories = {col: sorted(v) for col, v in values.items()}
+    categories.update({col: [value] for col, value in constants.items()})
+    return categories
+
+def _columnar_chunk(chunk, categories):
+    """
+    Bloc avec les types de optimize_dtypes, à catégories fixes (même dictionnaire pour tous
+    les blocs). Les valeurs restent en float64 : optimize_dtypes ne les réduit que sans perte
+    de précision, ce qui ne peut pas se décider bloc par bloc.
+    """
+    chunk = chunk.copy()
+    for col in chunk.columns:
+        if col in categories:
+            chunk[col] = pd.Categorical(chunk[col], categories=categories[col])
+        elif col == 'Year':
+            chunk[col] = chunk[col].astype('int16')
+    return chunk
+
+def add_cumulative(df, group_cols=['Country_code']):
+    """
+    Ajoute Type='Annual' aux lignes et leur version Type='Cumulative'
+    (cumul de 'Value' sur les années, par pays).
+    """
+    df_annual = df.copy()
+    df_annual["Type"] = "Annual"
+
+    df_cum = df.copy()
+    df_cum["Type"] = "Cumulative"
+    df_cum["Value"] = df_cum.sort_values("Year").groupby(group_cols)["Value"].cumsum()
+
+    return pd.concat([df_annual, df_cum], ignore_index=True)
+
+def import_countries_data(base_path, filename="countries_area.csv", folder="countries"):
+    """
+    Importation des données pays x année (population, PIB, surface...) depuis Data/countries,
+    avec les colonnes dérivées utilisées par les normalisations (PIB/hab).
+    """
+    data_path = base_path / "Data" / folder / filename
+    df = pd.read_csv(data_path, keep_default_na=False, na_values=[""])
+    df["countryiso3"] = df["countryiso3"].replace({"NA": "NAM"})  # Namibia, as in Country_code
+
+    df["gdp_percapita"] = df["gdp_current_usd"] / df["population_total"]
+    df["gdp_ppp_percapita"] = df["gdp_ppp_current_intl"] / df["population_total"]
+    if "population_density" not in df.columns:
+        df["population_density"] = df["population_total"] / df["surface_km2"]
+    return df
+
+def import_country_groups(base_path, filename="country_groups.csv", folder="countries"):
+    """
+    Importation des groupes de pays (Grouping, Group, Country_code) depuis Data/countries,
+    ex : Continent / Africa / DZ. Un regroupement ('Continent', 'European Union'...) par valeur de Grouping.
+    """
+    data_path = base_path / "Data" / folder / filename
+    return pd.read_csv(data_path, keep_default_na=False, na_values=[""])  # 'NA' reste un code
 
 def format_scientific(value, precision=2):
     """
@@ -220,10 +415,59 @@ def apply_unit_modifier(unit: str, type_value: str):
         return f"{unit}/year"
     return unit
 
-def import_csv_data(base_path, filename="data_final_all_norm.csv"):
+# Colonnes texte répétées sur chaque ligne -> stockées en catégories
+categorical_columns = ['Country', 'Country_code', 'Unit', 'Category', 'Indicator', 'Source', 'Type']
+
+def optimize_dtypes(df):
+    """
+    Convertit les colonnes texte répétées en 'category' et réduit les types numériques
+    (Year -> int16, valeurs -> float32).
+    """
+    df = df.copy()
+    for col in df.columns:
+        if col in categorical_columns or col.startswith('Unit'):
+            df[col] = df[col].astype('category')
+        elif col == 'Year':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif pd.api.types.is_float_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='float')
+    return df
+
+def build_columnar_data(base_path, filename="data_final_all.csv", folder="data_final", df=None):
+    """
+    Écrit une version colonne (Feather / Arrow IPC, non compressée pour une lecture
+    sans décompression) du fichier CSV final, avec types catégoriels et numériques réduits.
+    `df` : contenu du CSV s'il est déjà en mémoire (évite de le relire).
+
+    Retour
+    ------
+    Path du fichier .feather écrit
+    """
+    csv_path = base_path / "Data" / folder / filename
+    feather_path = csv_path.with_suffix(".feather")
+
+    df = optimize_dtypes(pd.read_csv(csv_path) if df is None else df)
+    df.to_feather(feather_path, compression="uncompressed")
+
+    print(f"Données colonne sauvegardées dans {feather_path} ({len(df)} lignes)")
+    return feather_path
+
+def import_csv_data(base_path, filename="data_final_all.csv"):
+    """
+    Charge le jeu de données final. Utilise la version .feather (lecture plus rapide,
+    sans parsing) si elle existe et n'est pas plus ancienne que le CSV, sinon lit le CSV.
+    """
     filepath = base_path / "Data" / "data_final" / filename
+    feather_path = filepath.with_suffix(".feather")
+
+    if feather_path.exists() and (not filepath.exists() or feather_path.stat().st_mtime >= filepath.stat().st_mtime):
+        try:
+            import pyarrow.feather as feather
+        except ImportError:
+            print("pyarrow non installé : lecture du CSV")
+        else:
+            return feather.read_table(feather_path).to_pandas()
+
     print("Loading data from:", filepath.resolve())  # debug
     df = pd.read_csv(filepath)
     return df
-
-
@@ -0,0 +1,199 @@
+import datetime
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+# Sheets of the Excel workbooks (Global Carbon Budget releases...) converted
+# once to a columnar file (Arrow IPC) keyed by the content hash of the
+# workbook and the sheet name. The cache holds the raw cells of the sheet, as
+# openpyxl returns them: the header row and the type inference of
+# pd.read_excel are applied when reading, so one conversion serves every
+# `n_header` and the result is the same DataFrame as pd.read_excel.
+
+EXCEL_CACHE_FORMAT = 1
+
+# Kind of each cell of a column in the cache
+_EMPTY, _INT, _FLOAT, _STR, _DATETIME, _BOOL = range(6)
+
+_hash_memo = {}
+
+
+def workbook_hash(path):
+    """
+    SHA-256 of a workbook, memoized on (path, size, mtime) within the process.
+    """
+    stat = os.stat(path)
+    memo_key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def sheet_cache_path(cache_dir, path, sheet_name):
+    """
+    Cache file of one sheet: <cache_dir>/<workbook stem>/<hash>_<sheet>.arrow
+    """
+    digest = hashlib.sha1(f"{EXCEL_CACHE_FORMAT}|{workbook_hash(path)}|{sheet_name!r}".encode("utf-8")).hexdigest()
+    safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(sheet_name))[:40]
+    return Path(cache_dir) / Path(path).stem / f"{digest[:16]}_{safe_name}.arrow"
+
+
+def _encode_column(values):
+    kinds = np.full(len(values), _EMPTY, dtype=np.int8)
+    for i, v in enumerate(values):
+        if isinstance(v, (bool, np.bool_)):
+            kinds[i] = _BOOL
+        elif isinstance(v, (int, np.integer)):
+            kinds[i] = _INT
+        elif isinstance(v, (float, np.floating)):
+            kinds[i] = _FLOAT
+        elif isinstance(v, str):
+            kinds[i] = _STR if v != "" else _EMPTY
+        elif isinstance(v, datetime.datetime):
+            kinds[i] = _DATETIME
+        else:
+            raise TypeError(f"type de cellule non pris en charge : {type(v).__name__}")
+
+    columns = {'k': kinds}
+    for kind, suffix, dtype in [(_INT, 'i', 'int64'), (_BOOL, 'i', 'int64'), (_FLOAT, 'f', 'float64')]:
+        if (kinds == kind).any():
+            col = columns.setdefault(suffix, np.zeros(len(values), dtype=dtype))
+            col[kinds == kind] = [values[i] for i in np.flatnonzero(kinds == kind)]
+    if (kinds == _STR).any():
+        columns['s'] = pd.array([v if k == _STR else None for v, k in zip(values, kinds)], dtype="string")
+    if (kinds == _DATETIME).any():
+        columns['t'] = pd.to_datetime(pd.Series([v if k == _DATETIME else None for v, k in zip(values, kinds)],
+                                                dtype=object))
+    return columns
+
+
+def _decode_column(table, i, n_rows):
+    kinds = table[f"c{i}_k"].to_numpy()
+    values = np.full(n_rows, "", dtype=object)
+    for kind, suffix, convert in [(_INT, 'i', int), (_BOOL, 'i', bool), (_FLOAT, 'f', float),
+                                  (_STR, 's', str), (_DATETIME, 't', lambda v: v.to_pydatetime())]:
+        mask = kinds == kind
+        if mask.any():
+            stored = table[f"c{i}_{suffix}"].to_pandas().to_numpy(dtype=object)
+            values[mask] = [convert(v) for v in stored[mask]]
+    return values
+
+
+def convert_sheet(path, sheet_name, cache_dir):
+    """
+    Read one sheet with openpyxl and write its raw cells to the cache.
+
+    Retour
+    ------
+    Path of the cache file
+    """
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    raw = pd.read_excel(path, sheet_name=sheet_name, header=None, dtype=object, na_filter=False)
+    columns = {}
+    for i in range(raw.shape[1]):
+        for suffix, col in _encode_column(raw.iloc[:, i].tolist()).items():
+            columns[f"c{i}_{suffix}"] = col
+    table = pa.table(columns) if columns else pa.table({})
+    table = table.replace_schema_metadata({'shape': f"{raw.shape[0]},{raw.shape[1]}", 'sheet': str(sheet_name)})
+
+    cache_path = sheet_cache_path(cache_dir, path, sheet_name)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    feather.write_feather(table, tmp_path)
+    tmp_path.replace(cache_path)  # several processes may convert the same sheet
+    return cache_path
+
+
+def read_cached_sheet(cache_path, n_header=0):
+    """
+    DataFrame of a converted sheet, as pd.read_excel(header=n_header) returns it.
+    """
+    import pyarrow.feather as feather
+
+    table = feather.read_table(cache_path)
+    n_rows, n_cols = map(int, table.schema.metadata[b'shape'].decode().split(","))
+    if n_rows == 0:
+        return pd.DataFrame()
+    table = {name: table.column(name) for name in table.column_names}
+    cells = np.empty((n_rows, n_cols), dtype=object)
+    for i in range(n_cols):
+        cells[:, i] = _decode_column(table, i, n_rows)
+    # Same parser and settings as pd.read_excel (pandas.io.excel._base)
+    return TextParser(cells.tolist(), header=n_header, skip_blank_lines=False).read()
+
+
+def read_excel_sheets(path, sheet_names, n_header=0, cache_dir=None, workers=1):
+    """
+    Read sheets of a workbook through the cache: the sheets not converted yet
+    are converted first (in `workers` processes), then only the requested
+    sheets are read back from their cache files.
+
+    Paramètres
+    ----------
+    path : Path
+        Classeur .xlsx
+    sheet_names : str, int ou list
+        Feuille(s) à lire (nom ou index, comme pd.read_excel)
+    n_header : int, optionnel
+        Ligne d'en-tête (par défaut : 0)
+    cache_dir : Path, optionnel
+        Dossier du cache (None : lecture directe avec pd.read_excel)
+    workers : int, optionnel
+        Nombre de processus pour convertir les feuilles manquantes
+
+    Retour
+    ------
+    pd.DataFrame for one sheet, {sheet: pd.DataFrame} for a list
+    """
+    single = not isinstance(sheet_names, (list, tuple))
+    names = [sheet_names] if single else list(sheet_names)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        cache_dir = None
+    if cache_dir is None:
+        frames = pd.read_excel(path, header=n_header, sheet_name=names)
+        return frames[names[0]] if single else frames
+
+    paths = {name: sheet_cache_path(cache_dir, path, name) for name in names}
+    missing = [name for name in names if not paths[name].exists()]
+    if len(missing) > 1 and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+            for future in [pool.submit(convert_sheet, path, name, cache_dir) for name in missing]:
+                future.result()
+    else:
+        for name in missing:
+            convert_sheet(path, name, cache_dir)
+
+    frames = {name: read_cached_sheet(paths[name], n_header) for name in names}
+    return frames[names[0]] if single else frames
+
+
+def convert_workbooks(paths, cache_dir, workers=None):
+    """
+    Convert every sheet of the given workbooks (the ones not in the cache yet), in parallel.
+
+    Retour
+    ------
+    (number of sheets converted, number already in the cache)
+    """
+    jobs = []
+    for path in paths:
+        with pd.ExcelFile(path) as xls:
+            jobs += [(path, name) for name in xls.sheet_names]
+    todo = [(path, name) for path, name in jobs if not sheet_cache_path(cache_dir, path, name).exists()]
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for future in [pool.submit(convert_sheet, path, name, cache_dir) for path, name in todo]:
+                future.result()
+    return len(todo), len(jobs) - len(todo)
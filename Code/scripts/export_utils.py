@@ -0,0 +1,320 @@
+import copy
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+from cube_utils import cube_matrix, cube_unit
+from aggregate_utils import group_matrix
+from map_utils import topojson_to_geojson
+from callbacks import build_map_update, start_year
+from metrics_utils import metrics
+from config import country_level
+
+# Exports of one map selection (the inputs of update_map) without the browser:
+# - the data slice behind the map, as CSV or a columnar file (route /export/data, build_data.py export)
+# - the map of every year of a range, as image / HTML / JSON files or one
+#   animated HTML (build_data.py render). Figures are built in a process pool
+#   from the state prepared at startup (see callbacks.build_map_state): with
+#   'fork', the workers share the parent's copy instead of loading it again.
+
+EXPORT_FORMATS = {
+    'csv': "text/csv",
+    'feather': "application/vnd.apache.arrow.file",
+    'parquet': "application/vnd.apache.parquet",
+}
+RENDER_FORMATS = ['html', 'json', 'png', 'svg', 'pdf']  # png / svg / pdf need the kaleido package
+ANIMATION_FORMATS = ['html', 'json']  # one figure with a frame per year: no image format
+
+
+def parse_year(text):
+    """
+    Year of a query parameter (None if absent or empty). Raise ValueError if it is not an integer.
+    """
+    if text in (None, ""):
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Année invalide : {text}") from None
+
+
+def parse_years(text, years):
+    """
+    Years of a range "1990-2020", a single year "2020" or "all" / None (every year of the data).
+    """
+    years = [int(y) for y in years]
+    if text in (None, "", "all"):
+        return years
+    first, _, last = str(text).partition("-")
+    first, last = int(first), int(last or first)
+    selected = [y for y in years if first <= y <= last]
+    if not selected:
+        raise ValueError(f"Aucune année de données entre {first} et {last}")
+    return selected
+
+
+def check_selection(state, norm_map, category, indicator, database, type_value, normalization,
+                    aggregate=country_level):
+    """
+    Raise ValueError if the selection is not one of the map.
+    """
+    cube = state['cube']
+    key = (category, indicator, database, type_value)
+    if normalization not in norm_map:
+        raise ValueError(f"Normalisation inconnue : {normalization} (choix : {', '.join(norm_map)})")
+    if key not in cube['matrices'] and key not in cube.get('cumulative_keys', []):
+        raise ValueError(f"Sélection absente des données : {key}")
+    if aggregate != country_level and aggregate not in state['group_pos']:
+        raise ValueError(f"Regroupement inconnu : {aggregate}")
+
+
+def selection_slice(state, norm_map, category, indicator, database, type_value, normalization,
+                    aggregate=country_level, cumulative_start=None, years=None):
+    """
+    Values behind the map of one selection, in long format: one row per year and
+    country (or group when `aggregate` is a grouping), countries without data left out.
+    """
+    check_selection(state, norm_map, category, indicator, database, type_value, normalization, aggregate)
+    cube = state['cube']
+    key = (category, indicator, database, type_value)
+    col_value, col_unit = norm_map[normalization]
+    start = start_year(type_value, cumulative_start)
+    years = parse_years(None, cube['years']) if years is None else years
+    year_pos = cube['year_index'].get_indexer(years)
+
+    if aggregate in state['group_pos']:
+        matrix = group_matrix(cube, key, col_value, aggregate, start)
+        names = state['group_names'][aggregate]
+        if matrix is None:
+            matrix = np.full((len(cube['years']), len(names)), np.nan)
+        ids = {'Group': np.tile(names, len(years))}
+    else:
+        matrix = cube_matrix(cube, key, col_value, state['country_pos'], start)
+        codes = state['ranking_codes']
+        ids = {'Country_code': np.tile(codes, len(years)),
+               'Country': np.tile([state['country_names'].get(c) for c in codes], len(years))}
+
+    values = matrix[year_pos]
+    df = pd.DataFrame({'Year': np.repeat(years, values.shape[1]), **ids, 'Value': values.ravel()})
+    df = df[df['Value'].notna()].reset_index(drop=True)
+    return df.assign(Category=category, Indicator=indicator, Source=database, Type=type_value,
+                     Normalization=normalization, Unit=cube_unit(cube, key, col_unit),
+                     **({'Cumulative_start': start} if start is not None else {}))
+
+
+def write_slice(df, fmt="csv"):
+    """
+    Bytes of a data slice in `fmt` (see EXPORT_FORMATS).
+    """
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    if fmt == "feather":
+        df.to_feather(buffer)
+    elif fmt == "parquet":
+        df.to_parquet(buffer, index=False)
+    else:
+        raise ValueError(f"Format d'export inconnu : {fmt} (choix : {', '.join(EXPORT_FORMATS)})")
+    return buffer.getvalue()
+
+
+def export_filename(category, indicator, database, type_value, normalization, years, extension):
+    parts = [category, indicator, database, type_value, normalization, f"{years[0]}-{years[-1]}"]
+    return "_".join("".join(c if c.isalnum() else "-" for c in str(p)) for p in parts) + f".{extension}"
+
+
+# --- Static maps ---
+_geojson = {}
+
+
+def map_geojson(state, level=None):
+    """
+    GeoJSON of one level of detail (by default the one the dashboard opens with), decoded once per process.
+    """
+    levels = state['topojson_levels']
+    level = state['default_level'] if level is None else level
+    if level not in _geojson:
+        _geojson[level] = topojson_to_geojson(levels[level])
+    return _geojson[level]
+
+
+def apply_update(figure, update):
+    # Same changes as callbacks.map_patch, on a figure dict
+    trace = figure['data'][0]
+    trace.update(update['trace'])
+    trace['colorbar'].update(update['colorbar'])
+    trace['colorbar']['title']['text'] = update['title']
+    return figure
+
+
+def map_figure(state, norm_map, selection, year, level=None):
+    """
+    Full map figure (geometry included) of one selection and year, as the dashboard shows it.
+
+    Paramètres
+    ----------
+    selection : dict
+        Arguments de callbacks.build_map_update sauf l'année : category, indicator,
+        database, type_value, scale, color_range, normalization, aggregate, cumulative_start
+    """
+    update = build_map_update(state, norm_map, year=year, **selection)
+    figure = apply_update(copy.deepcopy(state['base_figure']), update)
+    figure['data'][0]['geojson'] = map_geojson(state, level)
+    figure['layout']['title'] = dict(text=f"{selection['indicator']} ({selection['database']}) - {year}", x=0.5)
+    figure['layout']['margin'] = dict(l=0, r=0, t=40, b=0)
+    return figure
+
+
+_worker = {}
+
+
+def _init_worker(state, norm_map):
+    _worker['state'], _worker['norm_map'] = state, norm_map
+
+
+def _render_year(selection, year, fmt, out_dir, level, width, height, plotlyjs):
+    figure = map_figure(_worker['state'], _worker['norm_map'], selection, year, level)
+    path = Path(out_dir) / f"map_{year}.{fmt}"
+    if fmt == "html":
+        pio.write_html(figure, path, include_plotlyjs=plotlyjs, validate=False)
+    elif fmt == "json":
+        path.write_text(json.dumps(figure), encoding="utf-8")
+    else:
+        pio.write_image(figure, path, format=fmt, width=width, height=height, validate=False)
+    return path
+
+
+def _year_update(selection, year):
+    return build_map_update(_worker['state'], _worker['norm_map'], year=year, **selection)
+
+
+def animation_figure(state, norm_map, selection, years, updates, level=None):
+    """
+    One figure with a frame per year (slider + play button) from the updates of `build_map_update`.
+    """
+    figure = map_figure(state, norm_map, selection, years[0], level)
+    frames = []
+    for year, update in zip(years, updates):
+        trace = dict(update['trace'], colorbar=dict(update['colorbar'], title=dict(text=update['title'])))
+        frames.append(dict(name=str(year), data=[trace],
+                           layout=dict(title=dict(text=f"{selection['indicator']} ({selection['database']}) - {year}"))))
+    step_args = dict(mode="immediate", frame=dict(duration=300, redraw=True), transition=dict(duration=0))
+    figure['frames'] = frames
+    figure['layout']['sliders'] = [dict(active=0, pad=dict(t=30), steps=[
+        dict(label=f['name'], method="animate", args=[[f['name']], step_args]) for f in frames])]
+    figure['layout']['updatemenus'] = [dict(type="buttons", showactive=False, x=0.05, y=0, xanchor="right", buttons=[
+        dict(label="Play", method="animate", args=[None, dict(step_args, fromcurrent=True)]),
+        dict(label="Pause", method="animate", args=[[None], dict(step_args, mode="immediate")])])]
+    return figure
+
+
+def render_maps(state, norm_map, selection, years, out_dir, fmt="html", animation=False, workers=None, level=None,
+                width=1600, height=900):
+    """
+    Maps of every year of `years` for one selection, built in a process pool.
+
+    Paramètres
+    ----------
+    state : dict
+        Voir callbacks.build_map_state
+    selection : dict
+        Voir map_figure
+    fmt : str
+        Format des fichiers (voir RENDER_FORMATS), un fichier par année
+    animation : bool
+        Un seul fichier animé (une image par année) au lieu d'un fichier par année,
+        au format html ou json (voir ANIMATION_FORMATS)
+    workers : int, optionnel
+        Nombre de processus (par défaut : nombre de CPU)
+    level : float, optionnel
+        Tolérance de la géométrie (voir config.geom_lod_levels ; par défaut : celle de l'ouverture du dashboard)
+
+    Retour
+    ------
+    list of the files written
+    """
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"Format de rendu inconnu : {fmt} (choix : {', '.join(RENDER_FORMATS)})")
+    if animation and fmt not in ANIMATION_FORMATS:
+        raise ValueError(f"Format d'animation inconnu : {fmt} (choix : {', '.join(ANIMATION_FORMATS)})")
+    if fmt in ('png', 'svg', 'pdf') and not animation:
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            raise RuntimeError(f"Le format {fmt} nécessite le package kaleido (pip install kaleido)") from None
+    check_selection(state, norm_map, selection['category'], selection['indicator'], selection['database'],
+                    selection['type_value'], selection['normalization'], selection.get('aggregate', country_level))
+    selection = dict(selection, cumulative_start=start_year(selection['type_value'], selection.get('cumulative_start')))
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # The figure cache (lock, files) stays in the parent; 'fork' shares the rest without copying it
+    worker_state = {k: v for k, v in state.items() if k != 'figure_cache'}
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    n_workers = max(1, min(workers or os.cpu_count(), len(years)))
+
+    plotlyjs = True
+    if fmt == "html" and not animation and len(years) > 1:
+        (out_dir / "plotly.min.js").write_text(get_plotlyjs(), encoding="utf-8")  # shared by every page
+        plotlyjs = "plotly.min.js"
+
+    with metrics.stage('render_maps', 'animation' if animation else fmt):
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(worker_state, norm_map)) as pool:
+            if animation:
+                updates = list(pool.map(_year_update, [selection] * len(years), years))
+            else:
+                futures = [pool.submit(_render_year, selection, year, fmt, out_dir, level, width, height, plotlyjs)
+                           for year in years]
+                return [future.result() for future in futures]
+
+    figure = animation_figure(state, norm_map, selection, years, updates, level)
+    path = out_dir / f"map_{years[0]}-{years[-1]}.{fmt}"
+    if fmt == "json":
+        pio.write_json(figure, path, validate=False)
+    else:
+        pio.write_html(figure, path, include_plotlyjs=True, auto_play=False, validate=False)
+    return [path]
+
+
+def register_export_routes(server, resources, norm_map):
+    """
+    Add to the Flask `server`:
+    - GET /export/data : data slice of one map selection, query parameters
+      category, indicator, database, type (Annual), normalization, aggregate,
+      cumulative_start, years ("1990-2020", default: all) and format (csv, feather, parquet)
+    """
+    from flask import Response, request
+
+    @server.route("/export/data")
+    def _export_data():
+        if not resources.ready():
+            return {"status": resources.status()}, 503
+        state = resources.get()
+        args = request.args
+        fmt = args.get("format", "csv")
+        try:
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f"Format d'export inconnu : {fmt} (choix : {', '.join(EXPORT_FORMATS)})")
+            selection = dict(category=args.get("category"), indicator=args.get("indicator"),
+                             database=args.get("database"), type_value=args.get("type", "Annual"),
+                             normalization=args.get("normalization", next(iter(norm_map))),
+                             aggregate=args.get("aggregate", country_level))
+            cumulative_start = parse_year(args.get("cumulative_start"))
+            years = parse_years(args.get("years"), state['cube']['years'])
+            with metrics.stage('export_data', 'slice'):
+                df = selection_slice(state, norm_map, **selection, cumulative_start=cumulative_start, years=years)
+        except ValueError as error:
+            return {"error": str(error)}, 400
+        with metrics.stage('export_data', fmt):
+            body = write_slice(df, fmt)
+        filename = export_filename(selection['category'], selection['indicator'], selection['database'],
+                                   selection['type_value'], selection['normalization'], years, fmt)
+        return Response(body, mimetype=EXPORT_FORMATS[fmt],
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
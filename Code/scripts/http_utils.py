@@ -0,0 +1,128 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from metrics_utils import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression and cache validators of the Flask server (see register_http_routes).
+# - Callback responses and the layout are compressed (brotli or gzip, as the
+#   client accepts) above a size threshold.
+# - The callbacks listed as deterministic (same inputs -> same response, the
+#   data being static after startup) get an ETag computed from the data
+#   version and the request body, and a Cache-Control max-age. They are POST
+#   requests: browsers never cache nor revalidate them (and dash-renderer
+#   treats a 304 as a callback error), so these headers only serve a reverse
+#   proxy configured to cache POST responses keyed on the body (nginx:
+#   proxy_cache_methods POST; proxy_cache_key "$request_uri|$request_body").
+# - GET responses (layout, dependencies) get an ETag of their content and are
+#   answered 304 when the browser revalidates them.
+# ETags are weak: the same value for every Content-Encoding of a response.
+
+COMPRESSIBLE_TYPES = {"application/json", "text/html", "text/plain", "text/csv", "text/css",
+                      "application/javascript", "text/javascript"}
+DASH_CALLBACK_PATH = "/_dash-update-component"
+
+
+def compress(body, encoding, levels):
+    if encoding == "br":
+        return brotli.compress(body, quality=levels.get("br", 5))
+    return gzip.compress(body, compresslevel=levels.get("gzip", 6), mtime=0)
+
+
+def callback_etag(version, body):
+    """
+    ETag of a callback request: data version + output and input/state values
+    (changedPropIds left out: they do not change the response of these callbacks).
+    """
+    key = json.dumps([version, body.get("output"), body.get("inputs"), body.get("state")],
+                     sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:24]
+
+
+def register_http_routes(server, data_version, deterministic_outputs=(), encodings=("br", "gzip"), min_size=1024,
+                         levels=None, max_age=3600, compressed_cache_size=32):
+    """
+    Add compression and ETag handling to the Flask `server`.
+
+    Paramètres
+    ----------
+    data_version : callable
+        Retourne la version des données chargées (None tant qu'elles se chargent)
+    deterministic_outputs : iterable of str
+        Sorties des callbacks dont la réponse ne dépend que des entrées (ex : 'map_figure.data')
+    encodings : tuple of str
+        Encodages proposés, par ordre de préférence ('br' ignoré si brotli n'est pas installé)
+    min_size : int
+        Taille minimale (octets) d'une réponse compressée
+    levels : dict, optionnel
+        Niveau de compression par encodage, ex : {'gzip': 6, 'br': 5}
+    max_age : int
+        Durée (s) de Cache-Control des réponses des callbacks déterministes
+        (pour un reverse proxy qui met en cache les POST)
+    compressed_cache_size : int
+        Réponses GET compressées gardées en mémoire (bundles JS servis par Dash...)
+    """
+    from flask import request
+
+    deterministic_outputs = set(deterministic_outputs)
+    encodings = [e for e in encodings if e != "br" or brotli is not None]
+    levels = levels or {}
+    compressed_cache = OrderedDict()
+    cache_lock = threading.Lock()
+
+    def callback_response_etag():
+        if request.method != "POST" or not request.path.endswith(DASH_CALLBACK_PATH):
+            return None
+        version = data_version()
+        body = request.get_json(silent=True) or {}
+        if version is None or body.get("output") not in deterministic_outputs:
+            return None
+        return callback_etag(version, body)
+
+    @server.after_request
+    def _compress(response):
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+
+        # --- Validators ---
+        etag = callback_response_etag()
+        if etag is not None:
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = f"max-age={max_age}"
+        elif request.method in ("GET", "HEAD") and "ETag" not in response.headers \
+                and response.mimetype in COMPRESSIBLE_TYPES:
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                metrics.inc('netzero_http_not_modified_total', route="get")
+                return response
+
+        # --- Compression ---
+        if response.mimetype not in COMPRESSIBLE_TYPES or "Content-Encoding" in response.headers:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(encodings) if encodings else None
+        body = response.get_data()
+        if encoding is None or len(body) < min_size:
+            return response
+
+        key = (request.method, hashlib.sha1(body).digest(), encoding) if request.method == "GET" else None
+        with cache_lock:
+            compressed = compressed_cache.get(key) if key else None
+        if compressed is None:
+            with metrics.stage('http', f'compress_{encoding}'):
+                compressed = compress(body, encoding, levels)
+            if key:
+                with cache_lock:
+                    compressed_cache[key] = compressed
+                    while len(compressed_cache) > compressed_cache_size:
+                        compressed_cache.popitem(last=False)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -1,5 +1,16 @@
 from dash import html, dcc
 
+# Country drill-down panel (see callbacks.update_country_panel): hidden until a country is clicked
+country_panel_style = {
+    'flex': '0 0 420px',
+    'padding': '15px',
+    'backgroundColor': '#f8f9fa',
+    'boxShadow': '-2px 0px 5px rgba(0,0,0,0.1)',
+    'height': '100vh',
+    'overflowY': 'auto'
+}
+country_panel_hidden = {'display': 'none'}
+
 def get_layout(
     indicator_options,
     database_options,
@@ -10,17 +21,31 @@ def get_layout(
     year_options,
     scale_options,
     color_range_options,
-    type_options
+    type_options,
+    year_mode_options,
+    default_year_mode,
+    rank_by_options,
+    rank_window_options,
+    rank_size_options,
+    aggregate_options,
+    data_ready=True,
+    base_figure=None
 ):
+    # data_ready=False: data still loading, the dropdowns and the base figure
+    # are filled by the startup_poll callback (see callbacks.poll_startup)
     return html.Div([
         # --- Sidebar ---
         html.Div([
 
+            # Loading message, or the error once loading has failed (see callbacks.poll_startup)
+            html.Div("Loading data…" if not data_ready else None, id="startup_status",
+                     style={'color': '#b00020', 'marginBottom': '10px'}),
+
             html.Label("Category"),  # <-- Nouveau Dropdown
             dcc.Dropdown(
                 id="category",
                 options=[{"label": i, "value": i} for i in category_options],
-                value=category_options[0] if category_options.size > 0 else None,
+                value=category_options[0] if len(category_options) > 0 else None,
                 placeholder="Category",
                 style={'marginBottom': '20px'}
             ),
@@ -52,6 +77,15 @@ def get_layout(
                 style={'marginBottom': '20px'}
             ),
 
+            html.Label("Regions"),
+            dcc.Dropdown(
+                id="aggregate",
+                options=aggregate_options,
+                value=aggregate_options[0],
+                clearable=False,
+                style={'marginBottom': '20px'}
+            ),
+
             html.Label("Type"),
             dcc.Dropdown(
                 id="type",
@@ -61,6 +95,15 @@ def get_layout(
                 style={'marginBottom': '20px'}
             ),
 
+            html.Label("Cumulative since"),
+            dcc.Dropdown(
+                id="cumulative_start",
+                options=[{"label": str(int(y)), "value": int(y)} for y in year_options],
+                value=None,
+                placeholder="First year",
+                style={'marginBottom': '20px'}
+            ),
+
             html.Label("Scale"),
             dcc.Dropdown(
                 id="scale",
@@ -78,6 +121,23 @@ def get_layout(
                 placeholder="Color Range",
                 style={'marginBottom': '20px'}
             ),
+
+            html.Label("Year slider"),
+            dcc.RadioItems(
+                id="year_mode",
+                options=year_mode_options,
+                value=default_year_mode,
+                style={'marginBottom': '20px'}
+            ),
+
+            # --- Client-side stores ---
+            dcc.Store(id="server_year"),
+            dcc.Store(id="year_frames"),
+            dcc.Store(id="geo_level"),
+            dcc.Store(id="geo_topology"),
+            dcc.Store(id="map_figure", data=base_figure),
+            dcc.Store(id="data_ready", data=data_ready),
+            dcc.Interval(id="startup_poll", interval=500, disabled=data_ready),
         ], style={
             'flex': '0 0 250px',
             'padding': '15px',
@@ -92,7 +152,7 @@ def get_layout(
             html.Div([
                 dcc.Graph(
                     id="world_map",
-                    style={'height': '85vh', 'width': '80vw', 'margin': '0 auto'}
+                    style={'height': '85vh', 'width': '100%', 'margin': '0 auto'}
                 )
             ], style={'display': 'flex', 'justifyContent': 'center', 'alignItems': 'center', 'height': '85vh'}),
 
@@ -111,6 +171,32 @@ def get_layout(
                     value=last_year,
                     tooltip={"placement": "bottom", "always_visible": False},
                 )
-            ], style={'width': '60%', 'margin': '10px auto 0 auto', 'padding': '0'})
-        ], style={'flex': '1', 'padding': '0px'}),
+            ], style={'width': '60%', 'margin': '10px auto 0 auto', 'padding': '0'}),
+
+            # --- Ranking (top N of the selection, for the slider year) ---
+            html.Div([
+                html.Div([
+                    dcc.RadioItems(id="rank_by", options=rank_by_options, value=rank_by_options[0]["value"],
+                                   inline=True, style={'marginRight': '20px'}),
+                    dcc.RadioItems(id="rank_order", options=[{"label": "Top", "value": "top"},
+                                                             {"label": "Bottom", "value": "bottom"}],
+                                   value="top", inline=True, style={'marginRight': '20px'}),
+                    html.Label("Countries", style={'marginRight': '5px'}),
+                    dcc.Dropdown(id="rank_size", options=rank_size_options, value=rank_size_options[1],
+                                 clearable=False, style={'width': '80px', 'marginRight': '20px'}),
+                    html.Label("Window (years)", style={'marginRight': '5px'}),
+                    dcc.Dropdown(id="rank_window", options=rank_window_options, value=rank_window_options[2],
+                                 clearable=False, style={'width': '80px'}),
+                ], style={'display': 'flex', 'alignItems': 'center', 'flexWrap': 'wrap'}),
+                dcc.Graph(id="ranking", config={'displayModeBar': False}, style={'height': '60vh'})
+            ], style={'width': '90%', 'margin': '30px auto'})
+        ], style={'flex': '1', 'padding': '0px', 'minWidth': '0', 'height': '100vh', 'overflowY': 'auto'}),
+
+        # --- Country drill-down (all years, all sources) ---
+        html.Div([
+            html.Button("×", id="country_close", n_clicks=0,
+                        style={'float': 'right', 'border': 'none', 'background': 'none', 'fontSize': '24px', 'cursor': 'pointer'}),
+            html.H3(id="country_title", style={'marginTop': '0'}),
+            dcc.Graph(id="country_series", config={'displayModeBar': False}, style={'height': '60vh'})
+        ], id="country_panel", style=country_panel_hidden),
     ], style={'display': 'flex', 'flexDirection': 'row', 'height': '100vh'})
@@ -1,9 +1,11 @@
+import base64
+import functools
+import json
+import warnings
 import numpy as np
-
-def symlog(x):
-    if np.isnan(x):
-        return None
-    return np.sign(x) * np.log10(abs(x) + 1)
+import shapely
+from plotly.colors import get_colorscale
+from scale_utils import transform_values
 
 def simplify_geom(geom, tol=0.1):
     if geom is None:
@@ -13,3 +15,387 @@ def simplify_geom(geom, tol=0.1):
     elif geom.geom_type == 'MultiPolygon':
         return type(geom)([poly.simplify(tol, preserve_topology=True) for poly in geom.geoms])
     return geom
+
+def clean_coverage(geoms):
+    """
+    Make the polygons a clean coverage (no overlaps, identical shared edges).
+    Returns None if this shapely version cannot simplify coverages.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    polygonal = np.array([g is not None and g.geom_type in ('Polygon', 'MultiPolygon') for g in geoms], dtype=bool)
+    if not polygonal.any() or not hasattr(shapely, 'coverage_simplify'):
+        return None
+
+    coverage = geoms[polygonal]
+    if not shapely.coverage_is_valid(coverage):
+        if not hasattr(shapely, 'coverage_clean'):
+            return None
+        coverage = shapely.coverage_clean(coverage)
+
+    result = geoms.copy()
+    result[polygonal] = coverage
+    return result
+
+def simplify_coverage(geoms, tol=0.1, cleaned=None):
+    """
+    Simplify all geometries together so that borders shared by two countries
+    stay identical (no gaps or overlaps). `cleaned` is the output of
+    `clean_coverage(geoms)` when already computed. Without coverage support
+    (shapely < 2.2 for unclean inputs), each geometry is simplified on its own.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if cleaned is None:
+        cleaned = clean_coverage(geoms)
+    if cleaned is None:
+        return np.array([simplify_geom(g, tol=tol) for g in geoms], dtype=object)
+
+    polygonal = np.array([g is not None and g.geom_type in ('Polygon', 'MultiPolygon') for g in cleaned], dtype=bool)
+    result = cleaned.copy()
+    result[polygonal] = shapely.coverage_simplify(cleaned[polygonal], tol)
+    return result
+
+def build_geometry_levels(gdf, tolerances):
+    """
+    Geometry levels of detail: {tolerance: GeoDataFrame simplified with this tolerance}.
+    """
+    geoms = gdf['geometry'].to_numpy()
+    cleaned = clean_coverage(geoms)
+    levels = {}
+    for tol in tolerances:
+        gdf_level = gdf.copy()
+        gdf_level['geometry'] = simplify_coverage(geoms, tol, cleaned=cleaned)
+        levels[tol] = gdf_level
+    return levels
+
+def lod_tolerance(projection_scale, lod_levels):
+    """
+    Simplification tolerance to use at a given geo projection scale (zoom).
+    `lod_levels` is a list of (minimum projection scale, tolerance), by increasing scale.
+    """
+    tol = lod_levels[0][1]
+    for min_scale, level_tol in lod_levels:
+        if projection_scale is not None and projection_scale >= min_scale:
+            tol = level_tol
+    return tol
+
+def build_geojson(gdf, id_col='Country_code'):
+    """
+    Serialize the geometry once into a GeoJSON dict keyed by `id_col`.
+    Only the id property is kept; figures match it through featureidkey.
+    Features sharing the same id are merged into one geometry.
+    """
+    gdf_geo = gdf[[id_col, 'geometry']]
+    if gdf_geo[id_col].duplicated().any():
+        gdf_geo = gdf_geo.dissolve(by=id_col, as_index=False)
+    return json.loads(gdf_geo.to_json(drop_id=True))
+
+def _quantized_rings(geom, translate, scale):
+    """
+    Rings of a (Multi)Polygon as integer coordinates on the quantization grid:
+    [[exterior, *holes] for each polygon], without the closing point.
+    Consecutive duplicate points and rings collapsed by the quantization are dropped.
+    """
+    if geom is None or geom.is_empty or geom.geom_type not in ('Polygon', 'MultiPolygon'):
+        return []
+    polygons = []
+    for poly in (geom.geoms if geom.geom_type == 'MultiPolygon' else [geom]):
+        rings = []
+        for ring in [poly.exterior, *poly.interiors]:
+            coords = np.round((np.asarray(ring.coords)[:, :2] - translate) / scale).astype(np.int64)
+            keep = np.r_[True, np.any(coords[1:] != coords[:-1], axis=1)]
+            coords = coords[keep][:-1]
+            if len(coords) < 3:
+                if not rings:
+                    break  # exterior collapsed: drop the whole polygon
+                continue
+            rings.append(coords)
+        if rings:
+            polygons.append(rings)
+    return polygons
+
+def build_topojson(gdf, id_col='Country_code', quantization=1e5):
+    """
+    Encode the geometry as a TopoJSON topology (object 'countries').
+
+    Coordinates are quantized on a `quantization` x `quantization` grid and
+    delta-encoded, and a border shared by two countries is stored once as an
+    arc referenced by both. The browser converts it back to GeoJSON (assets/geometry.js).
+    """
+    gdf_geo = gdf[[id_col, 'geometry']]
+    if gdf_geo[id_col].duplicated().any():
+        gdf_geo = gdf_geo.dissolve(by=id_col, as_index=False)
+
+    x0, y0, x1, y1 = gdf_geo.total_bounds
+    translate = np.array([x0, y0])
+    scale = np.array([(x1 - x0) / (quantization - 1) or 1, (y1 - y0) / (quantization - 1) or 1])
+    shapes = [_quantized_rings(geom, translate, scale) for geom in gdf_geo['geometry']]
+    rings = [ring for polygons in shapes for rings in polygons for ring in rings]
+
+    # A point is a junction when the rings going through it do not all have the same neighbours
+    grid = np.int64(quantization)
+    keys = [ring[:, 0] * grid + ring[:, 1] for ring in rings]
+    is_junction = []
+    if rings:
+        points = np.concatenate(keys)
+        prev_points = np.concatenate([np.roll(k, 1) for k in keys])
+        next_points = np.concatenate([np.roll(k, -1) for k in keys])
+        neighbours = np.unique(np.stack([points, np.minimum(prev_points, next_points),
+                                         np.maximum(prev_points, next_points)], axis=1), axis=0)
+        candidates, counts = np.unique(neighbours[:, 0], return_counts=True)
+        is_junction = np.split(np.isin(points, candidates[counts > 1]), np.cumsum([len(k) for k in keys])[:-1])
+
+    arcs, arc_index = [], {}
+
+    def arc_ref(coords):
+        key = coords.tobytes()
+        if key in arc_index:
+            return arc_index[key]
+        reversed_key = coords[::-1].tobytes()
+        if reversed_key in arc_index:
+            return ~arc_index[reversed_key]
+        arc_index[key] = len(arcs)
+        arcs.append(coords)
+        return arc_index[key]
+
+    def encode_ring(ring, ring_keys, ring_junctions):
+        cuts = np.flatnonzero(ring_junctions)
+        if len(cuts) == 0:
+            # Ring without junction (island, enclave): one arc starting at its smallest point
+            ring = np.roll(ring, -np.argmin(ring_keys), axis=0)
+            return [arc_ref(np.vstack([ring, ring[:1]]))]
+        ring = np.roll(ring, -cuts[0], axis=0)
+        ring = np.vstack([ring, ring[:1]])
+        bounds = np.r_[cuts - cuts[0], len(ring) - 1]
+        return [arc_ref(ring[start:end + 1]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    encoded_rings = iter([encode_ring(*args) for args in zip(rings, keys, is_junction)])
+    geometries = []
+    for code, polygons in zip(gdf_geo[id_col], shapes):
+        encoded = [[next(encoded_rings) for _ in rings] for rings in polygons]
+        geometry = {'type': None} if not encoded else (
+            {'type': 'Polygon', 'arcs': encoded[0]} if len(encoded) == 1 else
+            {'type': 'MultiPolygon', 'arcs': encoded})
+        geometry['properties'] = {id_col: code}
+        geometries.append(geometry)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': scale.tolist(), 'translate': translate.tolist()},
+        'objects': {'countries': {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': [np.vstack([arc[:1], np.diff(arc, axis=0)]).tolist() for arc in arcs],
+    }
+
+def topojson_to_geojson(topology, id_col='Country_code'):
+    """
+    GeoJSON FeatureCollection of a topology built by `build_topojson`
+    (same decoding as assets/geometry.js), for the figures rendered server-side.
+    """
+    scale = np.array(topology['transform']['scale'])
+    translate = np.array(topology['transform']['translate'])
+    arcs = [np.cumsum(np.array(arc, dtype=float).reshape(-1, 2), axis=0) * scale + translate
+            for arc in topology['arcs']]
+
+    def ring(indexes):
+        parts = [arcs[~i][::-1] if i < 0 else arcs[i] for i in indexes]
+        return np.vstack([parts[0]] + [part[1:] for part in parts[1:]]).tolist()
+
+    features = []
+    for g in topology['objects']['countries']['geometries']:
+        if g['type'] == 'Polygon':
+            geometry = {'type': 'Polygon', 'coordinates': [ring(r) for r in g['arcs']]}
+        elif g['type'] == 'MultiPolygon':
+            geometry = {'type': 'MultiPolygon', 'coordinates': [[ring(r) for r in p] for p in g['arcs']]}
+        else:
+            geometry = None
+        features.append({'type': 'Feature', 'properties': g['properties'], 'geometry': geometry})
+    return {'type': 'FeatureCollection', 'features': features}
+
+def nanquantile_rows(matrix, q):
+    """
+    Linear-interpolated quantile `q` of each row, ignoring NaN (same result as
+    np.nanquantile(matrix, q, axis=1) without its per-row Python loop).
+    """
+    sorted_rows = np.sort(matrix, axis=1)  # NaN sorted last
+    n_valid = np.sum(~np.isnan(matrix), axis=1)
+    pos = q * np.maximum(n_valid - 1, 0)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, np.maximum(n_valid - 1, 0))
+    rows = np.arange(matrix.shape[0])
+    a, b = sorted_rows[rows, lo], sorted_rows[rows, hi]
+    t = pos - lo
+    # Same interpolation as numpy (stable for t >= 0.5)
+    diff = b - a
+    result = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+    result = np.where(a == b, a, result)
+    return np.where(n_valid > 0, result, np.nan)
+
+def color_range_bounds(matrix, color_range):
+    """
+    Raw color bounds (before unit scaling) for each row of a year x country matrix.
+    'global' uses the bounds over all rows, so the scale is the same every year.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # rows without any data
+        if color_range == 'raw':
+            return np.nanmin(matrix, axis=1), np.nanmax(matrix, axis=1)
+        if color_range == 'global':
+            n = matrix.shape[0]
+            return np.full(n, np.nanmin(matrix)), np.full(n, np.nanmax(matrix))
+        if color_range.startswith("q"):
+            q_low = float(color_range[1:])
+            q_high = 1 - q_low
+            return nanquantile_rows(matrix, q_low), nanquantile_rows(matrix, q_high)
+        if color_range.startswith("*"):
+            factor = float(color_range[1:])
+            return factor * np.nanmin(matrix, axis=1), factor * np.nanmax(matrix, axis=1)
+    raise ValueError("color_range must be 'raw', 'global', 'q0.xx', or '*0.xx'")
+
+def unit_multiplier(zborne):
+    """
+    Multiplier (1, 1e3, 1e6 or 1e9) used to display values of magnitude `zborne`.
+    """
+    zborne = np.asarray(zborne, dtype=float)
+    return np.select([zborne >= 1e9, zborne >= 1e6, zborne >= 1e3], [1e9, 1e6, 1e3], default=1.0)
+
+def unit_prefix(multiplier):
+    return {1e9: "G", 1e6: "M", 1e3: "k"}.get(float(multiplier), "")
+
+def colorbar_tickvals(zmin, zmax, scale):
+    """
+    Colorbar tick values for each (zmin, zmax) pair -> array (n, 9).
+    """
+    zmin, zmax = np.atleast_1d(zmin).astype(float), np.atleast_1d(zmax).astype(float)
+    if scale == 'absolute':
+        neg_ticks = np.linspace(zmin, 0, 5, axis=-1)[:, :-1]
+        pos_ticks = np.linspace(0, zmax, 5, axis=-1)[:, 1:]
+        return np.concatenate([neg_ticks, np.zeros((len(zmin), 1)), pos_ticks], axis=1)
+    return np.linspace(zmin, zmax, 9, axis=-1)
+
+def format_ticks(tickvals):
+    ticktext = []
+    for v in tickvals:
+        abs_v = abs(v)
+        if abs_v > 100:
+            ticktext.append(f"{int(round(v))}")
+        elif abs_v > 10:
+            ticktext.append(f"{round(v,1)}")
+        else:
+            ticktext.append(f"{round(v,2)}")
+    return ticktext
+
+def compute_color_stats(matrix, scale='relative', color_range='raw'):
+    """
+    zmin/zmax, unit multiplier and colorbar tick values for every row
+    (year) of a year x country matrix.
+
+    The color range only applies to the 'absolute' and 'relative' scales;
+    'rank' and 'log' use the full range of their transformed values
+    ('global' still makes it the same for every year).
+
+    Retour
+    ------
+    dict of arrays: 'zmin', 'zmax', 'multiplier' (n_years,) and 'tickvals' (n_years, 9)
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    n = matrix.shape[0]
+
+    if scale in ('absolute', 'relative'):
+        zmin_raw, zmax_raw = color_range_bounds(matrix, color_range)
+        zborne = np.maximum(np.abs(zmin_raw), np.abs(zmax_raw))
+        multiplier = unit_multiplier(zborne)
+        if scale == 'absolute':
+            zmin, zmax = -zborne / multiplier, zborne / multiplier
+        else:
+            zmin, zmax = zmin_raw / multiplier, zmax_raw / multiplier
+
+    elif scale in ('rank', 'log'):
+        z_plot = transform_values(matrix, scale)
+        zmin, zmax = color_range_bounds(z_plot, 'global' if color_range == 'global' else 'raw')
+        multiplier = np.ones(n)
+
+    else:
+        raise ValueError("scale must be 'absolute', 'relative', 'rank', or 'log'")
+
+    return dict(zmin=zmin, zmax=zmax, multiplier=multiplier, tickvals=colorbar_tickvals(zmin, zmax, scale))
+
+def compute_map_values(z_values, unit="", scale='relative', color_range='raw', type_value="Annual", color_stats=None,
+                       transformed=False):
+    """
+    Values, color range and colorbar of one map (one selection, one year).
+
+    Paramètres
+    ----------
+    z_values : array-like
+        Valeurs par pays (NaN si pas de donnée)
+    unit : str
+        Unité des valeurs (ex : "tC")
+    scale : str
+        'absolute', 'relative', 'rank' ou 'log'
+    color_range : str
+        'raw', 'global', 'q0.xx' ou '*0.xx'
+    type_value : str
+        'Annual' ajoute '/year' à l'unité
+    color_stats : dict, optionnel
+        Bornes pré-calculées pour cette année (zmin, zmax, multiplier, tickvals
+        et éventuellement ticktext). Calculées à partir de z_values si absent.
+    transformed : bool
+        z_values déjà transformés pour `scale` (ex : rangs des groupes répartis
+        sur leurs pays, qui ne doivent pas être re-classés pays par pays)
+
+    Retour
+    ------
+    dict with keys 'z', 'zmin', 'zmax', 'zmid', 'colorscale', 'tickvals',
+    'ticktext', 'unit_label' and 'no_data'
+    """
+    z_values = np.asarray(z_values, dtype=float)
+    if np.isnan(z_values).all():
+        return dict(z=np.zeros(len(z_values)), zmin=0, zmax=1, zmid=None,
+                    colorscale=[[0, 'lightgray'], [1, 'lightgray']],
+                    tickvals=[], ticktext=[], unit_label="", no_data=True)
+
+    if color_stats is None:
+        stats = compute_color_stats(z_values[None, :], scale, color_range)
+        color_stats = {k: v[0] for k, v in stats.items()}
+
+    multiplier = color_stats['multiplier']
+    z_plot_scaled = z_values if transformed else transform_values(z_values, scale, multiplier)
+    colorscale_to_use = 'YlOrBr' if scale == 'rank' else 'RdYlGn_r'
+
+    unit_label = f"{unit_prefix(multiplier)}{unit}"
+    if type_value == "Annual":
+        unit_label = f"{unit_label}/year"
+
+    ticktext = color_stats.get('ticktext') or format_ticks(color_stats['tickvals'])
+
+    return dict(z=z_plot_scaled, zmin=color_stats['zmin'], zmax=color_stats['zmax'],
+                zmid=0 if scale == 'absolute' else None,
+                colorscale=colorscale_to_use, tickvals=color_stats['tickvals'], ticktext=ticktext,
+                unit_label=unit_label, no_data=False)
+
+def encode_values(values):
+    """
+    Plotly.js typed array {'dtype': 'f4', 'bdata': base64} of float32 values
+    (NaN kept): half the size of Plotly's default float64 encoding, enough for
+    the colors and the 2-decimal hover.
+    """
+    data = np.asarray(values, dtype='<f4').tobytes()
+    return {'dtype': 'f4', 'bdata': base64.b64encode(data).decode("ascii")}
+
+def colorscale_values(colorscale):
+    """
+    Colorscale as a list of [position, color] (Plotly.js does not know every
+    name Plotly accepts, e.g. 'RdYlGn_r').
+    """
+    if isinstance(colorscale, str):
+        return _named_colorscale(colorscale)
+    return [list(c) for c in colorscale]
+
+@functools.lru_cache(maxsize=None)
+def _named_colorscale(name):
+    return get_colorscale(name)  # ~2 ms per call, half of an update_map render
+
+def compact_values(values, digits=6):
+    """
+    JSON-friendly list of floats rounded to `digits` significant digits (None for NaN).
+    """
+    return [None if np.isnan(v) else float(f"{v:.{digits}g}") for v in np.asarray(values, dtype=float)]
@@ -0,0 +1,181 @@
+import bisect
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Time spent in each stage of the callbacks, kept in memory by each worker and
+# exposed in the Prometheus text format (see register_metrics_routes). With
+# several gunicorn workers, every scrape of /metrics reads one worker: the
+# 'worker' label (pid) keeps their series apart.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'netzero_callback_stage_seconds': ('histogram', "Time spent in one stage of a callback"),
+    'netzero_callback_calls_total': ('counter', "Calls of a callback"),
+    'netzero_request_seconds': ('histogram', "Duration of a callback request, Dash serialization included"),
+    'netzero_response_bytes_total': ('counter', "Bytes of the callback responses"),
+    'netzero_figure_cache_total': ('counter', "Figure cache lookups by result (hit, disk_hit, miss)"),
+    'netzero_http_not_modified_total': ('counter', "Requests answered 304 Not Modified (see http_utils.py)"),
+}
+
+
+class Metrics:
+    """
+    Counters and histograms of one process, identified by a metric name
+    (see METRICS) and labels.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts, total = self._histograms.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._histograms[key] = (counts, total + value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def stage(self, callback, stage):
+        """
+        Context manager timing one stage of a callback.
+        """
+        return self.timer('netzero_callback_stage_seconds', callback=callback, stage=stage)
+
+    def render(self, extra_counters=()):
+        """
+        Prometheus text exposition (format 0.0.4) of every metric.
+        `extra_counters`: (name, labels, value) computed at scrape time.
+        """
+        worker = (('worker', str(os.getpid())),)
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (list(c), t) for k, (c, t) in self._histograms.items()}
+        for name, labels, value in extra_counters:
+            counters[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels + worker)} {value}")
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + worker + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels + worker)} {total}")
+                lines.append(f"{name}_count{_labels(labels + worker)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+# Registry of this process, shared by the callbacks and the /metrics route
+metrics = Metrics()
+
+
+def register_metrics_routes(server, cache_stats=None, profile_dir=None):
+    """
+    Add to the Flask `server`:
+    - GET /metrics : Prometheus text format
+    - the duration and size of every Dash callback request (netzero_request_seconds, ...)
+    - if `profile_dir` is given: a request sent with the header 'X-Profile: 1',
+      or the next callback request after GET /profile/next, is run under cProfile
+      and its stats dumped to `profile_dir` (open with pstats or snakeviz)
+
+    Paramètres
+    ----------
+    cache_stats : callable, optionnel
+        Retourne les compteurs du cache de figures (FigureCache.stats()) ou None
+    """
+    from flask import Response, g, request
+
+    profile_next = threading.Event()
+
+    def callback_name():
+        # Output(s) of the Dash callback, e.g. 'map_figure.data'
+        if request.path.endswith("/_dash-update-component"):
+            body = request.get_json(silent=True) or {}
+            return body.get("output", "unknown").strip(".").split("@")[0]
+        return None
+
+    @server.before_request
+    def _start_request():
+        g.netzero_callback = callback_name()
+        if g.netzero_callback is None:
+            return
+        g.netzero_t0 = time.perf_counter()
+        g.netzero_profiler = None
+        if profile_dir and (request.headers.get("X-Profile") == "1" or profile_next.is_set()):
+            profile_next.clear()
+            g.netzero_profiler = cProfile.Profile()
+            g.netzero_profiler.enable()
+
+    def stop_profiler():
+        # Disable and dump the profiler of the request, if any (None otherwise)
+        profiler = g.pop("netzero_profiler", None)
+        if profiler is None:
+            return None
+        profiler.disable()
+        stamp = time.strftime('%Y%m%d-%H%M%S') + f"{time.time() % 1:.3f}"[1:]
+        path = Path(profile_dir) / f"{g.netzero_callback.replace('.', '_')[:80]}-{stamp}-{os.getpid()}.prof"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        return path
+
+    @server.after_request
+    def _end_request(response):
+        callback = getattr(g, "netzero_callback", None)
+        if callback is None:
+            return response
+        path = stop_profiler()
+        if path is not None:
+            response.headers["X-Profile-File"] = path.name
+        metrics.observe('netzero_request_seconds', time.perf_counter() - g.netzero_t0, callback=callback)
+        metrics.inc('netzero_response_bytes_total', response.calculate_content_length() or 0, callback=callback)
+        return response
+
+    @server.teardown_request
+    def _stop_profiler(exception):
+        # after_request is skipped when the request raises: never leave cProfile enabled in the worker
+        stop_profiler()
+
+    @server.route("/metrics")
+    def _metrics():
+        stats = cache_stats() if cache_stats else None
+        extra = [('netzero_figure_cache_total', {'result': result}, stats[key])
+                 for result, key in [('hit', 'hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses')]] if stats else []
+        return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+    if profile_dir:
+        @server.route("/profile/next")
+        def _profile_next():
+            profile_next.set()
+            return {"status": "the next callback request will be profiled", "dir": str(profile_dir)}
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+# Normalizations (per area, population, GDP...) computed on request from the
+# country x year denominators of Data/countries, instead of being stored as
+# Value_norm_* / Unit_norm_* columns on every row of the final dataset.
+
+
+def norm_columns(name):
+    """
+    (value column, unit column) of the normalization `name`, as used in norm_map.
+    """
+    return f"Value_norm_{name}", f"Unit_norm_{name}"
+
+
+def build_denominators(df_countries, norm_specs, countries, years, code_col='countryiso3'):
+    """
+    Denominators aligned on the (years, countries) axes of the data cube.
+
+    Paramètres
+    ----------
+    df_countries : pd.DataFrame
+        Données pays x année (voir data_utils.import_countries_data)
+    norm_specs : dict
+        {nom: (libellé, colonne, diviseur, suffixe d'unité)}
+    countries, years : array-like
+        Axes des matrices
+
+    Retour
+    ------
+    {name: np.ndarray (n_years, n_countries)} = column / divisor,
+    NaN where the denominator is missing or zero
+    """
+    year_pos = pd.Index(years).get_indexer(df_countries['Year'])
+    country_pos = pd.Index(countries).get_indexer(df_countries[code_col])
+    rows = (year_pos >= 0) & (country_pos >= 0)
+
+    denominators = {}
+    for name, (_, col, divisor, _) in norm_specs.items():
+        mat = np.full((len(years), len(countries)), np.nan)
+        mat[year_pos[rows], country_pos[rows]] = df_countries[col].to_numpy(dtype=float, na_value=np.nan)[rows] / divisor
+        mat[mat == 0] = np.nan  # x / 0 -> no data, not inf
+        denominators[name] = mat
+    return denominators
+
+
+def normalize(values, denominator):
+    """
+    values / denominator, NaN where either is missing.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.asarray(values, dtype=float) / denominator
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def normalize_frame(df, df_countries, norm_specs, code_col='countryiso3'):
+    """
+    Add the Value_norm_* / Unit_norm_* columns to a long-format DataFrame
+    (export of a fully materialized file). The denominators are looked up by
+    position on (Country_code, Year), without merging the two tables.
+    """
+    df = df.copy()
+    ref = df_countries.drop_duplicates([code_col, 'Year']).set_index([code_col, 'Year'])
+    rows = ref.index.get_indexer(pd.MultiIndex.from_arrays([df['Country_code'], df['Year']]))
+    found = rows >= 0
+
+    values = df['Value'].to_numpy(dtype=float, na_value=np.nan)
+    for name, (_, col, divisor, suffix) in norm_specs.items():
+        denominator = np.full(len(df), np.nan)
+        denominator[found] = ref[col].to_numpy(dtype=float, na_value=np.nan)[rows[found]] / divisor
+        denominator[denominator == 0] = np.nan
+        col_value, col_unit = norm_columns(name)
+        df[col_value] = normalize(values, denominator)
+        df[col_unit] = df['Unit'] + suffix
+    return df
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pyarrow.feather as feather
+from data_utils import (import_data_raw, clean_year_column, melt_long_format, save_long_dataframe,
+                        add_cumulative, import_countries_data, concat_intermediate_files)
+from norm_utils import normalize_frame
+
+# Raw tables -> Data/data_intermediate (one CSV per source, in parallel)
+#            -> Data/data_final/data_final_all.csv (Annual only, + .feather for the app, which
+#               computes the Cumulative type on request: cube_utils.cumulative_values)
+#            -> Data/data_final/data_final_all_norm.csv (+ Cumulative rows and Value_norm_* columns,
+#               optional, for the notebooks)
+# A manifest keeps the content hash of every input: unchanged sources are skipped.
+
+MANIFEST_NAME = "pipeline_manifest.json"
+FINAL_FORMAT = 2  # 2: annual rows only
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-256 of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _spec_hash(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def source_path(base_path, spec):
+    return base_path / "Data" / spec.get("folder", "data_raw") / spec["file"]
+
+
+def source_name(spec):
+    """
+    Readable identifier of one raw table (file, and sheet for Excel files).
+    """
+    return spec["file"] if "sheet_name" not in spec else f"{spec['file']}[{spec['sheet_name']}]"
+
+
+def load_country_codes(base_path, manual_country_codes, filename="country_codes_clean.csv"):
+    """
+    {country name: Country_code} from Data/SIG/country_codes_clean.csv, completed
+    (and overridden) by the manual mapping of config.py.
+    """
+    df_codes = pd.read_csv(base_path / "Data" / "SIG" / filename, keep_default_na=False, na_values=[""])
+    country_codes = dict(zip(df_codes['Country'], df_codes['Alpha-2 code']))
+    country_codes.update(manual_country_codes)
+    return country_codes
+
+
+def process_raw_source(base_path, spec, country_codes, unit="tC", excel_cache_dir=None):
+    """
+    Raw table (countries in columns, years in rows) -> long-format intermediate CSV.
+    Excel sheets are read through the sheet cache of `excel_cache_dir` (see excel_utils.py).
+
+    Retour
+    ------
+    (Path of the intermediate file, number of rows, countries without Country_code)
+    """
+    df = import_data_raw(source_path(base_path, spec), n_header=spec.get("n_header", 0),
+                         sheet_name=spec.get("sheet_name", 0), cache_dir=excel_cache_dir)
+    df = clean_year_column(df)  # first column = years
+    df = df.loc[:, ~df.columns.astype(str).str.startswith("Unnamed")]  # empty trailing columns
+
+    df_long = melt_long_format(df, id_vars=['Year'], var_name='Country', value_name='Value',
+                               source=spec["source"], unit=unit, category=spec["category"],
+                               indicator=spec["indicator"])
+    df_long['Value'] = pd.to_numeric(df_long['Value'], errors='coerce') * spec.get("factor", 1)
+    df_long['Country_code'] = df_long['Country'].map(country_codes)
+
+    unmatched = sorted(df_long.loc[df_long['Country_code'].isna(), 'Country'].dropna().unique())
+    save_path = save_long_dataframe(df_long, base_path, folder="data_intermediate", category=spec["category"],
+                                    indicator=spec["indicator"], source=spec["source"])
+    return save_path, int(df_long['Value'].notna().sum()), unmatched
+
+
+def _read_manifest(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def run_pipeline(base_path, raw_sources, country_codes, norm_specs=None, countries_filename="countries_area.csv",
+                 final_filename="data_final_all.csv", workers=None, force=False, unit="tC", excel_cache_dir=None):
+    """
+    Build the final dataset from the raw tables.
+
+    Sources whose file content (and settings) did not change since the last
+    run are skipped; the other ones are processed in a process pool. The
+    final files are rebuilt only if one of their inputs changed.
+    The app normalizes on request (norm_utils.py): the Value_norm_* columns
+    are only written, to a separate file, when `norm_specs` is given.
+
+    Paramètres
+    ----------
+    raw_sources : list of dict
+        Tables à traiter (voir config.raw_sources)
+    country_codes : dict
+        Nom de pays -> Country_code (voir load_country_codes)
+    norm_specs : dict, optionnel
+        Normalisations à matérialiser dans data_final_all_norm.csv (voir config.norm_specs)
+    workers : int, optionnel
+        Nombre de processus (par défaut : nombre de CPU)
+    force : bool, optionnel
+        Retraiter toutes les sources
+    excel_cache_dir : Path, optionnel
+        Cache des feuilles Excel converties (le classeur n'est relu que s'il a changé)
+
+    Retour
+    ------
+    dict with the processed / skipped sources and the final files written
+    """
+    intermediate_dir = base_path / "Data" / "data_intermediate"
+    intermediate_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = intermediate_dir / MANIFEST_NAME
+    manifest = {} if force else _read_manifest(manifest_path)
+    previous = manifest.get("sources", {})
+
+    # --- Content hashes (one per file, Excel sheets share their file hash) ---
+    input_hashes = {}
+    for spec in raw_sources:
+        path = source_path(base_path, spec)
+        if path not in input_hashes:
+            input_hashes[path] = file_hash(path)
+
+    sources, todo = {}, []
+    for spec in raw_sources:
+        name = source_name(spec)
+        key = _spec_hash(input_hashes[source_path(base_path, spec)], spec, unit, country_codes)
+        entry = previous.get(name)
+        if entry and entry.get("hash") == key and (intermediate_dir / entry["output"]).exists():
+            sources[name] = entry
+        else:
+            todo.append((name, key, spec))
+
+    # --- Raw -> intermediate, in parallel ---
+    report = {"processed": [], "skipped": sorted(sources), "unmatched": {}}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [(name, key, pool.submit(process_raw_source, base_path, spec, country_codes, unit,
+                                                    excel_cache_dir))
+                       for name, key, spec in todo]
+            for name, key, future in futures:
+                save_path, n_rows, unmatched = future.result()
+                sources[name] = {"hash": key, "output": save_path.name, "rows": n_rows}
+                report["processed"].append(name)
+                if unmatched:
+                    report["unmatched"][name] = unmatched
+
+    manifest["sources"] = {name: sources[name] for name in sorted(sources)}
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    # --- Intermediate -> final (only if one of its inputs changed) ---
+    outputs = sorted({entry["output"] for entry in sources.values()})
+    final_dir = base_path / "Data" / "data_final"
+    final_key = _spec_hash([file_hash(intermediate_dir / f) for f in outputs], FINAL_FORMAT)
+    report["final"] = []
+
+    if manifest.get("final", {}).get("hash") != final_key or not (final_dir / final_filename).exists():
+        # Streamed block by block to the CSV and the .feather: memory bounded by one block
+        final_path = concat_intermediate_files(base_path, final_filename=final_filename, streaming=True,
+                                               files=outputs, constants={'Type': 'Annual'}, columnar=True)
+        n_rows = feather.read_table(final_path.with_suffix(".feather"), columns=['Year']).num_rows
+
+        manifest["final"] = {"hash": final_key, "rows": n_rows}
+        report["final"].append(final_filename)
+
+    if norm_specs:
+        countries_path = base_path / "Data" / "countries" / countries_filename
+        norm_filename = final_filename.replace(".csv", "_norm.csv")
+        norm_key = _spec_hash(final_key, file_hash(countries_path), norm_specs)
+        if manifest.get("norm", {}).get("hash") != norm_key or not (final_dir / norm_filename).exists():
+            df_final = pd.read_csv(final_dir / final_filename)
+            df_all = add_cumulative(df_final.drop(columns='Type'), group_cols=['Category', 'Indicator', 'Source',
+                                                                               'Country_code'])
+            df_norm = normalize_frame(df_all, import_countries_data(base_path, countries_filename), norm_specs)
+            df_norm.to_csv(final_dir / norm_filename, index=False, encoding="utf-8")
+
+            manifest["norm"] = {"hash": norm_key, "rows": len(df_norm)}
+            report["final"].append(norm_filename)
+
+    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return report
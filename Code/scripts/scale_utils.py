@@ -0,0 +1,72 @@
+import numpy as np
+
+# Vectorized versions of the map scales ('absolute', 'relative', 'rank', 'log').
+# All functions work on NumPy arrays of any shape along the last axis, so a
+# whole year x country matrix is transformed in one call. NaN (no data) stays NaN.
+
+
+def symlog(x):
+    """
+    Symmetric log: sign(x) * log10(|x| + 1).
+    """
+    x = np.asarray(x, dtype=float)
+    return np.sign(x) * np.log10(np.abs(x) + 1)
+
+
+def rank(x):
+    """
+    Ascending rank along the last axis, ties get their average rank
+    (same as pandas rank(method='average')). NaN are not ranked.
+    """
+    x = np.asarray(x, dtype=float)
+    if x.size == 0:
+        return x.copy()
+    values = x.reshape(-1, x.shape[-1]) if x.ndim else x.reshape(1, 1)
+    n = values.shape[-1]
+
+    order = np.argsort(values, axis=-1, kind='mergesort')  # NaN sorted last
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+
+    positions = np.broadcast_to(np.arange(n), sorted_values.shape)
+    starts = np.ones(sorted_values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ends = np.ones(sorted_values.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+
+    # First and last position of the group of equal values of each element
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    last = np.minimum.accumulate(np.where(ends, positions, n)[:, ::-1], axis=-1)[:, ::-1]
+
+    sorted_ranks = (first + last) / 2 + 1
+    sorted_ranks[np.isnan(sorted_values)] = np.nan
+
+    ranks = np.empty_like(sorted_ranks)
+    np.put_along_axis(ranks, order, sorted_ranks, axis=-1)
+    return ranks.reshape(x.shape)
+
+
+def transform_values(values, scale, multiplier=1):
+    """
+    Values as plotted on the map for `scale`.
+
+    Paramètres
+    ----------
+    values : array-like
+        Valeurs par pays (1D) ou matrice année x pays (2D)
+    scale : str
+        'absolute', 'relative', 'rank' ou 'log'
+    multiplier : float or array-like
+        Diviseur d'unité (k/M/G) des échelles 'absolute' et 'relative',
+        un par ligne pour une matrice
+    """
+    values = np.asarray(values, dtype=float)
+    if scale in ('absolute', 'relative'):
+        multiplier = np.asarray(multiplier, dtype=float)
+        if values.ndim == 2 and multiplier.ndim == 1:
+            multiplier = multiplier[:, None]
+        return values / multiplier
+    if scale == 'rank':
+        return rank(values)
+    if scale == 'log':
+        return symlog(values)
+    raise ValueError("scale must be 'absolute', 'relative', 'rank', or 'log'")
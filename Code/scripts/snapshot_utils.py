@@ -0,0 +1,156 @@
+import hashlib
+import json
+import pickle
+import pandas as pd
+from data_utils import import_csv_data, import_data_sig, import_countries_data, import_country_groups
+from map_utils import build_geometry_levels, build_topojson
+from cube_utils import build_data_cube, build_color_stats, color_columns
+from aggregate_utils import (build_membership, build_norm_inputs, build_aggregates, load_aggregate_cache,
+                             write_aggregate_cache)
+from pipeline_utils import file_hash
+from config import (norm_map, norm_specs, scale_options, color_range_options, geom_lod_levels,
+                    geom_quantization, groups_filename, world_group, aggregate_ratio_columns)
+
+# Everything the app computes at startup (data store, color stats, dropdown
+# options and mappings, simplified TopoJSON geometry) is built once by
+# `build_data.py snapshot` and written to one pickle file, loaded by each
+# worker in a single read. The file starts with a small header holding the
+# hash of its inputs (data files + settings) and of its content.
+
+SNAPSHOT_FORMAT = 6  # 2: per-country index in the cube, 3: regional aggregates, 4: annual series only,
+                     # 5: per-country index without a copy of the matrices, 6: denominators of the stored norms
+AGGREGATE_CACHE_NAME = "aggregates_cache.pkl"
+
+
+def prepare_resources(base_path, filename="data_final_all.csv", countries_filename="countries_area.csv",
+                      geometry_filename="world.geojson"):
+    """
+    Load the data and the geometry and prepare everything the map callbacks need.
+
+    Retour
+    ------
+    dict with keys:
+    - 'cube' : data store with its color stats and regional aggregates
+      (see cube_utils.build_data_cube, aggregate_utils.build_aggregates)
+    - 'topojson_levels' : {tolerance: TopoJSON of the simplified geometry}
+    - 'countries' : pd.DataFrame (Country_code, name), in the geometry order
+    - 'options' : dropdown options {'indicator', 'database', 'category', 'year', 'grouping'}
+    """
+    df_data = import_csv_data(base_path, filename)
+    df_countries = import_countries_data(base_path, countries_filename)  # denominators of the normalizations
+    gdf_world = import_data_sig(base_path, geometry_filename)
+
+    # --- Simplify geometry (one level of detail per zoom range) ---
+    gdf_world = gdf_world[gdf_world['Country_code'].notna()].copy()
+    gdf_levels = build_geometry_levels(gdf_world, [tol for _, tol in geom_lod_levels])
+    topojson_levels = {tol: build_topojson(gdf, id_col='Country_code', quantization=geom_quantization)
+                       for tol, gdf in gdf_levels.items()}
+
+    # --- Indexed data store ---
+    cube = build_data_cube(df_data, norm_map, df_countries, norm_specs)
+    cube['color_stats'] = build_color_stats(cube, scale_options, color_range_options, gdf_world['Country_code'])
+    cube['color_columns'] = color_columns(cube, gdf_world['Country_code'])  # stats of other cumulative start years
+
+    # --- Regional aggregates (only the selections whose inputs changed are recomputed) ---
+    groups_path = base_path / "Data" / "countries" / groups_filename
+    df_groups = import_country_groups(base_path, groups_filename) if groups_path.exists() else \
+        pd.DataFrame(columns=['Grouping', 'Group', 'Country_code'])
+    membership = build_membership(df_groups, cube['countries'], world_group)
+    shown_specs = {name: spec for name, spec in norm_specs.items() if spec[0]}  # the ones of norm_map
+    norm_inputs = build_norm_inputs(df_countries, shown_specs, aggregate_ratio_columns, cube['countries'], cube['years'])
+    cache_path = base_path / "Data" / "data_final" / AGGREGATE_CACHE_NAME
+    cube['aggregates'], aggregate_cache = build_aggregates(cube, membership, norm_inputs, load_aggregate_cache(cache_path))
+    try:
+        write_aggregate_cache(aggregate_cache, cache_path)
+    except OSError:
+        pass  # read-only deployment: recomputed next time
+
+    return {
+        'cube': cube,
+        'topojson_levels': topojson_levels,
+        'countries': pd.DataFrame(gdf_world[['Country_code', 'name']]).drop_duplicates('Country_code'),
+        'options': {
+            'indicator': list(df_data['Indicator'].unique()),
+            'database': list(df_data['Source'].unique()),
+            'category': list(df_data['Category'].unique()),
+            'year': [int(y) for y in sorted(df_data['Year'].unique())],
+            'grouping': list(membership['groupings']),
+        },
+    }
+
+
+def load_or_prepare_resources(base_path, snapshot_filename):
+    """
+    Resources of the snapshot if it was built from the current inputs,
+    otherwise prepared from the data files (see prepare_resources).
+    """
+    try:
+        inputs_key = snapshot_inputs_key(base_path)
+    except OSError:
+        inputs_key = None  # input files not deployed: trust the snapshot
+    resources = load_snapshot(base_path / "Data" / "data_final" / snapshot_filename, inputs_key)
+    return prepare_resources(base_path) if resources is None else resources
+
+
+def snapshot_inputs_key(base_path, filename="data_final_all.csv", countries_filename="countries_area.csv",
+                        geometry_filename="world.geojson"):
+    """
+    Hash of the input files and of the settings the snapshot depends on.
+    """
+    data_path = base_path / "Data" / "data_final" / filename
+    if not data_path.exists():
+        data_path = data_path.with_suffix(".feather")
+    paths = [data_path,
+             base_path / "Data" / "countries" / countries_filename,
+             base_path / "Data" / "SIG" / geometry_filename]
+    groups_path = base_path / "Data" / "countries" / groups_filename
+    paths += [groups_path] if groups_path.exists() else []
+    settings = [SNAPSHOT_FORMAT, norm_map, norm_specs, scale_options, color_range_options,
+                geom_lod_levels, geom_quantization, world_group, aggregate_ratio_columns]
+    parts = [file_hash(path) for path in paths] + [settings]
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()
+
+
+def write_snapshot(resources, path, inputs_key):
+    """
+    Write the output of `prepare_resources` to `path`.
+
+    Retour
+    ------
+    Content hash of the snapshot (first 16 characters)
+    """
+    payload = pickle.dumps(resources, protocol=pickle.HIGHEST_PROTOCOL)
+    header = {'format': SNAPSHOT_FORMAT, 'inputs': inputs_key,
+              'hash': hashlib.sha256(payload).hexdigest()[:16], 'size': len(payload)}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.write(payload)
+    tmp_path.replace(path)  # workers never read a half-written file
+    return header['hash']
+
+
+def load_snapshot(path, inputs_key=None):
+    """
+    Resources of a snapshot written by `write_snapshot`.
+
+    Returns None if the file is missing, of another format, corrupted, or
+    built from other inputs than `inputs_key` (when given).
+    """
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header.get('format') != SNAPSHOT_FORMAT:
+                return None
+            if inputs_key is not None and header.get('inputs') != inputs_key:
+                print(f"Snapshot {path} obsolète (données modifiées depuis sa création)")
+                return None
+            payload = f.read()
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if len(payload) != header.get('size') or hashlib.sha256(payload).hexdigest()[:16] != header.get('hash'):
+        print(f"Snapshot {path} corrompu")
+        return None
+    return pickle.loads(payload)
@@ -0,0 +1,88 @@
+import os
+import threading
+import traceback
+
+# Data and geometry are loaded by a `load()` function returning the resources
+# of the app. 'lazy' startup runs it in a background thread so the layout is
+# served (and health checks answer) immediately; 'eager' runs it at import,
+# e.g. once in the gunicorn master with --preload, the workers then share
+# the loaded arrays copy-on-write.
+
+
+class BackgroundLoader:
+    """
+    Runs `load()` once per process and keeps its result.
+
+    Paramètres
+    ----------
+    load : callable
+        Fonction sans argument qui charge les ressources
+    background : bool, optionnel
+        True : chargement dans un thread (démarrage 'lazy'),
+        False : chargement immédiat, bloquant (démarrage 'eager')
+    """
+
+    def __init__(self, load, background=True):
+        self._load = load
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._pid = None
+        self._result = None
+        self._error = None
+        if background:
+            self.start()
+        else:
+            self._pid = os.getpid()
+            self._run()
+
+    def start(self):
+        """
+        Start loading in a background thread (no-op if already started in this process).
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive a fork: a process forked while loading starts
+            # its own load (best effort, locks held by the loading thread at fork
+            # time can block it: with gunicorn --preload, use the 'eager' mode)
+            self._pid = os.getpid()
+            self._done = threading.Event()
+            self._result, self._error = None, None
+            threading.Thread(target=self._run, name="netzero-loader", daemon=True).start()
+
+    def _run(self):
+        try:
+            self._result = self._load()
+        except Exception as error:
+            self._error = error
+            traceback.print_exc()
+        finally:
+            self._done.set()
+
+    def ready(self):
+        """
+        True once the resources are loaded (False while loading or if loading failed).
+        """
+        if self._pid != os.getpid() and not self._done.is_set():
+            self.start()
+        return self._done.is_set() and self._error is None
+
+    def status(self):
+        """
+        'loading', 'ready' or 'error'.
+        """
+        if not self.ready():
+            return 'error' if self._done.is_set() else 'loading'
+        return 'ready'
+
+    def get(self, timeout=None):
+        """
+        Loaded resources, waiting at most `timeout` seconds (None = until loaded).
+        Raises TimeoutError if still loading, RuntimeError if loading failed.
+        """
+        self.ready()
+        if not self._done.wait(timeout):
+            raise TimeoutError("resources are still loading")
+        if self._error is not None:
+            raise RuntimeError("resources failed to load") from self._error
+        return self._result
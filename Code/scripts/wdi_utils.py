@@ -0,0 +1,156 @@
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Country x year denominators of the normalizations (Data/countries/countries_area.csv)
+# from the World Bank WDI API. Pages are fetched concurrently through one
+# bounded connection pool and every page is kept on disk as soon as it is
+# received: a failed run restarts from the pages it is missing.
+
+WDI_BASE = "https://api.worldbank.org/v2"
+
+
+def page_cache_path(cache_dir, indicator, page, params):
+    """
+    On-disk cache file of one page of one indicator (the query parameters are part of the key).
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+    return cache_dir / indicator / f"page_{page:04d}_{digest}.json"
+
+
+def fetch_page(session, base_url, indicator, page, params, cache_dir=None, retries=3, timeout=60, max_age=None):
+    """
+    One page of an indicator: [meta, records] as returned by the API.
+
+    Paramètres
+    ----------
+    session : requests.Session
+        Session partagée (pool de connexions)
+    params : dict
+        Paramètres de la requête, sans 'page'
+    cache_dir : Path, optionnel
+        Dossier du cache des réponses (None : pas de cache)
+    retries : int
+        Nouvelles tentatives en cas d'erreur réseau ou HTTP 429 / 5xx (attente croissante)
+    max_age : float, optionnel
+        Âge maximal d'une page en cache, en secondes (None : toujours valable)
+    """
+    path = page_cache_path(cache_dir, indicator, page, params) if cache_dir else None
+    if path is not None and path.exists() and (max_age is None or time.time() - path.stat().st_mtime < max_age):
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except ValueError:
+            pass  # truncated file: fetched again
+
+    url = f"{base_url}/country/all/indicator/{indicator}"
+    for attempt in range(retries + 1):
+        try:
+            r = session.get(url, params={**params, "page": page}, timeout=timeout)
+            if r.status_code == 429 or r.status_code >= 500:
+                raise requests.HTTPError(f"HTTP {r.status_code}", response=r)
+            if r.status_code != 200:
+                raise RuntimeError(f"Erreur HTTP {r.status_code} pour {indicator} page {page}")
+            data = r.json()
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.HTTPError, ValueError) as error:
+            if attempt == retries:
+                raise RuntimeError(f"Échec de {indicator} page {page} après {retries + 1} essais : {error}") from error
+            time.sleep(0.5 * 2 ** attempt)
+
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        tmp_path.replace(path)  # a page is either complete on disk or absent
+    return data
+
+
+def _records(data):
+    if not isinstance(data, list) or len(data) < 2 or not data[1]:
+        return []
+    return [(item["country"]["id"], item["country"]["value"], int(item["date"]),
+             np.nan if item["value"] is None else float(item["value"])) for item in data[1]]
+
+
+def fetch_indicators(indicators, first_year, last_year, base_url=WDI_BASE, per_page=1000, workers=8,
+                     cache_dir=None, retries=3, timeout=60, max_age=None):
+    """
+    Download WDI indicators, all pages in parallel.
+
+    Paramètres
+    ----------
+    indicators : dict
+        Code WDI -> nom de colonne (voir config.wdi_indicators)
+    workers : int
+        Nombre de requêtes simultanées (et taille du pool de connexions)
+
+    Retour
+    ------
+    pd.DataFrame in long format: countryiso3, country, Year, column, value
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    params = {"format": "json", "per_page": per_page, "date": f"{first_year}:{last_year}"}
+
+    def fetch(indicator, page):
+        return fetch_page(session, base_url, indicator, page, params, cache_dir, retries, timeout, max_age)
+
+    pages = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # --- First page of every indicator: number of pages ---
+        futures = {(code, 1): pool.submit(fetch, code, 1) for code in indicators}
+        wait(futures.values())
+        for code in indicators:
+            if futures[(code, 1)].exception() is not None:
+                continue  # reported below with the other failed pages
+            data = futures[(code, 1)].result()
+            n_pages = int(data[0].get("pages", 1)) if isinstance(data, list) and data else 1
+            futures.update({(code, page): pool.submit(fetch, code, page) for page in range(2, n_pages + 1)})
+
+        # --- Other pages; on error, the pages already received stay in the cache ---
+        wait(futures.values())
+        errors = [f"{code} page {page}: {future.exception()}" for (code, page), future in futures.items()
+                  if future.exception() is not None]
+        if errors:
+            raise RuntimeError(f"{len(errors)} page(s) en échec (relancer pour reprendre) :\n" + "\n".join(errors))
+        for key, future in futures.items():
+            pages[key] = future.result()
+    session.close()
+
+    frames = []
+    for (code, _), data in sorted(pages.items()):
+        df = pd.DataFrame(_records(data), columns=['countryiso3', 'country', 'Year', 'value'])
+        df['column'] = indicators[code]
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_countries_table(df_long, columns, first_year, last_year):
+    """
+    Country x year table of countries_area.csv: one column per indicator,
+    a missing_<column> flag for each, and the derived columns.
+    """
+    df = df_long.drop_duplicates(['countryiso3', 'Year', 'column'], keep='last')
+    wide = df.pivot(index=['countryiso3', 'Year'], columns='column', values='value')
+    names = df.drop_duplicates('countryiso3', keep='last').set_index('countryiso3')['country']
+
+    # --- Every country x every year, as in the notebook export ---
+    index = pd.MultiIndex.from_product([names.index, range(first_year, last_year + 1)], names=['countryiso3', 'Year'])
+    table = wide.reindex(index=index, columns=columns).reset_index()
+    table.insert(2, 'country', table['countryiso3'].map(names))
+    for col in columns:
+        table[f"missing_{col}"] = table[col].isna()
+
+    if 'gdp_ppp_current_intl' in table and 'population_total' in table:
+        table['gdp_ppp_percapita_calc'] = table['gdp_ppp_current_intl'] / table['population_total']
+    if 'population_total' in table and 'surface_km2' in table:
+        table['population_density'] = table['population_total'] / table['surface_km2']
+    table.loc[table['country'] == "Namibia", 'countryiso3'] = "NAM"  # 'NA' would be read as missing
+    return table.sort_values(['countryiso3', 'Year']).reset_index(drop=True)
@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from cube_utils import build_data_cube, cube_matrix, country_series  # noqa: E402
+from norm_utils import normalize_frame  # noqa: E402
+
+# Cumulative type of the normalizations materialized in the final file
+# (pipeline --norm-columns): running totals of 'Value' / denominator of the year.
+
+NORM_SPECS = {'population': ('Population', 'population_total', 1, '/hab')}
+NORM_MAP = {'No norm': ('Value', 'Unit'), 'Population': ('Value_norm_population', 'Unit_norm_population')}
+COUNTRIES = ["DE", "FR"]  # order of the country axis of the cube
+YEARS = [2000, 2001, 2002, 2003]
+
+
+def make_inputs():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame([dict(Category="Fossil Fuel", Indicator="Territorial", Source="GCB", Type="Annual",
+                            Country_code=code, Year=year, Value=rng.uniform(1, 100), Unit="tC")
+                       for code in COUNTRIES for year in YEARS])
+    df.loc[1, 'Value'] = np.nan  # missing year: skipped by the running total
+    df_countries = pd.DataFrame([dict(countryiso3=code, Year=year, population_total=rng.uniform(1, 10))
+                                 for code in COUNTRIES for year in YEARS])
+    return normalize_frame(df, df_countries, NORM_SPECS), df_countries
+
+
+def test_cumulative_of_materialized_norm():
+    df, df_countries = make_inputs()
+    cube = build_data_cube(df, NORM_MAP, df_countries, NORM_SPECS)
+    assert 'Value_norm_population' in cube['matrices'][("Fossil Fuel", "Territorial", "GCB", "Annual")]
+
+    key = ("Fossil Fuel", "Territorial", "GCB", "Cumulative")
+    totals = cube_matrix(cube, key, 'Value')
+    population = df_countries.pivot(index='Year', columns='countryiso3', values='population_total')[COUNTRIES]
+    expected = totals / population.to_numpy()
+    np.testing.assert_allclose(cube_matrix(cube, key, 'Value_norm_population'), expected)
+    assert np.isnan(expected[1, 0]) and not np.isnan(expected[2, 0])
+
+    series = country_series(cube, "DE", "Fossil Fuel", "Territorial", "Cumulative", 'Value_norm_population')
+    np.testing.assert_allclose(series["GCB"], expected[:, 0])
@@ -0,0 +1,58 @@
+import base64
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from cube_utils import build_data_cube  # noqa: E402
+from aggregate_utils import build_membership, build_aggregates  # noqa: E402
+from callbacks import build_map_state, build_map_update  # noqa: E402
+
+# build_map_update on a small cube: 12 countries in 3 regions (4 countries
+# each), plus one country in no region.
+
+NORM_MAP = {'No norm': ('Value', 'Unit')}
+COUNTRIES = [f"C{i:02d}" for i in range(13)]
+YEARS = [2000, 2001, 2002]
+
+
+@pytest.fixture(scope="module")
+def state():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame([dict(Category="Fossil Fuel", Indicator="Territorial", Source="GCB", Type="Annual",
+                            Country_code=code, Year=year, Value=rng.uniform(1, 1e6), Unit="tC")
+                       for code in COUNTRIES for year in YEARS])
+    cube = build_data_cube(df, NORM_MAP)
+    df_groups = pd.DataFrame(dict(Grouping="Continent", Group=[f"R{i // 4}" for i in range(12)],
+                                  Country_code=COUNTRIES[:12]))
+    cube['aggregates'], _ = build_aggregates(cube, build_membership(df_groups, cube['countries'], None), {})
+    countries = pd.DataFrame(dict(Country_code=COUNTRIES, name=COUNTRIES))
+    return build_map_state({'cube': cube, 'topojson_levels': {}, 'countries': countries})
+
+
+def decode(values):
+    return np.frombuffer(base64.b64decode(values['bdata']), dtype='<f4').astype(float)
+
+
+@pytest.mark.parametrize("scale", ['absolute', 'relative', 'rank', 'log'])
+@pytest.mark.parametrize("type_value", ['Annual', 'Cumulative'])
+def test_grouped_values_within_color_range(state, scale, type_value):
+    update = build_map_update(state, NORM_MAP, "Fossil Fuel", "Territorial", "GCB", type_value, 2001, scale, 'raw',
+                              'No norm', aggregate="Continent")
+    trace = update['trace']
+    z = decode(trace['z'])
+    assert np.isnan(z[-1]) and not np.isnan(z[:-1]).any()
+    assert trace['zmin'] - 1e-3 <= np.nanmin(z) and np.nanmax(z) <= trace['zmax'] + 1e-3
+    # Every country shows the value of its region
+    assert len(set(z[:-1])) == 3 and all(len(set(z[i:i + 4])) == 1 for i in range(0, 12, 4))
+
+
+def test_grouped_rank_is_rank_of_groups(state):
+    trace = build_map_update(state, NORM_MAP, "Fossil Fuel", "Territorial", "GCB", "Annual", 2001, 'rank', 'raw',
+                             'No norm', aggregate="Continent")['trace']
+    assert (trace['zmin'], trace['zmax']) == (1, 3)
+    assert sorted(set(decode(trace['z'])[:-1])) == [1, 2, 3]
@@ -0,0 +1,129 @@
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "scripts"))
+
+from wdi_utils import fetch_indicators, build_countries_table  # noqa: E402
+
+# fetch_indicators against a local stand-in of the WDI API: paginated
+# [meta, records] JSON, a short delay per request to make them overlap, and
+# 500 errors on chosen pages.
+
+INDICATORS = {"SP.POP.TOTL": "population_total", "AG.LND.TOTL.K2": "surface_km2"}
+COUNTRIES = ["FRA", "DEU", "NA", "USA", "CHN"]
+FIRST_YEAR, LAST_YEAR = 2000, 2009
+PER_PAGE = 7  # 50 records per indicator -> 8 pages
+
+
+class StandIn:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.failing = set()  # (indicator, page) answered with HTTP 500
+
+
+@pytest.fixture
+def wdi_server():
+    state = StandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            indicator = url.path.rsplit("/", 1)[1]
+            page, per_page = int(query["page"][0]), int(query["per_page"][0])
+            first, last = map(int, query["date"][0].split(":"))
+            with state.lock:
+                state.requests.append((indicator, page))
+                state.active += 1
+                state.max_active = max(state.max_active, state.active)
+            time.sleep(0.02)
+            with state.lock:
+                state.active -= 1
+
+            if (indicator, page) in state.failing:
+                body, status = b"error", 500
+            else:
+                rows = [(code, year) for code in COUNTRIES for year in range(last, first - 1, -1)]
+                chunk = rows[(page - 1) * per_page:page * per_page]
+                records = [{"country": {"id": code, "value": "Namibia" if code == "NA" else f"Country {code}"},
+                            "date": str(year), "value": None if year == first else float(year)}
+                           for code, year in chunk]
+                meta = {"page": page, "pages": -(-len(rows) // per_page), "per_page": per_page, "total": len(rows)}
+                body, status = json.dumps([meta, records]).encode("utf-8"), 200
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    state.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(state, cache_dir, workers=3):
+    return fetch_indicators(INDICATORS, FIRST_YEAR, LAST_YEAR, base_url=state.base_url, per_page=PER_PAGE,
+                            workers=workers, cache_dir=cache_dir, retries=0, timeout=10)
+
+
+def test_bounded_pool(wdi_server, tmp_path):
+    df = fetch(wdi_server, tmp_path, workers=3)
+    assert len(wdi_server.requests) == 16  # 2 indicators x 8 pages
+    assert 1 < wdi_server.max_active <= 3
+    assert len(df) == len(INDICATORS) * len(COUNTRIES) * (LAST_YEAR - FIRST_YEAR + 1)
+
+
+def test_second_run_from_cache(wdi_server, tmp_path):
+    first = fetch(wdi_server, tmp_path)
+    n_requests = len(wdi_server.requests)
+    second = fetch(wdi_server, tmp_path)
+    assert len(wdi_server.requests) == n_requests
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_resume_after_failure(wdi_server, tmp_path):
+    wdi_server.failing = {("SP.POP.TOTL", 3), ("AG.LND.TOTL.K2", 1)}
+    with pytest.raises(RuntimeError, match="2 page"):
+        fetch(wdi_server, tmp_path)
+    done = set(wdi_server.requests) - wdi_server.failing
+
+    wdi_server.failing = set()
+    wdi_server.requests.clear()
+    fetch(wdi_server, tmp_path)
+    # Only the failed pages, and the pages of the indicator whose first page failed
+    assert not set(wdi_server.requests) & done
+    assert set(wdi_server.requests) == {("SP.POP.TOTL", 3)} | {("AG.LND.TOTL.K2", p) for p in range(1, 9)}
+
+
+def test_countries_table_columns(wdi_server, tmp_path):
+    columns = ["population_total", "gdp_current_usd", "gdp_percapita_current_usd", "gdp_ppp_current_intl",
+               "gdp_percapita_ppp_current_intl", "surface_km2"]
+    df = fetch(wdi_server, tmp_path)
+    table = build_countries_table(df, columns, FIRST_YEAR, LAST_YEAR)
+
+    countries_area = Path(__file__).resolve().parents[2] / "Data" / "countries" / "countries_area.csv"
+    expected = list(pd.read_csv(countries_area, nrows=0).columns)
+    assert list(table.columns) == expected
+    assert len(table) == len(COUNTRIES) * (LAST_YEAR - FIRST_YEAR + 1)
+    assert "NAM" in set(table['countryiso3']) and "NA" not in set(table['countryiso3'])
+    assert table['missing_population_total'].sum() == len(COUNTRIES)  # first year: value None
+    assert table['missing_gdp_current_usd'].all()